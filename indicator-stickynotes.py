@@ -17,10 +17,18 @@
 # You should have received a copy of the GNU General Public License along with
 # indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
 
-from stickynotes.backend import Note, NoteSet
+from stickynotes.backend import Note, NoteSet, Selection
 from stickynotes.gui import *
 import stickynotes.info
-from stickynotes.info import MO_DIR, LOCALE_DOMAIN
+import stickynotes.transfer
+import stickynotes.sync
+from stickynotes.snapshots import SnapshotStore
+from stickynotes.thumbnails import ThumbnailCache
+from stickynotes.dbusapi import DBusService, call_running
+from stickynotes import layout, metrics
+from stickynotes.info import MO_DIR, LOCALE_DOMAIN, SAVE_DELAY_MS, \
+        REMINDER_POLL_SECONDS, CAPTURE_MAX_BYTES, THUMBNAIL_DIR, \
+        THUMBNAIL_SIZE, THUMBNAIL_CACHE_BYTES, SNAPSHOT_RETENTION_DAYS
 
 import gi
 gi.require_version('Gtk', '3.0')
@@ -31,17 +39,24 @@ try:
 except (ValueError, ImportError):
     gi.require_version('AppIndicator3', '0.1')
     from gi.repository import AppIndicator3 as appindicator
-from gi.repository import Gtk, Gdk
+from gi.repository import Gtk, Gdk, Gio, GLib
 
+from collections import deque
+from datetime import datetime
 import os.path
 import locale
 import argparse
+import logging
+import signal
 from locale import gettext as _
 from functools import wraps
-from shutil import copyfile, SameFileError
 
 import socket
 import sys
+import threading
+
+# Number of imported batches that may wait for the main loop at a time
+IMPORT_QUEUE_DEPTH = 2
 
 def save_required(f):
     """Wrapper for functions that require a save after execution"""
@@ -59,6 +74,18 @@ class IndicatorStickyNotes:
         isdev = args and args.d
         self.data_file = stickynotes.info.DEBUG_SETTINGS_FILE if isdev \
                 else stickynotes.info.SETTINGS_FILE
+        if args and args.data_file:
+            self.data_file = args.data_file
+        self.save_source = None
+        self.reminder_source = None
+        self.sync_server = None
+        self.snapshot_busy = False
+        self.dbus = None
+        # Captured notes whose windows are still to be built
+        self.captured = deque()
+        self.capture_source = None
+        self.thumbnails = ThumbnailCache(os.path.expanduser(THUMBNAIL_DIR),
+                THUMBNAIL_SIZE, THUMBNAIL_CACHE_BYTES)
         # Initialize NoteSet
         self.nset = NoteSet(StickyNote, self.data_file, self)
         try:
@@ -80,8 +107,20 @@ class IndicatorStickyNotes:
             winError.destroy()
             self.nset.load_fresh()
 
-        # If all notes were visible previously, show them now
-        if self.nset.properties.get("all_visible", True):
+        self.snapshots = SnapshotStore(os.path.expanduser(self.data_file) +
+                stickynotes.info.SNAPSHOT_DIR_SUFFIX)
+
+        # Encrypted notes are only decrypted as their windows are built,
+        # but the key is asked for once, up front
+        if self.nset.needs_unlock():
+            unlock_noteset(self.nset)
+
+        # Show the notes of the last visibility profile, or all notes if
+        # they were all visible
+        if self.nset.properties.get("profile") in \
+                self.nset.properties.get("profiles", {}):
+            self.nset.apply_profile(self.nset.properties["profile"])
+        elif self.nset.properties.get("all_visible", True):
             self.nset.showall()
         # Create App Indicator
         self.ind = appindicator.Indicator.new(
@@ -100,6 +139,17 @@ class IndicatorStickyNotes:
         self.mNewNote.connect("activate", self.new_note, None)
         self.mNewNote.show()
 
+        self.mCapture = Gtk.MenuItem(label=_("New Note from Clipboard"))
+        self.menu.append(self.mCapture)
+        self.mCapture.connect("activate", self.capture, "clipboard")
+        self.mCapture.show()
+
+        self.mCapturePrimary = Gtk.MenuItem(
+                label=_("New Note from Selection"))
+        self.menu.append(self.mCapturePrimary)
+        self.mCapturePrimary.connect("activate", self.capture, "primary")
+        self.mCapturePrimary.show()
+
         s = Gtk.SeparatorMenuItem.new()
         self.menu.append(s)
         s.show()
@@ -114,6 +164,32 @@ class IndicatorStickyNotes:
         self.mHideAll.connect("activate", self.hideall, None)
         self.mHideAll.show()
 
+        self.mNotebooks = Gtk.MenuItem(label=_("Notebooks"))
+        self.menu.append(self.mNotebooks)
+        self.mNotebooks.show()
+        self.populate_notebooks_menu()
+
+        self.mTags = Gtk.MenuItem(label=_("Tags"))
+        self.menu.append(self.mTags)
+        self.mTags.show()
+        self.tags_version = None
+        self.populate_tags_menu()
+
+        self.mProfiles = Gtk.MenuItem(label=_("Profiles"))
+        self.menu.append(self.mProfiles)
+        self.mProfiles.show()
+        self.populate_profiles_menu()
+
+        self.mTidy = Gtk.MenuItem(label=_("Tidy Up Notes"))
+        self.menu.append(self.mTidy)
+        self.mTidy.connect("activate", self.tidy, None)
+        self.mTidy.show()
+
+        self.mCascade = Gtk.MenuItem(label=_("Cascade Notes"))
+        self.menu.append(self.mCascade)
+        self.mCascade.connect("activate", self.cascade, None)
+        self.mCascade.show()
+
         s = Gtk.SeparatorMenuItem.new()
         self.menu.append(s)
         s.show()
@@ -128,6 +204,11 @@ class IndicatorStickyNotes:
         self.mUnlockAll.connect("activate", self.unlockall, None)
         self.mUnlockAll.show()
 
+        self.mBulk = Gtk.MenuItem(label=_("Bulk Actions..."))
+        self.menu.append(self.mBulk)
+        self.mBulk.connect("activate", self.show_bulk, None)
+        self.mBulk.show()
+
         s = Gtk.SeparatorMenuItem.new()
         self.menu.append(s)
         s.show()
@@ -142,6 +223,16 @@ class IndicatorStickyNotes:
         self.mImport.connect("activate", self.import_datafile, None)
         self.mImport.show()
 
+        self.mSyncNow = Gtk.MenuItem(label=_("Sync Now"))
+        self.menu.append(self.mSyncNow)
+        self.mSyncNow.connect("activate", self.sync_now, None)
+        self.mSyncNow.show()
+
+        self.mSyncSettings = Gtk.MenuItem(label=_("Sync Settings..."))
+        self.menu.append(self.mSyncSettings)
+        self.mSyncSettings.connect("activate", self.show_sync_settings, None)
+        self.mSyncSettings.show()
+
         s = Gtk.SeparatorMenuItem.new()
         self.menu.append(s)
         s.show()
@@ -151,6 +242,11 @@ class IndicatorStickyNotes:
         self.mArchive.connect("activate", self.show_archive, None)
         self.mArchive.show()
 
+        self.mSnapshots = Gtk.MenuItem(label=_("Snapshots..."))
+        self.menu.append(self.mSnapshots)
+        self.mSnapshots.connect("activate", self.show_snapshots, None)
+        self.mSnapshots.show()
+
         s = Gtk.SeparatorMenuItem.new()
         self.menu.append(s)
         s.show()
@@ -165,6 +261,11 @@ class IndicatorStickyNotes:
         self.mSettings.connect("activate", self.show_settings, None)
         self.mSettings.show()
 
+        self.mEncryption = Gtk.MenuItem(label=_("Encryption..."))
+        self.menu.append(self.mEncryption)
+        self.mEncryption.connect("activate", self.show_encryption, None)
+        self.mEncryption.show()
+
         s = Gtk.SeparatorMenuItem.new()
         self.menu.append(s)
         s.show()
@@ -179,16 +280,187 @@ class IndicatorStickyNotes:
         # Define secondary action (middle click)
         self.connect_secondary_activate()
 
+        # Catch up on reminders that fell due while we weren't running
+        self.schedule_reminders()
+        self.update_sync()
+        GLib.timeout_add_seconds(stickynotes.info.SNAPSHOT_INTERVAL_SECONDS,
+                self.take_snapshot)
+        # Benchmark runs create many indicators; none needs the bus
+        if not (args and args.benchmark):
+            self.dbus = DBusService(self)
+
     def new_note(self, *args):
-        self.nset.new()
+        self.nset.new(area=work_areas()[0])
+
+    def capture(self, widget, source):
+        """Creates a note from the clipboard or, if source is "primary",
+        the primary selection"""
+        clipboard = Gtk.Clipboard.get(Gdk.SELECTION_PRIMARY
+                if source == "primary" else Gdk.SELECTION_CLIPBOARD)
+        clipboard.request_text(lambda clipboard, text:
+                self.capture_text(text))
+
+    def capture_text(self, text):
+        """Creates a note holding text. The note is saved with the next
+        scheduled save, and its window is built once the main loop is
+        idle, so captures in quick succession stay cheap."""
+        if not text or not text.strip():
+            return
+        self.captured.append(self.nset.new(area=work_areas()[0], body=text,
+            show=False))
+        if self.capture_source is None:
+            self.capture_source = GLib.idle_add(self._show_captured)
+        self.schedule_save()
+
+    def capture_files(self, uris):
+        """Creates a note from each file: its text, if it is a small text
+        file, or else its URI. Files are read in a worker thread."""
+        def _read():
+            for uri in uris:
+                text = uri
+                path = Gio.File.new_for_uri(uri).get_path()
+                try:
+                    if path and os.path.getsize(path) <= CAPTURE_MAX_BYTES:
+                        with open(path, encoding="utf-8") as fsock:
+                            text = fsock.read()
+                except (OSError, UnicodeDecodeError):
+                    pass
+                GLib.idle_add(self.capture_text, text)
+        threading.Thread(target=_read, daemon=True).start()
+
+    def _show_captured(self):
+        """Builds the window of one captured note per main loop
+        iteration"""
+        while self.captured:
+            note = self.captured.popleft()
+            # It may have been archived before its window was built
+            if note.gui == None and note in self.nset.notes:
+                note.reveal()
+                return True
+        self.capture_source = None
+        return False
 
     def showall(self, *args):
         self.nset.showall(*args)
-        self.connect_secondary_activate()
+        self.visibility_changed()
 
     def hideall(self, *args):
         self.nset.hideall()
+        self.visibility_changed()
+
+    def populate_notebooks_menu(self):
+        """(Re)builds the submenu listing notebooks"""
+        submenu = Gtk.Menu()
+        for name in self.nset.properties.get("notebooks", []):
+            mitem = Gtk.CheckMenuItem.new_with_label(name)
+            mitem.set_active(name in self.nset.open_notebooks)
+            mitem.connect("toggled", self.toggle_notebook, name)
+            submenu.append(mitem)
+        if self.nset.properties.get("notebooks"):
+            submenu.append(Gtk.SeparatorMenuItem.new())
+        mnew = Gtk.MenuItem(label=_("New Notebook..."))
+        mnew.connect("activate", self.new_notebook)
+        submenu.append(mnew)
+        submenu.show_all()
+        self.mNotebooks.set_submenu(submenu)
+
+    def populate_tags_menu(self):
+        """(Re)builds the submenu of tags, if the set of tags changed"""
+        if self.tags_version == self.nset.tags.version:
+            return
+        self.tags_version = self.nset.tags.version
+        submenu = Gtk.Menu()
+        for tag in self.nset.tags.tags():
+            mtag = Gtk.MenuItem(label="#" + tag)
+            tagmenu = Gtk.Menu()
+            mshow = Gtk.MenuItem(label=_("Show Only These"))
+            mshow.connect("activate", self.filter_by_tag, tag, True)
+            tagmenu.append(mshow)
+            mhide = Gtk.MenuItem(label=_("Hide All Others"))
+            mhide.connect("activate", self.filter_by_tag, tag, False)
+            tagmenu.append(mhide)
+            mtag.set_submenu(tagmenu)
+            submenu.append(mtag)
+        if not self.nset.tags.tags():
+            mnone = Gtk.MenuItem(label=_("No tags"))
+            mnone.set_sensitive(False)
+            submenu.append(mnone)
+        submenu.show_all()
+        self.mTags.set_submenu(submenu)
+
+    def filter_by_tag(self, widget, tag, reveal):
+        self.nset.filter_by_tag(tag, reveal)
+        self.visibility_changed()
+
+    def toggle_notebook(self, widget, name):
+        """Opens or closes a notebook"""
+        if widget.get_active():
+            self.nset.open_notebook(name,
+                    show=self.nset.properties.get("all_visible", True))
+        else:
+            self.nset.close_notebook(name)
+        self.notebooks_changed()
+
+    def new_notebook(self, *args):
+        name = ask_name(_("New Notebook"), _("Name of the new notebook:"))
+        if name is not None:
+            self.nset.open_notebook(name)
+            self.notebooks_changed()
+
+    def populate_profiles_menu(self):
+        """(Re)builds the submenu of visibility profiles"""
+        submenu = Gtk.Menu()
+        current = self.nset.properties.get("profile")
+        profiles = sorted(self.nset.properties.get("profiles", {}))
+        for name in profiles:
+            mitem = Gtk.CheckMenuItem.new_with_label(name)
+            mitem.set_active(name == current)
+            mitem.connect("activate", self.apply_profile, name)
+            submenu.append(mitem)
+        if profiles:
+            submenu.append(Gtk.SeparatorMenuItem.new())
+        msave = Gtk.MenuItem(label=_("Save Current Layout..."))
+        msave.connect("activate", self.save_profile)
+        submenu.append(msave)
+        mdelete = Gtk.MenuItem(label=_("Delete Current Profile"))
+        mdelete.set_sensitive(current is not None)
+        mdelete.connect("activate", self.delete_profile)
+        submenu.append(mdelete)
+        submenu.show_all()
+        self.mProfiles.set_submenu(submenu)
+
+    def apply_profile(self, widget, name):
+        """Shows only the notes of a visibility profile, where it has
+        them"""
+        self.nset.apply_profile(name)
+        self.visibility_changed()
+        self.schedule_save()
+
+    def save_profile(self, *args):
+        name = ask_name(_("Save Profile"), _("Name of the profile:"))
+        if name is not None:
+            self.nset.save_profile(name)
+            self.populate_profiles_menu()
+            self.schedule_save()
+
+    def delete_profile(self, *args):
+        self.nset.delete_profile(self.nset.properties.get("profile"))
+        self.populate_profiles_menu()
+        self.schedule_save()
+
+    def visibility_changed(self):
+        """Updates the menu after notes were shown or hidden in bulk"""
         self.connect_secondary_activate()
+        self.populate_profiles_menu()
+
+    def notebooks_changed(self):
+        """Updates menus after notebooks were opened or closed"""
+        self.populate_notebooks_menu()
+        for note in self.nset.notes:
+            if note.gui != None:
+                note.gui.populate_menu()
+        self.schedule_reminders()
+        self.save()
 
     def connect_secondary_activate(self):
         """Define action of secondary action (middle click) depending
@@ -199,17 +471,26 @@ class IndicatorStickyNotes:
             self.ind.set_secondary_activate_target(self.mShowAll)
 
 
+    @save_required
+    def tidy(self, *args):
+        self.nset.arrange(layout.tidy, work_areas())
+
+    @save_required
+    def cascade(self, *args):
+        self.nset.arrange(layout.cascade, work_areas())
+
     @save_required
     def lockall(self, *args):
-        for note in self.nset.notes:
-            note.set_locked_state(True)
+        Selection(self.nset, self.nset.notes).lock(True)
         
     @save_required
     def unlockall(self, *args):
-        for note in self.nset.notes:
-            note.set_locked_state(False)
+        Selection(self.nset, self.nset.notes).lock(False)
+
+    def show_bulk(self, *args):
+        BulkDialog(self.nset)
 
-    def backup_datafile(self):
+    def backup_datafile(self, allow_stream=False):
         winChoose = Gtk.FileChooserDialog(_("Export Data"), None,
                 Gtk.FileChooserAction.SAVE, (Gtk.STOCK_CANCEL,
                     Gtk.ResponseType.CANCEL, Gtk.STOCK_SAVE,
@@ -220,20 +501,86 @@ class IndicatorStickyNotes:
         if response == Gtk.ResponseType.ACCEPT:
             backupfile =  winChoose.get_filename()
         winChoose.destroy()
-        if backupfile:
-            try:
-                copyfile(os.path.expanduser(self.data_file), backupfile)
-            except SameFileError:
+        if backupfile and allow_stream and \
+                stickynotes.transfer.is_stream_path(backupfile):
+            self.export_stream(backupfile)
+        elif backupfile:
+            if os.path.exists(backupfile) and os.path.samefile(backupfile,
+                    os.path.expanduser(self.data_file)):
                 err = _("Please choose a different "
                     "destination for the backup file.")
                 winError = Gtk.MessageDialog(None, None,
                         Gtk.MessageType.ERROR, Gtk.ButtonsType.CLOSE, err)
                 winError.run()
                 winError.destroy()
-                self.backup_datafile()
+                self.backup_datafile(allow_stream)
+                return
+            self.copy_datafile(backupfile)
 
     def export_datafile(self, *args):
-        self.backup_datafile()
+        self.backup_datafile(allow_stream=True)
+
+    def copy_datafile(self, path):
+        """Copies the data file to path in a worker thread"""
+        # Saves replace the data file rather than rewrite it, so the copy
+        # reads one consistent version even if a save happens meanwhile
+        self.save()
+        report = stickynotes.transfer.TransferReport(path)
+        cancel = threading.Event()
+        progress = ProgressDialog(_("Export Data"), cancel.set)
+        def _finish():
+            progress.destroy()
+            if report.failure:
+                show_transfer_report(_("Error exporting data."), report)
+            return False
+        # Latest fraction copied, and whether an update for it is pending:
+        # the copy can outpace the main loop, so updates are coalesced
+        latest = [0.0, False]
+        lock = threading.Lock()
+        def _progress():
+            with lock:
+                fraction, latest[1] = latest[0], False
+            progress.set_fraction(fraction)
+            return False
+        def _copy():
+            try:
+                for fraction in stickynotes.transfer.copy_file(
+                        os.path.expanduser(self.data_file), path, cancel):
+                    with lock:
+                        latest[0] = fraction
+                        pending, latest[1] = latest[1], True
+                    if not pending:
+                        GLib.idle_add(_progress)
+            except stickynotes.transfer.Cancelled:
+                report.cancelled = True
+            except OSError as e:
+                report.fail(e)
+            GLib.idle_add(_finish)
+        threading.Thread(target=_copy, daemon=True).start()
+
+    def export_stream(self, path):
+        """Writes a (compressed) JSON Lines export a chunk at a time from
+        the main loop, so notes can be extracted from their windows"""
+        report = stickynotes.transfer.TransferReport(path)
+        cancel = threading.Event()
+        progress = ProgressDialog(_("Export Data"), cancel.set)
+        steps = stickynotes.transfer.write_stream(self.nset, path)
+        def _step():
+            try:
+                if not cancel.is_set():
+                    progress.set_fraction(next(steps))
+                    return True
+                steps.close()
+                report.cancelled = True
+            except StopIteration:
+                pass
+            except Exception as e:
+                report.fail(e)
+            progress.destroy()
+            if report.failure:
+                show_transfer_report(_("Error exporting data."), report)
+            return False
+        GLib.idle_add(_step)
 
     def import_datafile(self, *args):
         winChoose = Gtk.FileChooserDialog(_("Import Data"), None,
@@ -246,15 +593,126 @@ class IndicatorStickyNotes:
             backupfile =  winChoose.get_filename()
         winChoose.destroy()
         if backupfile:
+            self.import_file(backupfile)
+
+    def import_file(self, path):
+        """Reads a data file or stream in a worker thread, handing batches
+        to the main loop to be merged. Batches merged before the import is
+        cancelled or fails are kept."""
+        report = stickynotes.transfer.TransferReport(path)
+        cancel = threading.Event()
+        progress = ProgressDialog(_("Import Data"), cancel.set)
+        # Keeps the reader from running far ahead of the main loop
+        slots = threading.Semaphore(IMPORT_QUEUE_DEPTH)
+        def _merge(batch, fraction):
+            if not cancel.is_set():
+                try:
+                    self.nset.merge(batch)
+                except Exception as e:
+                    report.fail(e)
+                    cancel.set()
+                progress.set_fraction(fraction)
+            slots.release()
+            return False
+        def _finish():
+            report.cancelled = cancel.is_set() and not report.failure
+            progress.destroy()
+            self.nset.record_migrations()
+            self.schedule_reminders()
+            self.save()
+            if report.failure or report.skipped:
+                show_transfer_report(_("Error importing data."), report)
+            return False
+        def _read():
             try:
-                with open(backupfile, encoding="utf-8") as fsock:
-                    self.nset.merge(fsock.read())
+                if stickynotes.transfer.is_stream_file(path):
+                    batches = stickynotes.transfer.read_stream(path,
+                            report=report)
+                else:
+                    batches = stickynotes.transfer.read_file(path,
+                            report=report)
+                for batch, fraction in batches:
+                    slots.acquire()
+                    if cancel.is_set():
+                        break
+                    GLib.idle_add(_merge, batch, fraction)
             except Exception as e:
-                err = _("Error importing data.")
-                winError = Gtk.MessageDialog(None, None,
-                        Gtk.MessageType.ERROR, Gtk.ButtonsType.CLOSE, err)
-                winError.run()
-                winError.destroy()
+                report.fail(e)
+            GLib.idle_add(_finish)
+        threading.Thread(target=_read, daemon=True).start()
+
+    def call_in_main(self, f, *args):
+        """Runs f in the main loop, from a worker thread, and returns its
+        result"""
+        done = threading.Event()
+        result = []
+        def _call():
+            try:
+                result.append(f(*args))
+            except Exception as e:
+                result.append(e)
+            done.set()
+            return False
+        GLib.idle_add(_call)
+        done.wait()
+        if isinstance(result[0], Exception):
+            raise result[0]
+        return result[0]
+
+    def update_sync(self):
+        """Starts or stops accepting sync sessions, as configured"""
+        if self.sync_server is not None:
+            self.sync_server.close()
+            self.sync_server = None
+        props = self.nset.properties
+        self.mSyncNow.set_sensitive(bool(props.get("sync_peer")))
+        if not (props.get("sync_listen") and props.get("sync_secret")):
+            return
+        try:
+            self.sync_server = stickynotes.sync.serve(self.nset,
+                    props["sync_secret"], call=self.call_in_main,
+                    done=lambda *counts: GLib.idle_add(self._synced))
+        except OSError:
+            self.show_error(_("Could not listen for sync connections."))
+
+    def _synced(self):
+        self.schedule_reminders()
+        self.save()
+        return False
+
+    def sync_now(self, *args):
+        """Syncs with the configured peer in a worker thread"""
+        host, sep, port = self.nset.properties["sync_peer"].rpartition(":")
+        if not sep or not port.isdigit():
+            host, port = self.nset.properties["sync_peer"], \
+                    stickynotes.info.SYNC_PORT
+        secret = self.nset.properties.get("sync_secret", "")
+        self.mSyncNow.set_sensitive(False)
+        def _finish(failed):
+            self.mSyncNow.set_sensitive(True)
+            self._synced()
+            if failed:
+                self.show_error(_("Error syncing notes."))
+            return False
+        def _sync():
+            failed = False
+            try:
+                stickynotes.sync.connect(self.nset, host, secret, int(port),
+                        call=self.call_in_main)
+            except (OSError, stickynotes.sync.SyncError):
+                failed = True
+            GLib.idle_add(_finish, failed)
+        threading.Thread(target=_sync, daemon=True).start()
+
+    def show_sync_settings(self, *args):
+        SyncDialog(self.nset)
+        self.update_sync()
+
+    def show_error(self, err):
+        winError = Gtk.MessageDialog(None, None,
+                Gtk.MessageType.ERROR, Gtk.ButtonsType.CLOSE, err)
+        winError.run()
+        winError.destroy()
 
     def show_about(self, *args):
         show_about_dialog()
@@ -262,23 +720,116 @@ class IndicatorStickyNotes:
     def show_settings(self, *args):
         wSettings = SettingsDialog(self.nset)
 
+    def show_encryption(self, *args):
+        EncryptionDialog(self.nset)
+        # Notes that couldn't be shown before may be readable now
+        if self.nset.properties.get("all_visible", True):
+            for note in self.nset.notes:
+                if note.gui == None:
+                    note.show()
+
+    def take_snapshot(self, then=None):
+        """Snapshots the note set, writing the snapshot in a worker thread.
+        then, if given, is called from that thread afterwards.
+
+        Attachments are cleaned up along the way. They are kept as long as
+        snapshots, so any snapshot can be restored with its attachments."""
+        if self.snapshot_busy:
+            return True
+        pending = self.snapshots.prepare(self.nset)
+        if pending is None and then is None:
+            return True
+        refs = self.nset.attachment_references()
+        self.snapshot_busy = True
+        def _done():
+            self.snapshot_busy = False
+            return False
+        def _write():
+            try:
+                if pending is not None:
+                    self.snapshots.write(pending)
+                if refs is not None:
+                    self.nset.attachments.collect(refs,
+                            SNAPSHOT_RETENTION_DAYS * 24 * 3600)
+                if then is not None:
+                    then()
+            except Exception:
+                logging.exception("Snapshot failed")
+            GLib.idle_add(_done)
+        threading.Thread(target=_write, daemon=True).start()
+        return True
+
+    def show_snapshots(self, *args):
+        SnapshotDialog(self.snapshots.snapshots(), self.restore_snapshot)
+
+    def restore_snapshot(self, snapshot_id):
+        """Rolls the note set back to a snapshot, after snapshotting the
+        current state"""
+        def _apply(state):
+            self.nset.restore_state(state)
+            self.schedule_reminders()
+            self.save()
+            return False
+        def _load():
+            GLib.idle_add(_apply, self.snapshots.state_at(snapshot_id))
+        if self.snapshot_busy:
+            self.show_error(_("A snapshot is being taken. Please try "
+                "again in a moment."))
+            return
+        self.take_snapshot(then=_load)
+
+    def notes_changed(self, uuids):
+        """Announces notes whose changes were just recorded"""
+        if self.dbus is not None:
+            for uuid in uuids:
+                self.dbus.note_changed(uuid)
+
     def show_archive(self, *args):
         from stickynotes.gui import ArchiveDialog
         ArchiveDialog(self.nset)
 
     def save(self):
         self.nset.save()
+        self.populate_tags_menu()
+
+    def schedule_save(self):
+        """Saves a little later, collapsing bursts of changes into one
+        write of the data file"""
+        if self.save_source is None:
+            self.save_source = GLib.timeout_add(SAVE_DELAY_MS,
+                    self._scheduled_save)
+
+    def schedule_reminders(self):
+        """(Re)arms the single timer for the earliest due reminder"""
+        if self.reminder_source is not None:
+            GLib.source_remove(self.reminder_source)
+            self.reminder_source = None
+        due = self.nset.reminders.next_due()
+        if due is None:
+            return
+        delay = (due - datetime.now()).total_seconds()
+        delay = min(max(delay, 0), REMINDER_POLL_SECONDS)
+        self.reminder_source = GLib.timeout_add(int(delay * 1000),
+                self._fire_reminders)
+
+    def _fire_reminders(self):
+        self.reminder_source = None
+        due = self.nset.fire_reminders(datetime.now())
+        for note in due:
+            # Rebuilding the window brings it to the front
+            note.show()
+        if due:
+            self.schedule_save()
+        self.schedule_reminders()
+        return False
+
+    def _scheduled_save(self):
+        self.save_source = None
+        if self.nset.dirty:
+            self.save()
+        return False
 
 def main():
-    # Avoid duplicate process
-    # From https://stackoverflow.com/questions/788411/check-to-see-if-python-script-is-running
-    procLock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
-    try:
-        procLock.bind('\0' + 'indicator-stickynotes')
-    except socket.error:
-        print('Indicator stickynotes already running.')
-        sys.exit()
-
     try:
         locale.setlocale(locale.LC_ALL, '')
     except:
@@ -295,8 +846,60 @@ def main():
     parser = argparse.ArgumentParser(description=_("Sticky Notes"))
     parser.add_argument("-d", action='store_true', help="use the development"
             " data file")
+    parser.add_argument("-f", "--data-file", help="use the given data file")
+    parser.add_argument("--metrics", action='store_true', help="collect "
+            "timings; dump them on SIGUSR1 or from the metrics socket")
+    parser.add_argument("--benchmark", metavar="RESULTS", help="benchmark "
+            "the GUI on synthetic data (e.g. under xvfb-run) and write the "
+            "results as JSON")
+    parser.add_argument("--benchmark-notes", metavar="N,N,...",
+            help="note counts to benchmark")
+    parser.add_argument("--capture", choices=["clipboard", "primary"],
+            help="make a note from the clipboard or the primary selection "
+            "in the running instance (e.g. from a keyboard shortcut)")
+    parser.add_argument("--capture-files", nargs="+", metavar="FILE",
+            help="make notes from files in the running instance")
     args = parser.parse_args()
 
+    if args.capture or args.capture_files:
+        if args.capture:
+            found = call_running("Capture", GLib.Variant("(s)",
+                (args.capture,)))
+        else:
+            found = call_running("CaptureFiles", GLib.Variant("(as)",
+                ([Gio.File.new_for_commandline_arg(f).get_uri()
+                    for f in args.capture_files],)))
+        if not found:
+            print('Indicator stickynotes is not running.')
+            sys.exit(1)
+        return
+
+    if args.benchmark:
+        import stickynotes.benchmark
+        load_global_css()
+        counts = [int(n) for n in args.benchmark_notes.split(",")] \
+                if args.benchmark_notes else \
+                stickynotes.benchmark.DEFAULT_COUNTS
+        stickynotes.benchmark.run(IndicatorStickyNotes, args,
+                args.benchmark, counts)
+        return
+
+    # Avoid duplicate process
+    # From https://stackoverflow.com/questions/788411/check-to-see-if-python-script-is-running
+    procLock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        procLock.bind('\0' + 'indicator-stickynotes')
+    except socket.error:
+        print('Indicator stickynotes already running.')
+        sys.exit()
+
+    if args.metrics or os.environ.get("STICKYNOTES_METRICS"):
+        logging.basicConfig()
+        metrics.enable()
+        metrics.serve()
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1,
+                lambda *args: metrics.dump() or True)
+
     indicator = IndicatorStickyNotes(args)
     # Load global css for the first time.
     load_global_css()
@@ -23,10 +23,11 @@ from distutils.cmd import Command
 import distutils.command.build, distutils.command.install_data, \
     distutils.command.clean
 
-from subprocess import call
-
+import ast
+import array
 import glob
 import os
+import struct
 import sys
 import shutil
 
@@ -34,6 +35,73 @@ sys.dont_write_bytecode = True
 from stickynotes.info import PO_DIR, MO_DIR, LOCALE_DOMAIN
 sys.dont_write_bytecode = False
 
+def parse_po(path):
+    """Parses a .po file into a dictionary of msgid -> msgstr, as stored in
+    a .mo file. Fuzzy and untranslated entries are skipped, like msgfmt."""
+    messages = {}
+    entry = {}
+    fuzzy = False
+    field = None
+
+    def _flush():
+        if "msgid" in entry and not fuzzy:
+            msgid = entry["msgid"]
+            if "msgctxt" in entry:
+                msgid = entry["msgctxt"] + b"\x04" + msgid
+            if "msgid_plural" in entry:
+                msgid += b"\0" + entry["msgid_plural"]
+                forms = sorted(k for k in entry if k.startswith("msgstr["))
+                msgstr = b"\0".join(entry[k] for k in forms)
+            else:
+                msgstr = entry.get("msgstr", b"")
+            if msgstr.replace(b"\0", b"") or not entry["msgid"]:
+                messages[msgid] = msgstr
+
+    with open(path, encoding="utf-8") as fsock:
+        for line in fsock:
+            line = line.strip()
+            if line.startswith("#,") and "fuzzy" in line:
+                _flush()
+                entry, fuzzy, field = {}, True, None
+                continue
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith('"'):
+                entry[field] += ast.literal_eval(line).encode("utf-8")
+                continue
+            keyword, string = line.split(None, 1)
+            if keyword in ("msgctxt", "msgid") and \
+                    ("msgstr" in entry or "msgstr[0]" in entry):
+                _flush()
+                entry, fuzzy = {}, False
+            field = keyword
+            entry[field] = ast.literal_eval(string).encode("utf-8")
+    _flush()
+    return messages
+
+def write_mo(messages, path):
+    """Writes messages to a GNU .mo file"""
+    keys = sorted(messages)
+    ids = strs = b""
+    offsets = []
+    for key in keys:
+        offsets.append((len(ids), len(key), len(strs), len(messages[key])))
+        ids += key + b"\0"
+        strs += messages[key] + b"\0"
+    # The header is 7 words, followed by the two tables of (length, offset)
+    keystart = 7 * 4 + 16 * len(keys)
+    valuestart = keystart + len(ids)
+    koffsets = []
+    voffsets = []
+    for o1, l1, o2, l2 in offsets:
+        koffsets += [l1, o1 + keystart]
+        voffsets += [l2, o2 + valuestart]
+    output = struct.pack("Iiiiiii", 0x950412de, 0, len(keys),
+            7 * 4, 7 * 4 + len(keys) * 8, 0, 0)
+    output += array.array("i", koffsets + voffsets).tobytes()
+    with open(path, "wb") as fsock:
+        fsock.write(output + ids + strs)
+
 class BuildPo(Command):
     """Builds translation files
     
@@ -44,19 +112,23 @@ class BuildPo(Command):
     def finalize_options(self):
         pass
     def run(self):
-        """Compiles .po files in PO_DIR to .mo files in MO_DIR"""
+        """Compiles .po files in PO_DIR to .mo files in MO_DIR.
+
+        Catalogs are compiled in-process, and only when the .po file is
+        newer than the existing .mo file."""
         for file in glob.glob(os.path.join(PO_DIR, "*.po")):
             locale = os.path.splitext(os.path.basename(file))[0]
             dest = os.path.join(MO_DIR, locale, "LC_MESSAGES",
                     LOCALE_DOMAIN + ".mo")
+            if os.path.exists(dest) and \
+                    os.path.getmtime(dest) >= os.path.getmtime(file):
+                continue
             os.makedirs(os.path.dirname(dest), exist_ok=True)
             try:
-                ret = call(["msgfmt", "-o", dest, file])
-            except OSError:
-                raise Exception("Error: Unable to run msgfmt")
-            if ret:
-                raise Exception("Error: msgfmt returned error code {0}" \
-                        .format(ret))
+                write_mo(parse_po(file), dest)
+            except (ValueError, SyntaxError, KeyError) as e:
+                raise Exception("Error: Unable to compile {0}: {1}" \
+                        .format(file, e))
 
 class Build(distutils.command.build.build):
     # build should depend on build_po
@@ -0,0 +1,116 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Content-addressed storage of files attached to notes.
+
+Attached files are copied into a directory beside the data file and named
+after the SHA-256 of their contents, so the data file only holds
+references and a file attached twice is stored once. A note refers to an
+attachment with a Markdown link, an image link for images:
+
+    ![photo.jpg](attachment:<sha256>.jpg)
+"""
+
+import hashlib
+import mimetypes
+import os
+import re
+import time
+import uuid
+
+# Read and hashed this much at a time
+CHUNK_SIZE = 1024 * 1024
+
+REF_RE = re.compile(r"attachment:([0-9a-f]{64}(?:\.[A-Za-z0-9]+)?)")
+LINK_RE = re.compile(r"(!?)\[([^\]\n]*)\]\(" + REF_RE.pattern + r"\)")
+
+def links(body):
+    """Returns (name, reference, is image) for the attachment links in a
+    body, each reference once, in order"""
+    found = {}
+    for match in LINK_RE.finditer(body):
+        found.setdefault(match.group(3), (match.group(2), match.group(3),
+            bool(match.group(1))))
+    return list(found.values())
+
+def references(body):
+    """Returns the set of references in a body, linked or not"""
+    return set(REF_RE.findall(body))
+
+def is_image(name):
+    mime = mimetypes.guess_type(name)[0]
+    return mime is not None and mime.startswith("image/")
+
+def markup(name, ref):
+    """The link to put in a note body for an attachment"""
+    return "{}[{}](attachment:{})".format("!" if is_image(name) else "",
+            name.replace("]", ")").replace("[", "("), ref)
+
+class AttachmentStore:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, ref):
+        return os.path.join(self.directory, ref)
+
+    def add(self, path):
+        """Copies a file into the store, hashing it on the way. Returns
+        its reference. Meant for a worker thread."""
+        os.makedirs(self.directory, exist_ok=True)
+        incoming = os.path.join(self.directory,
+                ".incoming-" + uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        try:
+            with open(path, "rb") as src, open(incoming, "wb") as dst:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    dst.write(chunk)
+            ref = digest.hexdigest() + os.path.splitext(path)[1].lower()
+            if not REF_RE.fullmatch("attachment:" + ref):
+                ref = digest.hexdigest()
+            if os.path.exists(self.path(ref)):
+                # Already stored; count it as just seen (see collect)
+                os.utime(self.path(ref))
+            else:
+                os.replace(incoming, self.path(ref))
+        finally:
+            if os.path.exists(incoming):
+                os.remove(incoming)
+        return ref
+
+    def collect(self, referenced, keep_seconds):
+        """Removes attachments that have not been referenced for
+        keep_seconds. Referenced ones have their modification time set to
+        now, so it records when they were last seen. Meant for a worker
+        thread. Returns the number of files removed."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+        now = time.time()
+        removed = 0
+        for name in names:
+            path = self.path(name)
+            try:
+                if name in referenced:
+                    os.utime(path)
+                elif now - os.path.getmtime(path) > keep_seconds:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
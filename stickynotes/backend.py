@@ -15,25 +15,64 @@
 # You should have received a copy of the GNU General Public License along with
 # indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
 from datetime import datetime, timedelta
+import itertools
 import uuid
 import json
+import hashlib
+import os
+import logging
+import shutil
 from os.path import expanduser
+from urllib.parse import quote
 
-from stickynotes.info import FALLBACK_PROPERTIES, DEFAULT_TRASH_RETENTION_DAYS, DEFAULT_CONFIRM_DELETE
+from stickynotes.info import FALLBACK_PROPERTIES, DEFAULT_TRASH_RETENTION_DAYS, DEFAULT_MAX_WINDOWS, NOTEBOOK_DIR_SUFFIX, SCHEMA_VERSION, ATTACHMENT_DIR_SUFFIX, SYNC_TOMBSTONE_DAYS
+from stickynotes import layout, metrics, migrations, reminders, attachments
+from stickynotes.tags import TagIndex, extract_tags
+from stickynotes.crypto import NoteCipher, LockedError
+from stickynotes.sync import SyncState, compare, category_digest
+
+log = logging.getLogger(__name__)
+
+# Revisions are shared by all notes, so a note's revision stands for one
+# body of one note, even across notes that replace each other
+_revisions = itertools.count(1)
+
+# Window state, which stays per machine when notes are synced
+WINDOW_PROPERTIES = ("position", "size", "keep_above", "sticky", "opacity",
+        "z")
 
 class Note:
     def __init__(self, content=None, gui_class=None, noteset=None,
-            category=None):
+            category=None, notebook=""):
         self.gui_class = gui_class
         self.noteset = noteset
+        # Name of the notebook the note is stored in ("" for the main file)
+        self.notebook = notebook
         content = content or {}
         self.uuid = content.get('uuid')
-        self.body = content.get('body','')
+        # None while the GUI's text buffer holds the body (see take_body)
+        self._body = content.get('body','')
+        # Encrypted body as stored, until it is first needed (see body)
+        self._sealed = content.get('body_enc')
+        # Bumped whenever the body changes. The last sealed copy is kept
+        # with its revision, so unchanged notes aren't re-encrypted.
+        self.revision = next(_revisions)
+        self._seal_cache = (self.revision, self._sealed) \
+                if self._sealed else None
+        # Body the GUI read from its buffer when it recorded a change, with
+        # its revision, until the note is next extracted
+        self._fresh = None
         self.properties = content.get("properties", {})
         self.category = category or content.get("cat", "")
         if not self.category in self.noteset.categories:
             self.category = ""
+        # Revision and category when the note was last versioned for sync,
+        # and when its last change was announced (never for notes that
+        # weren't just loaded)
+        self.synced = (self.revision, self.category)
+        self.announced = None
         last_modified = content.get('last_modified')
         if last_modified:
             self.last_modified = datetime.strptime(last_modified,
@@ -42,29 +81,132 @@ class Note:
             self.last_modified = datetime.now()
         # Don't create GUI until show is called
         self.gui = None
+        self.noteset.layout.update(self, self.rect())
+        self.noteset.tags.update(self, self._body)
+        self.schedule_reminder()
 
-    def extract(self):
+    def extract(self, sealed=False):
+        """Returns the note as a dictionary. With sealed set, the body of
+        an encrypted note is given encrypted, as body_enc."""
         if not self.uuid:
             self.uuid = str(uuid.uuid4())
         if self.gui != None:
             self.gui.update_note()
             self.properties = self.gui.properties()
-        return {"uuid":self.uuid, "body":self.body,
+            self.noteset.layout.update(self, self.rect())
+        data = {"uuid":self.uuid,
                 "last_modified":self.last_modified.strftime(
                     "%Y-%m-%dT%H:%M:%S"), "properties":self.properties,
                 "cat": self.category}
+        body = None
+        if self._fresh is not None and self._fresh[0] == self.revision:
+            body = self._fresh[1]
+        self._fresh = None
+        if sealed and self.encrypted():
+            data["body_enc"] = self.sealed_body(body)
+        else:
+            data["body"] = self.body if body is None else body
+        return data
+
+    @property
+    def body(self):
+        if self._sealed is not None:
+            self._open_sealed()
+        if self._body is None:
+            return self.gui.get_body()
+        return self._body
+
+    @body.setter
+    def body(self, body):
+        self._sealed = None
+        if self._body is None:
+            self.gui.set_body(body)
+        else:
+            self._body = body
+        self.revision = next(_revisions)
+        self.noteset.tags.update(self, body)
+        self.noteset.dirty = True
+
+    @property
+    def is_sealed(self):
+        """Whether the body is still encrypted and can't be read without
+        the key"""
+        return self._sealed is not None and not self.noteset.cipher.unlocked
+
+    def encrypted(self):
+        """Whether the note is to be stored encrypted"""
+        return self._sealed is not None or \
+                self.properties.get("encrypted", False) or \
+                self.noteset.properties.get("encrypt_all", False)
+
+    def set_sealed(self, sealed):
+        """Replaces the body with an encrypted one"""
+        if self.noteset.cipher.unlocked:
+            self.body = self.noteset.cipher.open(sealed)
+            return
+        # Without the key, the note can't stay on screen
+        if self.gui != None:
+            self.gui.destroy()
+            self.gui = None
+        self._body = ""
+        self._sealed = sealed
+        self.revision = next(_revisions)
+        self._seal_cache = (self.revision, sealed)
+
+    def _open_sealed(self):
+        """Decrypts the body, when it is first needed"""
+        self._body = self.noteset.cipher.open(self._sealed)
+        self._sealed = None
+        self.noteset.tags.update(self, self._body)
+
+    def sealed_body(self, body=None):
+        """Returns the encrypted body, encrypting it only if it changed
+        since it was last encrypted. body is the current body, if the
+        caller has it at hand."""
+        if self._sealed is not None:
+            return self._sealed
+        if self._seal_cache is None or self._seal_cache[0] != self.revision:
+            self._seal_cache = (self.revision, self.noteset.cipher.seal(
+                self.body if body is None else body))
+        return self._seal_cache[1]
+
+    def take_body(self):
+        """Hands the body over to the GUI, which keeps it in its text buffer
+        so it isn't held in memory twice. Returns the body."""
+        body = self.body
+        self._body = None
+        self._fresh = None
+        return body
+
+    def release_body(self):
+        """Takes the body back from the GUI"""
+        if self._body is None:
+            self._body = self.gui.get_body()
+            self._fresh = None
 
     def update(self,body=None):
         if not body == None:
             self.body = body
             self.last_modified = datetime.now()
 
+    def touch(self, body):
+        """Marks the note as modified now, after its GUI changed the body
+        to body"""
+        self.last_modified = datetime.now()
+        self.revision = next(_revisions)
+        self._fresh = (self.revision, body)
+        self.noteset.tags.update(self, body)
+
     def delete(self):
         """Move note to archive instead of permanent deletion"""
         self.noteset.archive_note(self)
         self.noteset.save()
 
     def show(self, *args, **kwargs):
+        # Encrypted notes can't be shown until the key is given
+        if self.is_sealed:
+            return
+        self.noteset.hidden.pop(self, None)
         # If GUI has not been created, create it now
         if self.gui == None:
             self.gui = self.gui_class(note=self)
@@ -74,6 +216,89 @@ class Note:
     def hide(self):
         if self.gui != None:
             self.gui.hide()
+            self.noteset.hidden[self] = None
+            self.noteset.hidden.move_to_end(self)
+
+    @property
+    def is_visible(self):
+        """Whether the note's window is shown"""
+        return self.gui != None and self not in self.noteset.hidden
+
+    def release_gui(self):
+        """Tears down the GUI, after taking its state back into the note.
+        It is rebuilt when the note is next shown."""
+        if self.gui == None:
+            return
+        self.gui.update_note()
+        self.properties = self.gui.properties()
+        self.drop_gui()
+
+    def drop_gui(self):
+        """Tears down the GUI without taking its state back, as when the
+        note's data was just replaced"""
+        self.release_body()
+        self.gui.destroy()
+        self.gui = None
+        self.noteset.hidden.pop(self, None)
+
+    def reveal(self):
+        """Shows the note without rebuilding an existing window"""
+        if self.gui == None:
+            self.show()
+        else:
+            self.noteset.hidden.pop(self, None)
+            self.gui.reveal()
+
+    def set_geometry(self, position, size):
+        """Records the window geometry. Returns whether it changed."""
+        position, size = list(position), list(size)
+        if list(self.properties.get("position", ())) == position and \
+                list(self.properties.get("size", ())) == size:
+            return False
+        self.properties["position"] = position
+        self.properties["size"] = size
+        self.noteset.layout.update(self, self.rect())
+        self.noteset.dirty = True
+        return True
+
+    def raised(self):
+        """Records that the note's window was raised above the others"""
+        top = self.noteset.properties.get("z_top", 0)
+        if self.properties.get("z") == top and top:
+            return
+        self.noteset.properties["z_top"] = top + 1
+        self.properties["z"] = top + 1
+        self.noteset.dirty = True
+
+    def set_reminder(self, reminder):
+        """Sets the note's reminder (see stickynotes.reminders), or clears
+        it if reminder is None"""
+        if reminder is None:
+            self.properties.pop("reminder", None)
+        else:
+            self.properties["reminder"] = reminder
+        self.schedule_reminder()
+        self.noteset.dirty = True
+
+    def schedule_reminder(self):
+        """Puts the note's reminder, if any, in the note set's queue"""
+        if "reminder" in self.properties:
+            self.noteset.reminders.schedule(self,
+                    reminders.parse(self.properties["reminder"]))
+        else:
+            self.noteset.reminders.cancel(self)
+
+    def rect(self):
+        """The note's window rectangle as last recorded"""
+        return (*self.properties.get("position", layout.DEFAULT_POSITION),
+                *self.properties.get("size", layout.DEFAULT_SIZE))
+
+    def place(self, position):
+        """Moves the note (and its window, if any) to position"""
+        self.set_geometry(position,
+                self.properties.get("size", layout.DEFAULT_SIZE))
+        if self.gui != None:
+            self.gui.place(position)
 
     def set_locked_state(self, locked):
         # if gui hasn't been initialized, just change the property
@@ -91,125 +316,711 @@ class NoteSet:
     def __init__(self, gui_class, data_file, indicator):
         self.notes = []
         self.archived_notes = []  # Archive for deleted notes
+        # Bodies of archived notes by content hash, and how many archived
+        # notes refer to each of them
+        self.archive_blobs = {}
+        self.blob_refs = {}
         self.properties = {}
         self.categories = {}
+        # Rectangles of all notes, for placement
+        self.layout = layout.SpatialIndex()
+        self.reminders = reminders.ReminderQueue()
+        self.tags = TagIndex()
+        self.cipher = NoteCipher()
+        self.sync = SyncState()
+        # Archived notes whose archiving was announced
+        self.announced_archived = set()
+        # Notes marked by the user for bulk operations
+        self.marked = set()
+        # Notes whose windows exist but are hidden, least recently hidden
+        # first (see evict_guis)
+        self.hidden = OrderedDict()
+        # Whether there are changes that haven't been written yet
+        self.dirty = False
+        # Names of the notebooks whose notes are loaded
+        self.open_notebooks = set()
+        # Digests of the data last written to each file, keyed by notebook,
+        # and of what that data was made from (see _stamp)
+        self.saved_digests = {}
+        self.saved_stamps = {}
+        # Time taken by each migration step of the last data loaded
+        self.migration_timings = {}
         self.gui_class = gui_class
         self.data_file = data_file
         self.indicator = indicator
+        # Files attached to notes, which bodies refer to
+        self.attachments = attachments.AttachmentStore(
+                expanduser(data_file) + ATTACHMENT_DIR_SUFFIX)
 
     def _loads_updater(self, dnoteset):
-        """Parses old versions of the Notes structure and updates them"""
+        """Parses old versions of the Notes structure and updates them.
+        The time taken adds up in migration_timings until it is recorded
+        (see record_migrations)."""
+        for version, ms in migrations.upgrade(dnoteset).items():
+            self.migration_timings[version] = \
+                    self.migration_timings.get(version, 0) + ms
         return dnoteset
 
+    def record_migrations(self):
+        """Records the time migrations took as metrics, once per load or
+        import however many parts it came in, and starts over. Returns
+        the timings recorded."""
+        timings, self.migration_timings = self.migration_timings, {}
+        for version, ms in timings.items():
+            metrics.record("migrate.v{}".format(version), ms)
+        return timings
+
     def loads(self, snoteset):
         """Loads notes into their respective objects"""
+        # Timings of earlier data that is being replaced don't count
+        self.migration_timings = {}
         notes = self._loads_updater(json.loads(snoteset))
         self.properties = notes.get("properties", {})
-        # Set default values for new properties
-        if "trash_retention_days" not in self.properties:
-            self.properties["trash_retention_days"] = DEFAULT_TRASH_RETENTION_DAYS
-        if "confirm_delete" not in self.properties:
-            self.properties["confirm_delete"] = DEFAULT_CONFIRM_DELETE
         self.categories = notes.get("categories", {})
+        self.sync = SyncState(notes.get("sync"))
+        self.layout = layout.SpatialIndex()
+        self.reminders = reminders.ReminderQueue()
+        self.tags = TagIndex()
+        self.open_notebooks = set()
+        self.saved_digests = {}
+        self.saved_stamps = {}
+        self.hidden = OrderedDict()
         self.notes = [Note(note, gui_class=self.gui_class, noteset=self)
                 for note in notes.get("notes",[])]
+        for note in self.notes:
+            note.announced = note.synced
         # Load archived notes
         self.archived_notes = notes.get("archived_notes", [])
+        self.archive_blobs = notes.get("archive_blobs", {})
+        self.blob_refs = {}
+        for archived in self.archived_notes:
+            self._intern_body(archived)
+        # Drop bodies nothing refers to
+        self.archive_blobs = {h: body for h, body in
+                self.archive_blobs.items() if h in self.blob_refs}
+        self.announced_archived = {a.get("uuid") for a in self.archived_notes}
         # Clean up old archived notes
         self.cleanup_old_archived_notes()
 
+    @metrics.timed("dumps")
     def dumps(self):
         return json.dumps({
-            "notes": [x.extract() for x in self.notes],
+            "version": SCHEMA_VERSION,
+            "notes": [x.extract(sealed=True) for x in self.notes
+                if not x.notebook],
             "archived_notes": self.archived_notes,
+            "archive_blobs": self.archive_blobs,
             "properties": self.properties,
-            "categories": self.categories
+            "categories": self.categories,
+            "sync": self.sync.to_dict()
+        })
+
+    def dumps_notebook(self, name):
+        """Serializes the notes of a notebook. Categories, properties and
+        the archive are shared and only stored in the main file."""
+        return json.dumps({
+            "version": SCHEMA_VERSION,
+            "notes": [x.extract(sealed=True) for x in self.notes
+                if x.notebook == name]
         })
 
+    def notebook_path(self, name):
+        return os.path.join(expanduser(self.data_file) + NOTEBOOK_DIR_SUFFIX,
+                quote(name, safe="") + ".json")
+
+    def _stamp(self, name):
+        """Digest of what a file is made from, with revisions standing in
+        for the bodies of notes, so finding that a file is unchanged
+        doesn't read any text buffers"""
+        stamp = [[n.uuid, n.revision, n.category, n.last_modified,
+            n.gui.properties() if n.gui != None else n.properties,
+            n.encrypted()] for n in self.notes if n.notebook == name]
+        if not name:
+            stamp += [self.archived_notes, self.archive_blobs,
+                    self.properties, self.categories, self.sync.to_dict()]
+        return hashlib.sha1(json.dumps(stamp, default=str).encode("utf-8")
+                ).digest()
+
+    def _save_file(self, name, path, dumps):
+        """Writes what dumps returns to path, unless nothing it is made
+        from changed since the last write"""
+        stamp = self._stamp(name)
+        if self.saved_stamps.get(name) == stamp:
+            return 0
+        written = self._write(name, path, dumps())
+        self.saved_stamps[name] = stamp
+        return written
+
+    def _write(self, name, path, output):
+        """Writes output to path unless it is what was last written there"""
+        data = output.encode("utf-8")
+        digest = hashlib.sha1(data).digest()
+        if self.saved_digests.get(name) == digest:
+            return 0
+        # Written beside the file and moved into place, so readers (such as
+        # a backup being copied) never see a partly written file
+        path = os.path.realpath(path)
+        with open(path + ".tmp", mode='wb') as fsock:
+            fsock.write(data)
+        if os.path.exists(path):
+            shutil.copymode(path, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self.saved_digests[name] = digest
+        return len(data)
+
+    @metrics.timed("save")
     def save(self, path=''):
-        output = self.dumps()
-        with open(path or expanduser(self.data_file),
-                mode='w', encoding='utf-8') as fsock:
-            fsock.write(output)
+        """Saves the main data file and every open notebook. Files whose
+        contents haven't changed are not rewritten."""
+        if path:
+            self.saved_digests.pop("", None)
+            self.saved_stamps.pop("", None)
+        # Without sync, changes are versioned when a snapshot needs them.
+        # Either way every GUI records its changes first.
+        if self.sync_enabled():
+            self.stamp_changes()
+        else:
+            self.announce_changes()
+        written = self._save_file("", path or expanduser(self.data_file),
+                self.dumps)
+        for name in self.open_notebooks:
+            os.makedirs(os.path.dirname(self.notebook_path(name)),
+                    exist_ok=True)
+            written += self._save_file(name, self.notebook_path(name),
+                    lambda name=name: self.dumps_notebook(name))
+        metrics.record("save.bytes", written)
+        self.dirty = False
 
     def open(self, path=''):
         with open(path or expanduser(self.data_file), 
                 encoding='utf-8') as fsock:
             self.loads(fsock.read())
+        for name in self.properties.get("open_notebooks", []):
+            self.open_notebook(name, show=False)
+        timings = self.record_migrations()
+        # Write upgraded data back, so later loads skip the migration
+        if timings:
+            log.warning("Upgraded data file to version %d (%s)",
+                    SCHEMA_VERSION, ", ".join("v{}: {:.1f} ms".format(v, ms)
+                        for v, ms in sorted(timings.items())))
+            self.save(path)
+
+    def open_notebook(self, name, show=True):
+        """Loads the notes of a notebook"""
+        if name in self.open_notebooks:
+            return
+        try:
+            with open(self.notebook_path(name), encoding='utf-8') as fsock:
+                data = json.loads(fsock.read())
+        except FileNotFoundError:
+            data = {}
+        self._loads_updater(data)
+        notes = [Note(note, gui_class=self.gui_class, noteset=self,
+            notebook=name) for note in data.get("notes", [])]
+        for note in notes:
+            note.announced = note.synced
+        self.notes.extend(notes)
+        self.open_notebooks.add(name)
+        if name not in self.properties.setdefault("notebooks", []):
+            self.properties["notebooks"].append(name)
+        self.properties["open_notebooks"] = sorted(self.open_notebooks)
+        if show:
+            for note in notes:
+                note.show()
+
+    def close_notebook(self, name):
+        """Saves a notebook and unloads its notes"""
+        if name not in self.open_notebooks:
+            return
+        self.properties["open_notebooks"] = sorted(self.open_notebooks -
+                {name})
+        self.save()
+        for note in [n for n in self.notes if n.notebook == name]:
+            self.notes.remove(note)
+            self.layout.remove(note)
+            self.reminders.cancel(note)
+            self.tags.remove(note)
+            self.marked.discard(note)
+            self.hidden.pop(note, None)
+            if note.gui != None:
+                note.gui.destroy()
+        self.open_notebooks.discard(name)
+        self.saved_digests.pop(name, None)
+        self.saved_stamps.pop(name, None)
 
     def load_fresh(self):
         """Load empty data"""
         self.loads('{}')
         self.new()
 
+    @metrics.timed("merge")
     def merge(self, data):
-        """Update notes based on new data"""
-        jdata = self._loads_updater(json.loads(data))
-        self.hideall()
+        """Update notes based on new data.
+
+        data is either a JSON string or an already parsed dictionary, such
+        as a batch read from a data stream. Only windows of notes that
+        changed are rebuilt. Hidden notes stay hidden, and their windows
+        are only built again when they are shown."""
+        if isinstance(data, str):
+            data = json.loads(data)
+        jdata = self._loads_updater(data)
         # update categories
-        if "categories" in jdata:
-            self.categories.update(jdata["categories"])
+        restyled = {cid for cid, cdata in jdata.get("categories", {}).items()
+                if self.categories.get(cid) != cdata}
+        self.categories.update(jdata.get("categories", {}))
         # make a dictionary of notes so we can modify existing notes
         dnotes = {n.uuid : n for n in self.notes}
+        changed = []
+        created = set()
         for newnote in jdata.get("notes", []):
             if "uuid" in newnote and newnote["uuid"] in dnotes:
                 # Update notes that are already in the noteset
                 orignote = dnotes[newnote["uuid"]]
                 if "body" in newnote:
                     orignote.body = newnote["body"]
+                elif "body_enc" in newnote:
+                    orignote.set_sealed(newnote["body_enc"])
                 if "properties" in newnote:
                     orignote.properties = newnote["properties"]
+                    self.layout.update(orignote, orignote.rect())
+                    orignote.schedule_reminder()
                 if "cat" in newnote:
                     orignote.category = newnote["cat"]
+                if "notebook" in newnote:
+                    orignote.notebook = newnote["notebook"]
             else:
                 # otherwise create a new note
-                if "uuid" in newnote:
-                    uuid = newnote["uuid"]
-                else:
-                    uuid = str(uuid.uuid4())
-                dnotes[uuid] = Note(newnote, gui_class=self.gui_class,
-                        noteset=self)
-        # copy notes over from dictionary to list
-        self.notes = list(dnotes.values())
-        self.showall(reload_from_backend=True)
-
-    def new(self):
-        """Creates a new note and adds it to the note set"""
-        note = Note(gui_class=self.gui_class, noteset=self,
-                category=self.properties.get("default_cat", ""))
+                if not "uuid" in newnote:
+                    newnote["uuid"] = str(uuid.uuid4())
+                orignote = Note(newnote, gui_class=self.gui_class,
+                        noteset=self, notebook=newnote.get("notebook", ""))
+                dnotes[orignote.uuid] = orignote
+                self.notes.append(orignote)
+                created.add(orignote)
+            changed.append(orignote)
+        # add archived notes we don't know about yet
+        archived = {n.get("uuid") for n in self.archived_notes}
+        for newnote in jdata.get("archived_notes", []):
+            if newnote.get("uuid") not in archived:
+                newnote = dict(newnote)
+                if "body_ref" in newnote:
+                    newnote["body"] = jdata.get("archive_blobs", {}).get(
+                            newnote.pop("body_ref"), "")
+                self._intern_body(newnote)
+                self.archived_notes.append(newnote)
+        # Changed categories show up in every note's menu, and restyle the
+        # notes in them. Other notes' windows are left as they are.
+        if restyled:
+            reloaded = set(changed)
+            for note in self.notes:
+                if note.gui is None or note in reloaded:
+                    continue
+                note.gui.populate_menu()
+                if note.category in restyled:
+                    note.gui.update_style()
+                    note.gui.update_font()
+        for note in changed:
+            if note in self.hidden:
+                note.drop_gui()
+            elif note.gui != None or note in created:
+                note.show(reload_from_backend=True)
+
+    def sync_enabled(self):
+        return bool(self.properties.get("sync_peer") or
+                self.properties.get("sync_listen"))
+
+    def announce_changes(self):
+        """Tells the indicator which notes changed or were archived since
+        the last call"""
+        changed = []
+        for note in self.notes:
+            if note.gui != None:
+                note.gui.update_note()
+            if not note.uuid:
+                note.uuid = str(uuid.uuid4())
+            if note.announced != (note.revision, note.category):
+                note.announced = (note.revision, note.category)
+                changed.append(note.uuid)
+        archived = {a.get("uuid") for a in self.archived_notes}
+        changed.extend(archived - self.announced_archived)
+        self.announced_archived = archived
+        if changed and self.indicator is not None:
+            self.indicator.notes_changed(changed)
+
+    def stamp_changes(self):
+        """Gives everything that changed locally since the last call a new
+        version, for sync and snapshots. Only bodies and categories of
+        notes count as changes to them; window state stays per machine.
+        Archived notes that were purged and deleted categories leave
+        tombstones."""
+        self.announce_changes()
+        now = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        for note in self.notes:
+            item = self.sync.items.get(note.uuid)
+            if item is None or item["kind"] != "note" or \
+                    note.synced != (note.revision, note.category):
+                self.sync.changed(note.uuid, "note")
+                note.synced = (note.revision, note.category)
+        archived = set()
+        for entry in self.archived_notes:
+            archived.add(entry["uuid"])
+            item = self.sync.items.get(entry["uuid"])
+            if item is None or item["kind"] != "archived":
+                self.sync.changed(entry["uuid"], "archived")
+        for cid, cdata in self.categories.items():
+            digest = category_digest(cdata)
+            item = self.sync.items.get(cid)
+            if item is None or item.get("digest") != digest:
+                self.sync.changed(cid, "category", digest=digest, time=now)
+        # Notes of notebooks that aren't open keep their versions
+        for key, item in list(self.sync.items.items()):
+            if item["kind"] == "archived" and key not in archived or \
+                    item["kind"] == "category" and \
+                    key not in self.categories:
+                self.sync.forget(key, now)
+
+    def sync_delta(self, peer, since):
+        """Returns the records peer hasn't seen, given the last sequence
+        number it received, and the current sequence number. Encrypted
+        notes are never sent."""
+        self.stamp_changes()
+        notes = {n.uuid: n for n in self.notes}
+        archived = {a.get("uuid"): a for a in self.archived_notes}
+        records = []
+        for key in self.sync.outgoing(peer, since):
+            item = self.sync.items[key]
+            if item["kind"] == "note" and key in notes and \
+                    not notes[key].encrypted():
+                data = notes[key].extract()
+                time = data["last_modified"]
+            elif item["kind"] == "archived" and key in archived and \
+                    "body_enc" not in archived[key]:
+                data = self.archived_note_data(archived[key])
+                time = data.get("deleted_at", "")
+            elif item["kind"] == "category" and key in self.categories:
+                data = self.categories[key]
+                time = item["time"]
+            else:
+                continue
+            records.append({"uuid": key, "kind": item["kind"],
+                "vv": item["vv"], "time": time, "data": data})
+        return records, self.sync.clock
+
+    def _sync_time(self, key, item, notes, archived):
+        """Returns when the local copy of an item last changed, for
+        settling concurrent changes"""
+        if item["kind"] == "note" and key in notes:
+            return notes[key].last_modified.strftime("%Y-%m-%dT%H:%M:%S")
+        if item["kind"] == "archived" and key in archived:
+            return archived[key].get("deleted_at", "")
+        return item.get("time", "")
+
+    def sync_apply(self, peer, records, clock):
+        """Applies records received from peer, up to its sequence number
+        clock. Of two concurrent changes, the later one wins."""
+        notes = {n.uuid: n for n in self.notes}
+        archived = {a.get("uuid"): a for a in self.archived_notes}
+        new_data = {"version": SCHEMA_VERSION, "notes": []}
+        changed = []
+        for record in records:
+            key, kind, data = record["uuid"], record["kind"], record["data"]
+            item = self.sync.items.get(key)
+            if item is not None:
+                order = compare(item["vv"], record["vv"])
+                if order in (0, 1):
+                    continue
+                if order is None and (self._sync_time(key, item, notes,
+                        archived), self.sync.id) > (record["time"], peer):
+                    # Ours wins, and goes back to the peer next time
+                    self.sync.keep(key, record["vv"])
+                    continue
+            extra = {}
+            if kind == "note":
+                if key in archived:
+                    self.delete_archived_note(key)
+                    del archived[key]
+                data = dict(data)
+                if key in notes:
+                    data["properties"] = dict(data.get("properties", {}))
+                    for prop in WINDOW_PROPERTIES:
+                        if prop in notes[key].properties:
+                            data["properties"][prop] = \
+                                    notes[key].properties[prop]
+                new_data["notes"].append(data)
+            elif kind == "archived":
+                if key in notes:
+                    self.archive_note(notes.pop(key))
+                self.delete_archived_note(key)
+                data = dict(data)
+                self._intern_body(data)
+                self.archived_notes.append(data)
+                archived[key] = data
+            elif kind == "category":
+                new_data.setdefault("categories", {})[key] = data
+                extra = {"digest": category_digest(data),
+                        "time": record["time"]}
+            else:
+                continue
+            self.sync.received(key, kind, record["vv"], peer, **extra)
+            if kind != "category":
+                changed.append(key)
+        if new_data["notes"] or "categories" in new_data:
+            self.merge(new_data)
+        notes = {n.uuid: n for n in self.notes}
+        for data in new_data["notes"]:
+            note = notes[data["uuid"]]
+            note.last_modified = datetime.strptime(data["last_modified"],
+                    "%Y-%m-%dT%H:%M:%S")
+            note.synced = (note.revision, note.category)
+            note.announced = note.synced
+        self.announced_archived = {a.get("uuid") for a in self.archived_notes}
+        self.sync.peers[peer] = clock
+        self.dirty = True
+        if changed and self.indicator is not None:
+            self.indicator.notes_changed(changed)
+
+    def restore_state(self, state):
+        """Rolls the note set back to a snapshot state (see
+        stickynotes.snapshots). Notes that didn't exist then are archived,
+        and notes of notebooks that aren't open are left alone. Only
+        windows of notes that differ are rebuilt. Returns the number of
+        notes and categories changed."""
+        notes = {n.uuid: n for n in self.notes}
+        archived = {a.get("uuid"): a for a in self.archived_notes}
+        notebooks = set(state.get("m:notebooks", []))
+        new_data = {"version": SCHEMA_VERSION, "notes": [],
+                "categories": {}}
+        count = 0
+        for key, data in state.items():
+            kind, key = key.split(":", 1)
+            if kind == "c" and self.categories.get(key) != data:
+                new_data["categories"][key] = data
+            elif kind == "n":
+                data = dict(data)
+                notebook = data.pop("notebook", "")
+                if key in notes:
+                    current = json.loads(json.dumps(
+                        notes[key].extract(sealed=True)))
+                    if current == data and notes[key].notebook == notebook:
+                        continue
+                elif notebook and notebook not in self.open_notebooks:
+                    continue
+                # A note isn't moved into a notebook that isn't loaded
+                if not notebook or notebook in self.open_notebooks:
+                    data["notebook"] = notebook
+                if key in archived:
+                    self.delete_archived_note(key)
+                new_data["notes"].append(data)
+            elif kind == "a":
+                if key in notes:
+                    self.archive_note(notes.pop(key))
+                    self.delete_archived_note(key)
+                elif key in archived:
+                    if self.archived_note_data(archived[key]) == data:
+                        continue
+                    self.delete_archived_note(key)
+                entry = dict(data)
+                self._intern_body(entry)
+                self.archived_notes.append(entry)
+                count += 1
+        for uuid, note in notes.items():
+            if "n:" + uuid not in state and "a:" + uuid not in state and \
+                    (not note.notebook or note.notebook in notebooks):
+                self.archive_note(note)
+                count += 1
+        if not new_data["categories"]:
+            del new_data["categories"]
+        if new_data["notes"] or "categories" in new_data:
+            self.merge(new_data)
+        return count + len(new_data["notes"]) + \
+                len(new_data.get("categories", ()))
+
+    def new(self, area=None, start=None, notebook="", body="", show=True):
+        """Creates a new note and adds it to the note set.
+
+        If a work area is given, the note is placed in free space there,
+        preferably at start. With show unset, the window isn't built until
+        the note is shown."""
+        note = Note({"body": body}, gui_class=self.gui_class, noteset=self,
+                category=self.properties.get("default_cat", ""),
+                notebook=notebook)
+        if area is not None:
+            self.layout.remove(note)
+            note.set_geometry(self.layout.find_free(layout.DEFAULT_SIZE,
+                area, start), layout.DEFAULT_SIZE)
         self.notes.append(note)
-        note.show()
+        self.dirty = True
+        if show:
+            note.show()
         return note
 
+    def stacking_order(self):
+        """Returns the notes from the bottom of the window stack to the
+        top, as last recorded"""
+        return sorted(self.notes, key=lambda note: note.properties.get("z",
+            0))
+
+    @metrics.timed("showall")
     def showall(self, *args, **kwargs):
-        for note in self.notes:
+        # Windows shown later stack above earlier ones
+        for note in self.stacking_order():
             note.show(*args, **kwargs)
         self.properties["all_visible"] = True
+        self.properties.pop("profile", None)
 
     def hideall(self, *args):
         self.save()
         for note in self.notes:
             note.hide(*args)
         self.properties["all_visible"] = False
+        self.properties.pop("profile", None)
+        self.evict_guis()
+
+    def evict_guis(self):
+        """Tears down the GUIs of the least recently hidden notes, until no
+        more windows exist than the max_windows property allows. Visible
+        windows are never torn down."""
+        excess = sum(1 for note in self.notes if note.gui != None) - \
+                self.properties.get("max_windows", DEFAULT_MAX_WINDOWS)
+        while excess > 0 and self.hidden:
+            note = next(iter(self.hidden))
+            note.release_gui()
+            excess -= 1
+
+    def guis(self):
+        """Returns the GUIs that exist. Notes that are encrypted, evicted
+        or not shown yet have none."""
+        return [note.gui for note in self.notes if note.gui != None]
+
+    def arrange(self, method, areas):
+        """Lays out all notes on the work areas they are on.
+
+        method is layout.tidy or layout.cascade. Each note stays on the work
+        area containing its centre."""
+        groups = {area: [] for area in areas}
+        for note in self.notes:
+            groups[layout.area_for(note.rect(), areas)].append(note)
+        for area, notes in groups.items():
+            positions = method([note.rect()[2:] for note in notes], area)
+            for note, position in zip(notes, positions):
+                note.place(position)
+
+    def fire_reminders(self, now):
+        """Returns the notes whose reminders are due. Repeating reminders
+        move on to their next occurrence; others are cleared."""
+        due = self.reminders.pop_due(now)
+        for note in due:
+            note.set_reminder(reminders.advance(
+                note.properties["reminder"], now))
+        return due
+
+    def select(self, category=None, tag=None, query=None, marked=False):
+        """Returns a Selection of the active and archived notes matching
+        all the given criteria: a category id, a tag, text contained in
+        the body (case-insensitive), or being marked by the user."""
+        def _matches(cat, body, tags):
+            return (category is None or cat == category) and \
+                    (tag is None or tag in tags) and \
+                    (query is None or query.lower() in body.lower())
+        notes = self.marked if marked else self.notes
+        if tag is not None:
+            notes = [n for n in notes if n in self.tags.tagged(tag)]
+        notes = [n for n in notes if not (query is not None and n.is_sealed)
+                and _matches(n.category, n.body if query is not None else "",
+                    (tag,))]
+        archived = []
+        if not marked:
+            for a in self.archived_notes:
+                body = self.archived_body(a)
+                if _matches(a.get("cat", ""), body,
+                        extract_tags(body) if tag is not None else ()):
+                    archived.append(a.get("uuid"))
+        return Selection(self, notes, archived)
+
+    def filter_by_tag(self, tag, reveal=True):
+        """Hides every note not tagged with tag. If reveal is set, hidden
+        notes with the tag are shown. Windows are only shown or hidden,
+        never rebuilt."""
+        tagged = self.tags.tagged(tag)
+        for note in self.notes:
+            if note not in tagged:
+                note.hide()
+            elif reveal:
+                note.reveal()
+        self.properties["all_visible"] = False
+        self.properties.pop("profile", None)
+        self.evict_guis()
+
+    def save_profile(self, name):
+        """Saves which notes are visible, and where, as the visibility
+        profile name"""
+        self.properties.setdefault("profiles", {})[name] = {
+                (note.uuid or note.extract()["uuid"]):
+                list(note.rect()[:2]) for note in self.notes
+                if note.is_visible}
+        self.properties["profile"] = name
+        self.dirty = True
+
+    def delete_profile(self, name):
+        self.properties.get("profiles", {}).pop(name, None)
+        if self.properties.get("profile") == name:
+            self.properties.pop("profile")
+        self.dirty = True
+
+    @metrics.timed("profile.apply")
+    def apply_profile(self, name):
+        """Switches to the visibility profile name. Only the windows whose
+        visibility or position differ from the profile are hidden, shown
+        or moved, and none are rebuilt."""
+        profile = self.properties["profiles"][name]
+        for note in self.stacking_order():
+            position = profile.get(note.uuid)
+            if position is None:
+                if note.is_visible:
+                    note.hide()
+                continue
+            if list(note.rect()[:2]) != position:
+                note.place(position)
+            if not note.is_visible:
+                note.reveal()
+        self.properties["all_visible"] = False
+        self.properties["profile"] = name
+        self.dirty = True
+        self.evict_guis()
+
     def archive_note(self, note):
         """Move note to archive instead of permanent deletion"""
+        # Extract note data first: that takes the GUI's state back into the
+        # note, which updates the layout and tag indices
+        archived_data = note.extract(sealed=True)
+
         # Remove from active notes
         if note in self.notes:
             self.notes.remove(note)
+        self.layout.remove(note)
+        self.reminders.cancel(note)
+        self.tags.remove(note)
+        self.marked.discard(note)
+        self.hidden.pop(note, None)
         
-        # Extract note data and add deletion timestamp
-        archived_data = note.extract()
+        # Add deletion timestamp
         archived_data["deleted_at"] = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        if note.notebook:
+            archived_data["notebook"] = note.notebook
+        self._intern_body(archived_data)
         
         # Add to archived notes
         self.archived_notes.append(archived_data)
         
         # Hide GUI if exists
         if note.gui:
-            note.gui.winMain.destroy()
+            note.gui.destroy()
 
     def cleanup_old_archived_notes(self):
-        """Remove archived notes older than retention period"""
+        """Remove archived notes older than retention period, and expired
+        sync tombstones"""
+        self.sync.expire((datetime.now() - timedelta(
+            days=SYNC_TOMBSTONE_DAYS)).strftime("%Y-%m-%dT%H:%M:%S"))
         retention_days = self.properties.get("trash_retention_days", DEFAULT_TRASH_RETENTION_DAYS)
         if retention_days <= 0:
             return  # Keep notes forever if retention is 0 or negative
@@ -217,13 +1028,114 @@ class NoteSet:
         cutoff_date = datetime.now() - timedelta(days=retention_days)
         
         # Filter out old archived notes
-        self.archived_notes = [
-            note for note in self.archived_notes
-            if datetime.strptime(note.get("deleted_at", "2000-01-01T00:00:00"), 
-                                "%Y-%m-%dT%H:%M:%S") > cutoff_date
-        ]
+        kept = []
+        for note in self.archived_notes:
+            if datetime.strptime(note.get("deleted_at", "2000-01-01T00:00:00"),
+                                "%Y-%m-%dT%H:%M:%S") > cutoff_date:
+                kept.append(note)
+            else:
+                self._release_body(note)
+        self.archived_notes = kept
+
+    def _intern_body(self, archived):
+        """Moves the body of an archived note into the blob store, keeping
+        a single copy of identical bodies"""
+        if "body" in archived:
+            body = archived.pop("body")
+            digest = hashlib.sha256(body.encode("utf-8")).hexdigest()
+            self.archive_blobs.setdefault(digest, body)
+            archived["body_ref"] = digest
+        digest = archived.get("body_ref")
+        if digest is not None:
+            self.blob_refs[digest] = self.blob_refs.get(digest, 0) + 1
+
+    def _release_body(self, archived):
+        """Drops a reference to an archived body, deleting it if unused"""
+        digest = archived.get("body_ref")
+        if digest is None:
+            return
+        self.blob_refs[digest] -= 1
+        if self.blob_refs[digest] <= 0:
+            del self.blob_refs[digest]
+            self.archive_blobs.pop(digest, None)
+
+    def archived_body(self, archived):
+        """Returns the body of an archived note ("" if it is encrypted and
+        the key hasn't been given)"""
+        if "body_enc" in archived:
+            try:
+                return self.cipher.open(archived["body_enc"])
+            except LockedError:
+                return ""
+        return self.archive_blobs.get(archived.get("body_ref"), "")
+
+    def attachment_references(self):
+        """Returns the attachments referred to by active and archived
+        notes and by the notes of closed notebooks, or None if some of
+        them can't be read (because they are encrypted, say)"""
+        refs = set()
+        for note in self.notes:
+            if note.is_sealed:
+                return None
+            refs |= attachments.references(note.body)
+        for archived in self.archived_notes:
+            if "body_enc" in archived and not self.cipher.unlocked:
+                return None
+            refs |= attachments.references(self.archived_body(archived))
+        for name in self.properties.get("notebooks", []):
+            if name in self.open_notebooks:
+                continue
+            try:
+                with open(self.notebook_path(name),
+                        encoding='utf-8') as fsock:
+                    data = json.loads(fsock.read())
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError):
+                return None
+            for note in data.get("notes", []):
+                try:
+                    body = self.cipher.open(note["body_enc"]) \
+                            if "body_enc" in note else note.get("body", "")
+                except (LockedError, ValueError):
+                    return None
+                refs |= attachments.references(body)
+        return refs
+
+    def archived_note_data(self, archived):
+        """Returns a self-contained copy of an archived note. Encrypted
+        bodies stay encrypted."""
+        data = {k: v for k, v in archived.items() if k != "body_ref"}
+        if "body_enc" not in data:
+            data["body"] = self.archived_body(archived)
+        return data
+
+    def enable_encryption(self, passphrase):
+        """Sets the passphrase notes are encrypted with. It can only be set
+        once, since existing encrypted notes depend on it."""
+        if "encryption" in self.properties:
+            raise ValueError("Encryption is already set up")
+        self.properties["encryption"] = self.cipher.setup(passphrase)
+
+    def needs_unlock(self):
+        return "encryption" in self.properties and not self.cipher.unlocked
 
-    def restore_note(self, archived_note_uuid):
+    def unlock(self, passphrase):
+        """Gives the passphrase for this session. Returns whether it was
+        right."""
+        return self.cipher.unlock(self.properties["encryption"], passphrase)
+
+    def delete_archived_note(self, archived_note_uuid):
+        """Permanently delete a note from the archive"""
+        kept = []
+        for note in self.archived_notes:
+            if note.get("uuid") == archived_note_uuid:
+                self._release_body(note)
+            else:
+                kept.append(note)
+        self.archived_notes = kept
+
+    def restore_note(self, archived_note_uuid, save=True):
         """Restore a note from archive"""
         # Find the archived note
         archived_note = None
@@ -237,17 +1149,27 @@ class NoteSet:
         
         # Remove from archive
         self.archived_notes.remove(archived_note)
+        data = self.archived_note_data(archived_note)
+        self._release_body(archived_note)
+        archived_note = data
         
         # Remove deleted_at timestamp
         if "deleted_at" in archived_note:
             del archived_note["deleted_at"]
         
+        # Return the note to its notebook if that is open
+        notebook = archived_note.pop("notebook", "")
+        if notebook not in self.open_notebooks:
+            notebook = ""
+
         # Create new note from archived data
-        restored_note = Note(archived_note, gui_class=self.gui_class, noteset=self)
+        restored_note = Note(archived_note, gui_class=self.gui_class,
+                noteset=self, notebook=notebook)
         self.notes.append(restored_note)
         
         # Save changes
-        self.save()
+        if save:
+            self.save()
         
         return restored_note
 
@@ -270,16 +1192,89 @@ class NoteSet:
         else:
             raise ValueError("Unknown property")
 
+class Selection:
+    """A group of notes that operations apply to in one batch.
+
+    None of the operations save or ask for confirmation; callers save once
+    afterwards."""
+    def __init__(self, noteset, notes=(), archived=()):
+        self.noteset = noteset
+        self.notes = list(notes)
+        # uuids of archived notes in the selection
+        self.archived = list(archived)
+
+    def __len__(self):
+        return len(self.notes)
+
+    def lock(self, locked=True):
+        for note in self.notes:
+            note.set_locked_state(locked)
+
+    def set_category(self, cat):
+        """Moves the notes to category cat"""
+        if not cat in self.noteset.categories:
+            raise KeyError("No such category")
+        for note in self.notes:
+            if note.gui != None:
+                note.gui.set_category(None, cat)
+                note.gui.populate_menu()
+            else:
+                note.category = cat
+
+    def archive(self):
+        for note in self.notes:
+            self.noteset.archive_note(note)
+        self.notes = []
+
+    def restore(self):
+        """Restores the archived notes in the selection"""
+        restored = [self.noteset.restore_note(uuid, save=False)
+                for uuid in self.archived]
+        self.archived = []
+        for note in restored:
+            if note is not None:
+                note.show()
+                self.notes.append(note)
+
+    def export(self, path):
+        """Writes the selected notes, with their categories, to path in the
+        format accepted by NoteSet.merge"""
+        notes = [note.extract(sealed=True) for note in self.notes]
+        archived = {a.get("uuid"): a for a in self.noteset.archived_notes}
+        cats = {note["cat"] for note in notes}
+        with open(path, mode='w', encoding='utf-8') as fsock:
+            json.dump({"notes": notes, "archived_notes":
+                [self.noteset.archived_note_data(archived[uuid])
+                    for uuid in self.archived if uuid in archived],
+                "categories": {cid: cdata for cid, cdata in
+                    self.noteset.categories.items() if cid in cats}}, fsock)
+
 class dGUI:
     """Dummy GUI"""
-    def __init__(self, *args, **kwargs):
-        pass
-    def show(self):
+    def __init__(self, *args, note=None, **kwargs):
+        self.note = note
+    def show(self, *args, **kwargs):
         pass
     def hide(self):
         pass
+    def reveal(self):
+        pass
+    def destroy(self):
+        pass
     def update_note(self):
         pass
+    def place(self, position):
+        pass
+    def populate_menu(self):
+        pass
+    def update_style(self):
+        pass
+    def update_font(self):
+        pass
+    def set_category(self, widget, cat):
+        self.note.category = cat
+    def set_locked_state(self, locked):
+        self.note.properties["locked"] = locked
     def properties(self):
-        return None
+        return self.note.properties
 
@@ -0,0 +1,122 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of the GTK render path on synthetic data files.
+
+Meant to be run under a virtual display, e.g.
+
+    xvfb-run ./indicator-stickynotes.py --benchmark results.json
+"""
+
+from datetime import datetime
+import json
+import os.path
+import random
+import tempfile
+import time
+import uuid
+
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gtk, GLib
+
+from stickynotes import metrics
+from stickynotes.gui import SettingsDialog
+
+DEFAULT_COUNTS = [10, 50, 100, 250, 500]
+CATEGORIES = 5
+
+def synthetic_data(count, seed=0):
+    """Returns a data file (as a string) with count notes spread over a
+    few categories and a 1920x1080 screen"""
+    rng = random.Random(seed)
+    categories = {str(uuid.uuid4()): {"name": "Category {}".format(i),
+        "bgcolor_hsv": [rng.random(), 0.5, 1]} for i in range(CATEGORIES)}
+    cids = list(categories)
+    now = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    notes = [{"uuid": str(uuid.uuid4()), "body": "Note {}\n".format(i) +
+        "lorem ipsum " * rng.randint(0, 200), "last_modified": now,
+        "cat": rng.choice(cids), "properties": {
+            "position": [rng.randrange(1720), rng.randrange(930)],
+            "size": [200, 150], "locked": False}} for i in range(count)]
+    return json.dumps({"notes": notes, "categories": categories,
+        "properties": {"all_visible": True}})
+
+def flush_events():
+    """Processes pending events, so windows are actually drawn"""
+    while Gtk.events_pending():
+        Gtk.main_iteration()
+
+def timed(f):
+    """Runs f and flushes events. Returns elapsed milliseconds."""
+    start = time.perf_counter()
+    f()
+    flush_events()
+    return (time.perf_counter() - start) * 1000
+
+def close_dialogs():
+    """Closes whatever dialogs are open"""
+    for window in Gtk.Window.list_toplevels():
+        if isinstance(window, Gtk.Dialog) and window.get_visible():
+            window.response(Gtk.ResponseType.CLOSE)
+    return False
+
+def run_one(indicator_class, args, count, tmpdir):
+    """Benchmarks the indicator with count notes"""
+    args.data_file = os.path.join(tmpdir, "stickynotes-{}".format(count))
+    with open(args.data_file, "w", encoding="utf-8") as fsock:
+        fsock.write(synthetic_data(count))
+    result = {"notes": count}
+
+    indicator = None
+    def _start():
+        nonlocal indicator
+        indicator = indicator_class(args)
+    result["first_window_ms"] = timed(_start)
+    nset = indicator.nset
+    result["hideall_ms"] = timed(nset.hideall)
+    result["showall_ms"] = timed(nset.showall)
+
+    # What SettingsCategory.update_bg does after a colour change
+    cid = next(iter(nset.categories))
+    def _restyle():
+        nset.categories[cid]["bgcolor_hsv"] = [0.3, 0.6, 1]
+        for gui in nset.guis():
+            gui.update_style()
+    result["update_style_ms"] = timed(_restyle)
+
+    # The dialog is modal; close it as soon as the main loop is idle again
+    GLib.idle_add(close_dialogs)
+    result["settings_open_ms"] = timed(lambda: SettingsDialog(nset))
+
+    for note in nset.notes:
+        if note.gui is not None:
+            note.gui.destroy()
+    flush_events()
+    return result
+
+def run(indicator_class, args, path, counts=DEFAULT_COUNTS):
+    """Runs the benchmark for every note count and writes results to path"""
+    metrics.enable()
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for count in counts:
+            results.append(run_one(indicator_class, args, count, tmpdir))
+            print(json.dumps(results[-1]), flush=True)
+    with open(path, "w", encoding="utf-8") as fsock:
+        json.dump({"results": results, "metrics": metrics.summary()},
+                fsock, indent=2)
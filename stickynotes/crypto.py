@@ -0,0 +1,105 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Encryption of note bodies at rest.
+
+The key is derived from a passphrase with scrypt once per session and kept
+in memory. Bodies are sealed with AES-GCM, which needs the optional
+cryptography module."""
+
+import base64
+import hashlib
+import os
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.exceptions import InvalidTag
+except ImportError:
+    AESGCM = None
+
+# scrypt parameters for new passphrases
+SCRYPT_N = 2**15
+SCRYPT_R = 8
+SCRYPT_P = 1
+NONCE_SIZE = 12
+# Plaintext sealed with the key, to check passphrases against
+CHECK_TEXT = "indicator-stickynotes"
+
+class LockedError(Exception):
+    """Raised when encrypted data is needed but no key has been given"""
+
+def available():
+    return AESGCM is not None
+
+class NoteCipher:
+    """Holds the session key and seals or opens note bodies"""
+    def __init__(self):
+        self.key = None
+
+    @property
+    def unlocked(self):
+        return self.key is not None
+
+    def _derive(self, params, passphrase):
+        return hashlib.scrypt(passphrase.encode("utf-8"),
+                salt=base64.b64decode(params["salt"]), n=params["n"],
+                r=params["r"], p=params["p"], maxmem=2**26, dklen=32)
+
+    def setup(self, passphrase):
+        """Derives a key for a new passphrase. Returns the parameters to
+        store so the passphrase can be checked later."""
+        if not available():
+            raise RuntimeError("Encryption requires the cryptography module")
+        params = {"salt": base64.b64encode(os.urandom(16)).decode("ascii"),
+                "n": SCRYPT_N, "r": SCRYPT_R, "p": SCRYPT_P}
+        self.key = self._derive(params, passphrase)
+        params["check"] = self.seal(CHECK_TEXT)
+        return params
+
+    def unlock(self, params, passphrase):
+        """Derives the key from passphrase. Returns whether it's correct."""
+        if not available():
+            raise RuntimeError("Encryption requires the cryptography module")
+        key = self._derive(params, passphrase)
+        previous, self.key = self.key, key
+        try:
+            if self.open(params["check"]) == CHECK_TEXT:
+                return True
+        except ValueError:
+            pass
+        self.key = previous
+        return False
+
+    def seal(self, text):
+        """Encrypts text, returning base64"""
+        if self.key is None:
+            raise LockedError()
+        nonce = os.urandom(NONCE_SIZE)
+        data = AESGCM(self.key).encrypt(nonce, text.encode("utf-8"), None)
+        return base64.b64encode(nonce + data).decode("ascii")
+
+    def open(self, sealed):
+        """Decrypts what seal returned"""
+        if self.key is None:
+            raise LockedError()
+        raw = base64.b64decode(sealed)
+        try:
+            data = AESGCM(self.key).decrypt(raw[:NONCE_SIZE],
+                    raw[NONCE_SIZE:], None)
+        except InvalidTag:
+            raise ValueError("Wrong key or corrupted data")
+        return data.decode("utf-8")
@@ -0,0 +1,285 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Session D-Bus interface, for scripts and desktop integration.
+
+Method calls are dispatched in the main loop, like menu actions. Search
+results are paged, and GetNotes and UpdateNotes handle many notes in one
+call. It can be tried against a private bus, e.g.
+
+    dbus-run-session -- sh -c './indicator-stickynotes.py -f /tmp/notes & \\
+        sleep 2; gdbus call --session --dest net.launchpad.IndicatorStickyNotes \\
+        --object-path /net/launchpad/IndicatorStickyNotes \\
+        --method net.launchpad.IndicatorStickyNotes.Search "" "" 0 10'
+"""
+
+import logging
+
+from gi.repository import Gio, GLib
+
+from stickynotes.gui import work_areas
+
+BUS_NAME = "net.launchpad.IndicatorStickyNotes"
+OBJECT_PATH = "/net/launchpad/IndicatorStickyNotes"
+INTERFACE = "net.launchpad.IndicatorStickyNotes"
+ERROR_NO_SUCH_NOTE = INTERFACE + ".Error.NoSuchNote"
+ERROR_ENCRYPTED = INTERFACE + ".Error.Encrypted"
+ERROR_NO_SUCH_PROFILE = INTERFACE + ".Error.NoSuchProfile"
+ERROR_FAILED = "org.freedesktop.DBus.Error.Failed"
+
+log = logging.getLogger(__name__)
+
+# Largest page of search results returned at once
+MAX_PAGE_SIZE = 500
+
+INTROSPECTION = """
+<node>
+  <interface name="{}">
+    <method name="NewNote">
+      <arg type="s" name="body" direction="in"/>
+      <arg type="s" name="uuid" direction="out"/>
+    </method>
+    <method name="Capture">
+      <arg type="s" name="source" direction="in"/>
+    </method>
+    <method name="CaptureText">
+      <arg type="s" name="text" direction="in"/>
+    </method>
+    <method name="CaptureFiles">
+      <arg type="as" name="uris" direction="in"/>
+    </method>
+    <method name="ShowAll"/>
+    <method name="HideAll"/>
+    <method name="Search">
+      <arg type="s" name="query" direction="in"/>
+      <arg type="s" name="tag" direction="in"/>
+      <arg type="u" name="offset" direction="in"/>
+      <arg type="u" name="limit" direction="in"/>
+      <arg type="u" name="total" direction="out"/>
+      <arg type="a(sss)" name="results" direction="out"/>
+    </method>
+    <method name="GetNote">
+      <arg type="s" name="uuid" direction="in"/>
+      <arg type="a{{sv}}" name="note" direction="out"/>
+    </method>
+    <method name="GetNotes">
+      <arg type="as" name="uuids" direction="in"/>
+      <arg type="aa{{sv}}" name="notes" direction="out"/>
+    </method>
+    <method name="UpdateNote">
+      <arg type="s" name="uuid" direction="in"/>
+      <arg type="s" name="body" direction="in"/>
+    </method>
+    <method name="UpdateNotes">
+      <arg type="a{{ss}}" name="bodies" direction="in"/>
+      <arg type="u" name="updated" direction="out"/>
+    </method>
+    <method name="ListProfiles">
+      <arg type="as" name="names" direction="out"/>
+      <arg type="s" name="current" direction="out"/>
+    </method>
+    <method name="ApplyProfile">
+      <arg type="s" name="name" direction="in"/>
+    </method>
+    <method name="SaveProfile">
+      <arg type="s" name="name" direction="in"/>
+    </method>
+    <signal name="NoteChanged">
+      <arg type="s" name="uuid"/>
+    </signal>
+  </interface>
+</node>
+""".format(INTERFACE)
+
+def call_running(method, args=None):
+    """Calls a method of the running instance. Returns whether one was
+    running to take the call."""
+    try:
+        bus = Gio.bus_get_sync(Gio.BusType.SESSION, None)
+        bus.call_sync(BUS_NAME, OBJECT_PATH, INTERFACE, method, args, None,
+                Gio.DBusCallFlags.NONE, -1, None)
+    except GLib.Error:
+        return False
+    return True
+
+class NoSuchNote(Exception):
+    pass
+
+class NoteEncrypted(Exception):
+    pass
+
+class NoSuchProfile(Exception):
+    pass
+
+def note_title(note):
+    """First line of a note, as shown in search results"""
+    if note.is_sealed:
+        return ""
+    return note.body.split("\n", 1)[0]
+
+class DBusService:
+    """Exports the indicator's note set on the session bus"""
+    def __init__(self, indicator):
+        self.indicator = indicator
+        self.connection = None
+        self.registration = None
+        self.node_info = Gio.DBusNodeInfo.new_for_xml(INTROSPECTION)
+        self.owner_id = Gio.bus_own_name(Gio.BusType.SESSION, BUS_NAME,
+                Gio.BusNameOwnerFlags.NONE, self.bus_acquired, None, None)
+
+    @property
+    def nset(self):
+        return self.indicator.nset
+
+    def bus_acquired(self, connection, name):
+        self.connection = connection
+        self.registration = connection.register_object(OBJECT_PATH,
+                self.node_info.interfaces[0], self.method_call, None, None)
+
+    def unregister(self):
+        if self.registration is not None:
+            self.connection.unregister_object(self.registration)
+            self.registration = None
+        Gio.bus_unown_name(self.owner_id)
+
+    def note_changed(self, uuid):
+        if self.registration is not None:
+            self.connection.emit_signal(None, OBJECT_PATH, INTERFACE,
+                    "NoteChanged", GLib.Variant("(s)", (uuid,)))
+
+    def method_call(self, connection, sender, path, interface, method,
+            params, invocation):
+        try:
+            result = getattr(self, "do_" + method)(*params.unpack())
+        except NoSuchNote as e:
+            invocation.return_dbus_error(ERROR_NO_SUCH_NOTE,
+                    "No note with uuid {}".format(e))
+            return
+        except NoteEncrypted as e:
+            invocation.return_dbus_error(ERROR_ENCRYPTED,
+                    "Note {} is encrypted and locked".format(e))
+            return
+        except NoSuchProfile as e:
+            invocation.return_dbus_error(ERROR_NO_SUCH_PROFILE,
+                    "No profile named {}".format(e))
+            return
+        except Exception as e:
+            # Callers would otherwise wait for a reply until they time out
+            log.exception("D-Bus call %s failed", method)
+            invocation.return_dbus_error(ERROR_FAILED,
+                    "{}: {}".format(type(e).__name__, e))
+            return
+        invocation.return_value(result)
+
+    def _find(self, uuid):
+        for note in self.nset.notes:
+            if note.uuid == uuid:
+                return note
+        raise NoSuchNote(uuid)
+
+    def _describe(self, note):
+        """A note as an a{sv} dictionary"""
+        return {"uuid": GLib.Variant("s", note.uuid),
+                "body": GLib.Variant("s", "" if note.is_sealed
+                    else note.body),
+                "encrypted": GLib.Variant("b", note.is_sealed),
+                "category": GLib.Variant("s", note.category),
+                "category_name": GLib.Variant("s", self.nset.categories.get(
+                    note.category, {}).get("name", "")),
+                "last_modified": GLib.Variant("s",
+                    note.last_modified.strftime("%Y-%m-%dT%H:%M:%S")),
+                "tags": GLib.Variant("as", sorted(
+                    self.nset.tags.note_tags.get(note, ()))),
+                "visible": GLib.Variant("b", note.gui is not None and
+                    note.gui.winMain.get_visible())}
+
+    def do_NewNote(self, body):
+        note = self.nset.new(area=work_areas()[0], body=body)
+        self.indicator.schedule_save()
+        return GLib.Variant("(s)", (note.extract()["uuid"],))
+
+    def do_Capture(self, source):
+        """Captures the clipboard or, if source is "primary", the primary
+        selection"""
+        self.indicator.capture(None, source)
+
+    def do_CaptureText(self, text):
+        self.indicator.capture_text(text)
+
+    def do_CaptureFiles(self, uris):
+        self.indicator.capture_files(uris)
+
+    def do_ShowAll(self):
+        self.indicator.showall()
+
+    def do_HideAll(self):
+        self.indicator.hideall()
+
+    def do_Search(self, query, tag, offset, limit):
+        """Notes matching query and tag (either may be empty), most
+        recently modified first"""
+        notes = self.nset.select(tag=tag.lower() or None,
+                query=query or None).notes
+        notes.sort(key=lambda note: note.last_modified, reverse=True)
+        page = notes[offset:offset + min(limit, MAX_PAGE_SIZE)]
+        return GLib.Variant("(ua(sss))", (len(notes), [(note.uuid or
+            note.extract()["uuid"], note_title(note),
+            note.last_modified.strftime("%Y-%m-%dT%H:%M:%S"))
+            for note in page]))
+
+    def do_GetNote(self, uuid):
+        return GLib.Variant("(a{sv})", (self._describe(self._find(uuid)),))
+
+    def do_GetNotes(self, uuids):
+        """Notes by uuid. Unknown uuids are left out."""
+        wanted = set(uuids)
+        return GLib.Variant("(aa{sv})", ([self._describe(note)
+            for note in self.nset.notes if note.uuid in wanted],))
+
+    def do_UpdateNote(self, uuid, body):
+        self._update(self._find(uuid), body)
+        self.indicator.schedule_save()
+
+    def do_UpdateNotes(self, bodies):
+        """Replaces the bodies of notes by uuid. Unknown uuids are
+        skipped. Returns how many notes were updated."""
+        updated = 0
+        for note in self.nset.notes:
+            if note.uuid in bodies and not note.is_sealed:
+                self._update(note, bodies[note.uuid])
+                updated += 1
+        self.indicator.schedule_save()
+        return GLib.Variant("(u)", (updated,))
+
+    def _update(self, note, body):
+        if note.is_sealed:
+            raise NoteEncrypted(note.uuid)
+        note.update(body)
+
+    def do_ListProfiles(self):
+        return GLib.Variant("(ass)", (sorted(self.nset.properties.get(
+            "profiles", {})), self.nset.properties.get("profile", "")))
+
+    def do_ApplyProfile(self, name):
+        if name not in self.nset.properties.get("profiles", {}):
+            raise NoSuchProfile(name)
+        self.indicator.apply_profile(None, name)
+
+    def do_SaveProfile(self, name):
+        self.nset.save_profile(name)
+        self.indicator.populate_profiles_menu()
+        self.indicator.schedule_save()
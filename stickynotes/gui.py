@@ -20,12 +20,24 @@ from string import Template
 import gi
 gi.require_version("Gtk", "3.0")
 gi.require_version("GtkSource", "3.0")
-from gi.repository import Gtk, Gdk, Gio, GObject, GtkSource, Pango
+gi.require_version("GdkPixbuf", "2.0")
+from gi.repository import Gtk, Gdk, GdkPixbuf, Gio, GLib, GObject, \
+        GtkSource, Pango
 from locale import gettext as _
 import os.path
 import colorsys
+import threading
 import uuid
 
+from stickynotes.info import GEOMETRY_SETTLE_MS, DEFAULT_MAX_WINDOWS, \
+        OPACITY_LEVELS
+from stickynotes import metrics, reminders, crypto, attachments
+from stickynotes.markdown import MarkdownHighlighter
+
+# StickyNotes.ui uses GtkSource.View, which must be registered before any
+# note window is built
+GObject.type_register(GtkSource.View)
+
 def load_global_css():
     """Adds a provider for the global CSS"""
     global_css = Gtk.CssProvider()
@@ -34,6 +46,65 @@ def load_global_css():
     Gtk.StyleContext.add_provider_for_screen(Gdk.Screen.get_default(),
             global_css, Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
 
+# Styles and icons are shared by all notes with the same colours
+_css_template = None
+_css_providers = {}
+_icon_pixbufs = {}
+# Bound on the number of cached CSS providers (e.g. while picking colours)
+CSS_CACHE_SIZE = 64
+
+def css_template():
+    """Returns the per-note CSS template, loading it once"""
+    global _css_template
+    if _css_template is None:
+        with open(os.path.join(os.path.dirname(__file__), "..", "style.css"),
+                encoding="utf-8") as css_file:
+            _css_template = Template(css_file.read())
+    return _css_template
+
+def css_provider(css_string):
+    """Returns a CSS provider loaded with css_string, shared between all
+    notes that use the same style"""
+    if css_string not in _css_providers:
+        if len(_css_providers) >= CSS_CACHE_SIZE:
+            _css_providers.clear()
+        provider = Gtk.CssProvider()
+        provider.load_from_data(css_string)
+        _css_providers[css_string] = provider
+    return _css_providers[css_string]
+
+def icon_pixbuf(filename):
+    """Returns the pixbuf of one of the icons, loading it once"""
+    if filename not in _icon_pixbufs:
+        _icon_pixbufs[filename] = GdkPixbuf.Pixbuf.new_from_file(
+                os.path.join(os.path.dirname(__file__), "..", "Icons",
+                    filename))
+    return _icon_pixbufs[filename]
+
+def work_areas():
+    """Returns the work area of every monitor as (x, y, width, height)"""
+    display = Gdk.Display.get_default()
+    areas = []
+    for i in range(display.get_n_monitors()):
+        area = display.get_monitor(i).get_workarea()
+        areas.append((area.x, area.y, area.width, area.height))
+    return areas
+
+def work_area_at(x, y):
+    """Returns the work area of the monitor at a point"""
+    area = Gdk.Display.get_default().get_monitor_at_point(x, y).get_workarea()
+    return (area.x, area.y, area.width, area.height)
+
+def new_note_buffer(text):
+    """Creates the text buffer of a note, set up the same way for all notes"""
+    buf = GtkSource.Buffer()
+    buf.set_highlight_matching_brackets(False)
+    buf.begin_not_undoable_action()
+    buf.set_text(text)
+    buf.end_not_undoable_action()
+    buf.set_modified(False)
+    return buf
+
 class StickyNote:
     """Manages the GUI of an individual stickynote"""
     def __init__(self, note):
@@ -43,22 +114,28 @@ class StickyNote:
         self.note = note
         self.noteset = note.noteset
         self.locked = self.note.properties.get("locked", False)
+        # Throttling of geometry updates while the window is dragged
+        self.last_configure = 0
+        self.geometry_source = None
 
-        # Create menu
+        # Create menu. Its items are only built when it first pops up.
         self.menu = Gtk.Menu()
         self.populate_menu()
 
-        # Load CSS template and initialize Gtk.CssProvider
-        with open(os.path.join(self.path, "style.css"), encoding="utf-8") \
-                as css_file:
-            self.css_template = Template(css_file.read())
-        self.css = Gtk.CssProvider()
+        # CSS provider currently applied to the window (see update_style)
+        self.css_template = css_template()
+        self.css = None
+
+        # The buffer outlives window rebuilds and owns the note's body
+        self.bbody = new_note_buffer(self.note.take_body())
+        self.markdown = None
+        self.set_markdown(self.note.properties.get("markdown", False))
 
         self.build_note()
         
+    @metrics.timed("build_note")
     def build_note(self):
         self.builder = Gtk.Builder()
-        GObject.type_register(GtkSource.View)
         self.builder.add_from_file(os.path.join(self.path,
             "StickyNotes.ui"))
         self.builder.connect_signals(self)
@@ -72,6 +149,7 @@ class StickyNote:
             setattr(self, w, self.builder.get_object(w))
         self.style_contexts = [self.winMain.get_style_context(),
                 self.txtNote.get_style_context()]
+        self.css = None
         # Update window-specific style. Global styles are loaded initially!
         self.update_style()
         self.update_font()
@@ -79,20 +157,37 @@ class StickyNote:
         settings = Gtk.Settings.get_default()
         settings.props.gtk_button_images = True
         # Set text buffer
-        self.bbody = GtkSource.Buffer()
-        self.bbody.begin_not_undoable_action()
-        self.bbody.set_text(self.note.body)
-        self.bbody.set_highlight_matching_brackets(False)
-        self.bbody.end_not_undoable_action()
         self.txtNote.set_buffer(self.bbody)
+        # Attachments are listed below the text
+        self.attachBox = Gtk.FlowBox()
+        self.attachBox.set_selection_mode(Gtk.SelectionMode.NONE)
+        self.attachBox.set_no_show_all(True)
+        mainBox = self.builder.get_object("mainBox")
+        mainBox.pack_start(self.attachBox, False, True, 0)
+        mainBox.reorder_child(self.attachBox, 2)
+        self.attachment_links = None
+        self.update_attachments()
+        # Text and files dropped on the add button become new notes
+        self.bAdd.drag_dest_set(Gtk.DestDefaults.ALL, [],
+                Gdk.DragAction.COPY)
+        self.bAdd.drag_dest_add_uri_targets()
+        self.bAdd.drag_dest_add_text_targets()
+        self.bAdd.connect("drag-data-received", self.dropped)
         # Make resize work
         self.winMain.add_events(Gdk.EventMask.BUTTON_PRESS_MASK)
         self.eResizeR.add_events(Gdk.EventMask.BUTTON_PRESS_MASK)
         # Move Window
         self.winMain.move(*self.note.properties.get("position", (10,10)))
         self.winMain.resize(*self.note.properties.get("size", (200,150)))
-        # Show the window
+        # Window state is set before the window is mapped, so the window
+        # manager gets it along with the window
         self.winMain.set_skip_pager_hint(True)
+        self.winMain.set_keep_above(
+                self.note.properties.get("keep_above", False))
+        if self.note.properties.get("sticky", False):
+            self.winMain.stick()
+        self.winMain.set_opacity(self.note.properties.get("opacity", 1.0))
+        # Show the window
         self.winMain.show_all()
         # Mouse over
         self.eResizeR.get_window().set_cursor(Gdk.Cursor.new_for_display(
@@ -101,17 +196,6 @@ class StickyNote:
         # Set locked state
         self.set_locked_state(self.locked)
 
-        # call set_keep_above just to have the note appearing
-        # above everything else.
-        # without it, it still won't appear above a window
-        # in which a cursor is active
-        self.winMain.set_keep_above(True)
-
-        # immediately undo the set keep above after the window
-        # is shown, so that windows won't stay up if we switch to
-        # a different window
-        self.winMain.set_keep_above(False)
-
 
     # (re-)show the sticky note after it has been hidden getting a sticky note
     # to show itself was problematic after a "show desktop" command in unity.
@@ -142,10 +226,132 @@ class StickyNote:
         """Hides the stickynotes window"""
         self.winMain.hide()
 
+    def reveal(self):
+        """Shows the window if it is hidden, without rebuilding it"""
+        if not self.winMain.get_visible():
+            self.winMain.show()
+
+    def destroy(self):
+        """Destroys the stickynotes window"""
+        if self.geometry_source is not None:
+            GLib.source_remove(self.geometry_source)
+            self.geometry_source = None
+        if self.markdown is not None:
+            self.markdown.disconnect()
+        self.winMain.destroy()
+        self.menu.destroy()
+
     def update_note(self):
         """Update the underlying note object"""
-        self.note.update(self.bbody.get_text(self.bbody.get_start_iter(),
-            self.bbody.get_end_iter(), True))
+        # The body lives in the buffer. It is read once here, and the note
+        # keeps it only until it is next saved.
+        if self.bbody.get_modified():
+            body = self.get_body()
+            self.note.touch(body)
+            self.bbody.set_modified(False)
+            self.update_attachments(body)
+
+    def update_attachments(self, body=None):
+        """Lists the attachments the body links to, if they changed.
+        Thumbnails of images are filled in as they become available."""
+        found = attachments.links(self.get_body() if body is None else body)
+        if found == self.attachment_links:
+            return
+        self.attachment_links = found
+        for child in self.attachBox.get_children():
+            child.destroy()
+        store = self.noteset.attachments
+        for name, ref, image in found:
+            button = Gtk.Button()
+            button.set_relief(Gtk.ReliefStyle.NONE)
+            button.set_tooltip_text(name)
+            button.connect("clicked", self.open_attachment, ref)
+            if image:
+                icon = Gtk.Image.new_from_icon_name("image-x-generic",
+                        Gtk.IconSize.DIALOG)
+                button.add(icon)
+                self.noteset.indicator.thumbnails.request(ref,
+                        store.path(ref), lambda pixbuf, icon=icon:
+                        self.set_thumbnail(icon, pixbuf))
+            else:
+                button.set_label(name)
+            self.attachBox.add(button)
+            button.show_all()
+        self.attachBox.set_visible(bool(found))
+
+    def set_thumbnail(self, icon, pixbuf):
+        # The list may have been rebuilt while the thumbnail was made
+        if pixbuf is not None and icon.get_parent() is not None:
+            icon.set_from_pixbuf(pixbuf)
+
+    def open_attachment(self, widget, ref):
+        uri = Gio.File.new_for_path(
+                self.noteset.attachments.path(ref)).get_uri()
+        try:
+            Gio.AppInfo.launch_default_for_uri(uri, None)
+        except GLib.Error:
+            self.noteset.indicator.show_error(
+                    _("Could not open the attachment."))
+
+    def attach_files(self, *args):
+        """Asks for files and attaches them. They are copied into the
+        attachment store in a worker thread, then linked at the cursor."""
+        winChoose = Gtk.FileChooserDialog(_("Attach Files"), None,
+                Gtk.FileChooserAction.OPEN, (Gtk.STOCK_CANCEL,
+                    Gtk.ResponseType.CANCEL, Gtk.STOCK_OPEN,
+                    Gtk.ResponseType.ACCEPT))
+        winChoose.set_select_multiple(True)
+        response = winChoose.run()
+        paths = winChoose.get_filenames() \
+                if response == Gtk.ResponseType.ACCEPT else []
+        winChoose.destroy()
+        if not paths:
+            return
+        store = self.noteset.attachments
+        def _insert(links, failed):
+            text = "\n".join(links) + "\n"
+            if links and self.note.gui is self:
+                self.bbody.insert_at_cursor(text)
+                self.update_note()
+            elif links:
+                # The window was torn down meanwhile
+                self.note.update(self.note.body.rstrip("\n") + "\n" + text)
+            if links:
+                self.save()
+            if failed:
+                self.noteset.indicator.show_error(
+                        _("Could not attach {}.").format(", ".join(failed)))
+            return False
+        def _copy():
+            links, failed = [], []
+            for path in paths:
+                name = os.path.basename(path)
+                try:
+                    links.append(attachments.markup(name, store.add(path)))
+                except OSError:
+                    failed.append(name)
+            GLib.idle_add(_insert, links, failed)
+        threading.Thread(target=_copy, daemon=True).start()
+
+    def get_body(self):
+        """Returns the text of the note's buffer"""
+        return self.bbody.get_text(self.bbody.get_start_iter(),
+            self.bbody.get_end_iter(), True)
+
+    def set_body(self, body):
+        """Replaces the text of the note's buffer"""
+        self.bbody.begin_not_undoable_action()
+        self.bbody.set_text(body)
+        self.bbody.end_not_undoable_action()
+        self.bbody.set_modified(False)
+
+    def set_markdown(self, enabled):
+        """Turns Markdown rendering of the buffer on or off"""
+        if enabled and self.markdown is None:
+            self.markdown = MarkdownHighlighter(self.bbody)
+        elif not enabled and self.markdown is not None:
+            self.markdown.detach()
+            self.markdown = None
 
     def move(self, widget, event):
         """Action to begin moving (by dragging) the window"""
@@ -159,10 +365,39 @@ class StickyNote:
                 event.button, event.x_root, event.y_root, event.get_time())
         return True
 
+    def configured(self, *args):
+        """Action when the window is moved or resized.
+
+        A drag emits a stream of configure events; the geometry is only
+        recorded once the window has settled, so a whole drag becomes a
+        single update of the note."""
+        self.last_configure = GLib.get_monotonic_time()
+        if self.geometry_source is None:
+            self.geometry_source = GLib.timeout_add(GEOMETRY_SETTLE_MS,
+                    self.record_geometry)
+        return False
+
+    def record_geometry(self):
+        """Stores the window geometry in the note once it has settled"""
+        elapsed = (GLib.get_monotonic_time() - self.last_configure) / 1000
+        if elapsed < GEOMETRY_SETTLE_MS:
+            return True
+        self.geometry_source = None
+        if self.winMain.get_visible() and self.note.set_geometry(
+                self.winMain.get_position(), self.winMain.get_size()):
+            self.noteset.indicator.schedule_save()
+        return False
+
+    def place(self, position):
+        """Moves the window to position"""
+        self.winMain.move(*position)
+
     def properties(self):
         """Get properties of the current note"""
-        prop = {"position":self.winMain.get_position(),
-                "size":self.winMain.get_size(), "locked":self.locked}
+        # Keep properties that aren't window state, such as reminders
+        prop = dict(self.note.properties)
+        prop.update({"position":self.winMain.get_position(),
+                "size":self.winMain.get_size(), "locked":self.locked})
         if not self.winMain.get_visible():
             prop["position"] = self.note.properties.get("position", (10, 10))
             prop["size"] = self.note.properties.get("size", (200, 150))
@@ -176,15 +411,21 @@ class StickyNote:
                 self.note.cat_prop("font"))
         self.txtNote.override_font(font)
 
+    @metrics.timed("update_style")
     def update_style(self):
         """Updates the style using CSS template"""
         self.update_button_color()
         css_string = self.css_template.substitute(**self.css_data())\
                 .encode("ascii", "replace")
-        self.css.load_from_data(css_string)
+        provider = css_provider(css_string)
+        if provider is self.css:
+            return
         for context in self.style_contexts:
-            context.add_provider(self.css,
+            if self.css is not None:
+                context.remove_provider(self.css)
+            context.add_provider(provider,
                     Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+        self.css = provider
 
     def update_button_color(self):
         """Switches between regular and dark icons appropriately"""
@@ -195,9 +436,8 @@ class StickyNote:
         iconfiles = {"imgAdd":"add", "imgClose":"close", "imgDropdown":"menu",
                 "imgLock":"lock", "imgUnlock":"unlock", "imgResizeR":"resizer"}
         for img, filename in iconfiles.items():
-            getattr(self, img).set_from_file(
-                    os.path.join(os.path.dirname(__file__), "..","Icons/" +
-                    filename + suffix + ".png"))
+            getattr(self, img).set_from_pixbuf(
+                    icon_pixbuf(filename + suffix + ".png"))
 
     def css_data(self):
         """Returns data to substitute into the CSS template"""
@@ -213,16 +453,74 @@ class StickyNote:
         return data
 
     def populate_menu(self):
+        """Marks the note's menu to be (re)populated when it next pops up"""
+        self.menu_stale = True
+
+    def build_menu(self):
         """(Re)populates the note's menu items appropriately"""
+        self.menu_stale = False
         def _delete_menu_item(item, *args):
             self.menu.remove(item)
         self.menu.foreach(_delete_menu_item, None)
 
         aot = Gtk.CheckMenuItem.new_with_label(_("Always on top"))
+        aot.set_active(self.note.properties.get("keep_above", False))
         aot.connect("toggled", self.malways_on_top_toggled)
         self.menu.append(aot)
         aot.show()
 
+        msticky = Gtk.CheckMenuItem.new_with_label(_("On all workspaces"))
+        msticky.set_active(self.note.properties.get("sticky", False))
+        msticky.connect("toggled", self.sticky_toggled)
+        self.menu.append(msticky)
+        msticky.show()
+
+        mopacity = Gtk.MenuItem(_("Opacity"))
+        opacitymenu = Gtk.Menu()
+        opacitygroup = []
+        for level in OPACITY_LEVELS:
+            mitem = Gtk.RadioMenuItem.new_with_label(opacitygroup,
+                    "{:.0%}".format(level))
+            opacitygroup = mitem.get_group()
+            if level == self.note.properties.get("opacity", 1.0):
+                mitem.set_active(True)
+            mitem.connect("activate", self.set_opacity, level)
+            opacitymenu.append(mitem)
+        mopacity.set_submenu(opacitymenu)
+        self.menu.append(mopacity)
+        mopacity.show_all()
+
+        mmark = Gtk.CheckMenuItem.new_with_label(_("Marked for Bulk Actions"))
+        mmark.set_active(self.note in self.noteset.marked)
+        mmark.connect("toggled", self.mark_toggled)
+        self.menu.append(mmark)
+        mmark.show()
+
+        mmd = Gtk.CheckMenuItem.new_with_label(_("Markdown"))
+        mmd.set_active(self.markdown is not None)
+        mmd.connect("toggled", self.markdown_toggled)
+        self.menu.append(mmd)
+        mmd.show()
+
+        if self.noteset.cipher.unlocked:
+            menc = Gtk.CheckMenuItem.new_with_label(_("Encrypted"))
+            menc.set_active(self.note.encrypted())
+            menc.set_sensitive(
+                    not self.noteset.properties.get("encrypt_all", False))
+            menc.connect("toggled", self.encrypted_toggled)
+            self.menu.append(menc)
+            menc.show()
+
+        mattach = Gtk.MenuItem(_("Attach Files..."))
+        mattach.connect("activate", self.attach_files)
+        self.menu.append(mattach)
+        mattach.show()
+
+        mrem = Gtk.MenuItem(_("Reminder..."))
+        mrem.connect("activate", self.edit_reminder)
+        self.menu.append(mrem)
+        mrem.show()
+
         mset = Gtk.MenuItem(_("Settings"))
         mset.connect("activate", self.noteset.indicator.show_settings)
         self.menu.append(mset)
@@ -250,27 +548,74 @@ class StickyNote:
             self.menu.append(mitem)
             mitem.show()
 
+        if not self.noteset.open_notebooks:
+            return
+        sep = Gtk.SeparatorMenuItem()
+        self.menu.append(sep)
+        sep.show()
+
+        bookgroup = []
+        mbooks = Gtk.RadioMenuItem.new_with_label(bookgroup, _("Notebooks:"))
+        self.menu.append(mbooks)
+        mbooks.set_sensitive(False)
+        bookgroup = mbooks.get_group()
+        mbooks.show()
+
+        for name in [""] + sorted(self.noteset.open_notebooks):
+            mitem = Gtk.RadioMenuItem.new_with_label(bookgroup,
+                    name or _("Main"))
+            bookgroup = mitem.get_group()
+            if name == self.note.notebook:
+                mitem.set_active(True)
+            mitem.connect("activate", self.set_notebook, name)
+            self.menu.append(mitem)
+            mitem.show()
+
     def malways_on_top_toggled(self, widget, *args):
+        self.note.properties["keep_above"] = widget.get_active()
         self.winMain.set_keep_above(widget.get_active())
+        self.save()
+
+    def sticky_toggled(self, widget, *args):
+        self.note.properties["sticky"] = widget.get_active()
+        if widget.get_active():
+            self.winMain.stick()
+        else:
+            self.winMain.unstick()
+        self.save()
+
+    def set_opacity(self, widget, level):
+        if widget.get_active() and \
+                level != self.note.properties.get("opacity", 1.0):
+            self.note.properties["opacity"] = level
+            self.winMain.set_opacity(level)
+            self.save()
 
     def save(self, *args):
-        self.note.noteset.save()
+        self.noteset.indicator.save()
         return False
 
     def add(self, *args):
-        new_note = self.note.noteset.new()
+        # Place the new note below this note, or in the nearest free space
+        x, y = self.winMain.get_position()
+        new_note = self.note.noteset.new(area=work_area_at(x, y),
+                start=(x, y + self.winMain.get_allocation().height + 10),
+                notebook=self.note.notebook)
 
         # Set the new note to the current category
         new_note.gui.set_category(None, self.note.category)
         new_note.gui.populate_menu()  # Fix Category Menu Selected indicator
 
-        # Set the new note position below this note
-        w, h = self.note.properties.get("position", (10, 10))
-        h += self.winMain.get_allocation().height + 10
-        new_note.gui.winMain.move(w, h)
-
         return False
 
+    def dropped(self, widget, context, x, y, data, info, time):
+        """Captures text or files dropped on the add button"""
+        uris = data.get_uris()
+        if uris:
+            self.noteset.indicator.capture_files(uris)
+        else:
+            self.noteset.indicator.capture_text(data.get_text())
+
     def delete(self, *args):
         """Delete note (move to archive) with optional confirmation dialog"""
         confirm_delete = self.noteset.properties.get("confirm_delete", False)
@@ -293,6 +638,8 @@ class StickyNote:
 
     def popup_menu(self, button, *args):
         """Pops up the note's menu"""
+        if self.menu_stale:
+            self.build_menu()
         self.menu.popup(None, None, None, None, Gdk.BUTTON_PRIMARY, 
                 Gtk.get_current_event_time())
 
@@ -304,6 +651,31 @@ class StickyNote:
         self.update_style()
         self.update_font()
 
+    def mark_toggled(self, widget, *args):
+        if widget.get_active():
+            self.noteset.marked.add(self.note)
+        else:
+            self.noteset.marked.discard(self.note)
+
+    def markdown_toggled(self, widget, *args):
+        self.note.properties["markdown"] = widget.get_active()
+        self.set_markdown(widget.get_active())
+        self.save()
+
+    def encrypted_toggled(self, widget, *args):
+        self.note.properties["encrypted"] = widget.get_active()
+        self.save()
+
+    def edit_reminder(self, *args):
+        """Shows the reminder dialog for this note"""
+        ReminderDialog(self.note)
+
+    def set_notebook(self, widget, name):
+        """Move the note to another open notebook"""
+        if widget.get_active() and name != self.note.notebook:
+            self.note.notebook = name
+            self.save()
+
     def set_locked_state(self, locked):
         """Change the locked state of the stickynote"""
         self.locked = locked
@@ -318,6 +690,10 @@ class StickyNote:
         """Toggle the locked state of the note"""
         self.set_locked_state(not self.locked)
 
+    def focus_in(self, *args):
+        self.note.raised()
+        return False
+
     def focus_out(self, *args):
         self.save(*args)
 
@@ -331,6 +707,95 @@ def show_about_dialog():
     winAbout.destroy()
     return ret
 
+def ask_name(title, message):
+    """Asks for a name. Returns it stripped, or None if the dialog is
+    cancelled or the name is empty."""
+    winName = Gtk.MessageDialog(None, None, Gtk.MessageType.QUESTION,
+            Gtk.ButtonsType.OK_CANCEL, message)
+    winName.set_title(title)
+    winName.set_default_response(Gtk.ResponseType.OK)
+    eName = Gtk.Entry()
+    eName.set_activates_default(True)
+    winName.get_message_area().pack_end(eName, False, False, 0)
+    eName.show()
+    resp = winName.run()
+    name = eName.get_text().strip()
+    winName.destroy()
+    if resp == Gtk.ResponseType.OK and name:
+        return name
+    return None
+
+def ask_passphrase(message, confirm=False):
+    """Asks for a passphrase (twice, if confirm is set). Returns None if
+    the dialog is cancelled."""
+    winPass = Gtk.MessageDialog(None, None, Gtk.MessageType.QUESTION,
+            Gtk.ButtonsType.OK_CANCEL, message)
+    winPass.set_title(_("Encryption"))
+    winPass.set_default_response(Gtk.ResponseType.OK)
+    entries = [Gtk.Entry() for i in range(2 if confirm else 1)]
+    for entry in entries:
+        entry.set_visibility(False)
+        entry.set_activates_default(True)
+        winPass.get_message_area().pack_start(entry, False, False, 0)
+        entry.show()
+    while True:
+        resp = winPass.run()
+        passphrase = entries[0].get_text()
+        if resp != Gtk.ResponseType.OK:
+            passphrase = None
+        elif not passphrase or (confirm and
+                entries[1].get_text() != passphrase):
+            winPass.format_secondary_text(
+                    _("The passphrases are empty or don't match."))
+            continue
+        winPass.destroy()
+        return passphrase
+
+def unlock_noteset(noteset):
+    """Asks for the passphrase until it is right or the user gives up.
+    Returns whether the note set was unlocked."""
+    message = _("Enter the passphrase for your encrypted notes:")
+    while noteset.needs_unlock():
+        passphrase = ask_passphrase(message)
+        if passphrase is None:
+            return False
+        if not noteset.unlock(passphrase):
+            message = _("Wrong passphrase. Try again:")
+    return True
+
+class EncryptionDialog:
+    """Sets up encryption and whether all notes are encrypted"""
+    def __init__(self, noteset):
+        self.noteset = noteset
+        if not crypto.available():
+            winError = Gtk.MessageDialog(None, None, Gtk.MessageType.ERROR,
+                    Gtk.ButtonsType.CLOSE, _("Encryption requires the "
+                        "python3-cryptography package."))
+            winError.run()
+            winError.destroy()
+            return
+        if "encryption" not in noteset.properties:
+            passphrase = ask_passphrase(_("Choose a passphrase for "
+                "encrypting notes. It can't be recovered if you forget it."),
+                confirm=True)
+            if passphrase is None:
+                return
+            noteset.enable_encryption(passphrase)
+        elif not unlock_noteset(noteset):
+            return
+        winEnc = Gtk.MessageDialog(None, None, Gtk.MessageType.QUESTION,
+                Gtk.ButtonsType.CLOSE, _("Notes can be encrypted one by one "
+                    "from their menus, or all at once."))
+        winEnc.set_title(_("Encryption"))
+        chkAll = Gtk.CheckButton(label=_("Encrypt all notes"))
+        chkAll.set_active(noteset.properties.get("encrypt_all", False))
+        winEnc.get_message_area().pack_start(chkAll, False, False, 0)
+        chkAll.show()
+        winEnc.run()
+        noteset.properties["encrypt_all"] = chkAll.get_active()
+        winEnc.destroy()
+        noteset.save()
+
 class SettingsCategory:
     """Widgets that handle properties of a category"""
     def __init__(self, settingsdialog, cat):
@@ -389,16 +854,16 @@ class SettingsCategory:
         """Make this the default category"""
         self.noteset.properties["default_cat"] = self.cat
         self.settingsdialog.refresh_category_titles()
-        for note in self.noteset.notes:
-            note.gui.update_style()
-            note.gui.update_font()
+        for gui in self.noteset.guis():
+            gui.update_style()
+            gui.update_font()
 
     def eName_changed(self, *args):
         """Update a category name"""
         self.noteset.categories[self.cat]["name"] = self.eName.get_text()
         self.refresh_title()
-        for note in self.noteset.notes:
-            note.gui.populate_menu()
+        for gui in self.noteset.guis():
+            gui.populate_menu()
 
     def update_bg(self, *args):
         """Action to update the background color"""
@@ -411,8 +876,8 @@ class SettingsCategory:
             # https://bugzilla.gnome.org/show_bug.cgi?id=687633 
         hsv = colorsys.rgb_to_hsv(rgba.red, rgba.green, rgba.blue)
         self.noteset.categories[self.cat]["bgcolor_hsv"] = hsv
-        for note in self.noteset.notes:
-            note.gui.update_style()
+        for gui in self.noteset.guis():
+            gui.update_style()
         # Remind some widgets that they are transparent, etc.
         load_global_css()
 
@@ -425,15 +890,15 @@ class SettingsCategory:
             self.cbText.get_rgba(rgba)
         self.noteset.categories[self.cat]["textcolor"] = \
                 [rgba.red, rgba.green, rgba.blue]
-        for note in self.noteset.notes:
-            note.gui.update_style()
+        for gui in self.noteset.guis():
+            gui.update_style()
 
     def update_font(self, *args):
         """Action to update the font size"""
         self.noteset.categories[self.cat]["font"] = \
             self.fbFont.get_font_name()
-        for note in self.noteset.notes:
-            note.gui.update_font()
+        for gui in self.noteset.guis():
+            gui.update_font()
 
 class SettingsDialog:
     """Manages the GUI of the settings dialog"""
@@ -452,6 +917,7 @@ class SettingsDialog:
         
         # Add archive settings
         self.add_archive_settings()
+        self.add_window_settings()
         
         for c in self.noteset.categories:
             self.add_category_widgets(c)
@@ -475,10 +941,10 @@ class SettingsDialog:
         del self.noteset.categories[cat]
         self.categories[cat].catExpander.destroy()
         del self.categories[cat]
-        for note in self.noteset.notes:
-            note.gui.populate_menu()
-            note.gui.update_style()
-            note.gui.update_font()
+        for gui in self.noteset.guis():
+            gui.populate_menu()
+            gui.update_style()
+            gui.update_font()
     
     def add_archive_settings(self):
         """Add archive configuration widgets"""
@@ -535,6 +1001,40 @@ class SettingsDialog:
         content_area.reorder_child(frame, 0)
         frame.show_all()
     
+    def add_window_settings(self):
+        """Add the setting for how many note windows are kept"""
+        frame = Gtk.Frame(label=_("Memory"))
+        frame.set_margin_start(10)
+        frame.set_margin_end(10)
+        frame.set_margin_bottom(10)
+
+        hbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        hbox.set_margin_top(10)
+        hbox.set_margin_bottom(10)
+        hbox.set_margin_start(10)
+        hbox.set_margin_end(10)
+        label = Gtk.Label(label=_("Windows kept for hidden notes:"))
+        label.set_xalign(0)
+        spin_windows = Gtk.SpinButton()
+        spin_windows.set_range(0, 1000)
+        spin_windows.set_increments(1, 10)
+        spin_windows.set_value(self.noteset.properties.get("max_windows",
+            DEFAULT_MAX_WINDOWS))
+        spin_windows.connect("value-changed", self.on_max_windows_changed)
+        hbox.pack_start(label, True, True, 0)
+        hbox.pack_start(spin_windows, False, False, 0)
+        frame.add(hbox)
+
+        content_area = self.wSettings.get_content_area()
+        content_area.pack_start(frame, False, False, 0)
+        content_area.reorder_child(frame, 1)
+        frame.show_all()
+
+    def on_max_windows_changed(self, spinbutton):
+        self.noteset.properties["max_windows"] = int(spinbutton.get_value())
+        self.noteset.evict_guis()
+        self.noteset.save()
+
     def on_retention_changed(self, spinbutton):
         """Update retention days setting"""
         self.noteset.properties["trash_retention_days"] = int(spinbutton.get_value())
@@ -553,6 +1053,304 @@ class SettingsDialog:
         for cid, catsettings in self.categories.items():
             catsettings.refresh_title()
 
+class BulkDialog:
+    """Dialog to apply an action to a selection of notes at once"""
+    def __init__(self, noteset):
+        self.noteset = noteset
+        self.wBulk = Gtk.Dialog(_("Bulk Actions"), None, Gtk.DialogFlags.MODAL)
+        self.wBulk.add_button(_("Close"), Gtk.ResponseType.CLOSE)
+        self.wBulk.add_button(_("Apply"), Gtk.ResponseType.APPLY)
+
+        grid = Gtk.Grid(column_spacing=6, row_spacing=6)
+        grid.set_margin_top(10)
+        grid.set_margin_bottom(10)
+        grid.set_margin_start(10)
+        grid.set_margin_end(10)
+
+        self.cbCategory = Gtk.ComboBoxText()
+        self.cbCategory.append("", _("Any category"))
+        for cid, cdata in noteset.categories.items():
+            self.cbCategory.append(cid, cdata.get("name", _("New Category")))
+        self.cbCategory.set_active(0)
+        self.cbTag = Gtk.ComboBoxText()
+        self.cbTag.append("", _("Any tag"))
+        for tag in noteset.tags.tags():
+            self.cbTag.append(tag, "#" + tag)
+        self.cbTag.set_active(0)
+        self.eSearch = Gtk.Entry()
+        self.eSearch.set_placeholder_text(_("Containing text"))
+        self.chkMarked = Gtk.CheckButton(label=_("Only marked notes"))
+        self.cbAction = Gtk.ComboBoxText()
+        for action, label in [("lock", _("Lock")), ("unlock", _("Unlock")),
+                ("category", _("Move to category")),
+                ("archive", _("Archive")),
+                ("restore", _("Restore from archive")),
+                ("export", _("Export"))]:
+            self.cbAction.append(action, label)
+        self.cbAction.set_active(0)
+        self.cbTarget = Gtk.ComboBoxText()
+        for cid, cdata in noteset.categories.items():
+            self.cbTarget.append(cid, cdata.get("name", _("New Category")))
+        self.cbTarget.set_active(0)
+        self.lStatus = Gtk.Label()
+
+        for row, (label, widget) in enumerate([
+                (_("Category:"), self.cbCategory), (_("Tag:"), self.cbTag),
+                (_("Text:"), self.eSearch), (None, self.chkMarked),
+                (_("Action:"), self.cbAction),
+                (_("Target category:"), self.cbTarget),
+                (None, self.lStatus)]):
+            if label:
+                lwidget = Gtk.Label(label=label)
+                lwidget.set_xalign(0)
+                grid.attach(lwidget, 0, row, 1, 1)
+            grid.attach(widget, 1, row, 1, 1)
+        self.wBulk.get_content_area().pack_start(grid, True, True, 0)
+        self.wBulk.show_all()
+
+        while self.wBulk.run() == Gtk.ResponseType.APPLY:
+            self.apply()
+        self.wBulk.destroy()
+
+    def selection(self):
+        """Returns the notes matching the criteria in the dialog"""
+        return self.noteset.select(
+                category=self.cbCategory.get_active_id() or None,
+                tag=self.cbTag.get_active_id() or None,
+                query=self.eSearch.get_text() or None,
+                marked=self.chkMarked.get_active())
+
+    def apply(self):
+        """Applies the chosen action to the selection, saving once"""
+        selection = self.selection()
+        action = self.cbAction.get_active_id()
+        count = len(selection.archived if action == "restore" else
+                selection.notes)
+        if action == "lock":
+            selection.lock(True)
+        elif action == "unlock":
+            selection.lock(False)
+        elif action == "category":
+            if self.cbTarget.get_active_id() is None:
+                return
+            selection.set_category(self.cbTarget.get_active_id())
+        elif action == "archive":
+            selection.archive()
+        elif action == "restore":
+            selection.restore()
+        elif action == "export":
+            winChoose = Gtk.FileChooserDialog(_("Export Data"), self.wBulk,
+                    Gtk.FileChooserAction.SAVE, (Gtk.STOCK_CANCEL,
+                        Gtk.ResponseType.CANCEL, Gtk.STOCK_SAVE,
+                        Gtk.ResponseType.ACCEPT))
+            winChoose.set_do_overwrite_confirmation(True)
+            response = winChoose.run()
+            path = winChoose.get_filename()
+            winChoose.destroy()
+            if response != Gtk.ResponseType.ACCEPT or not path:
+                return
+            selection.export(path)
+        self.noteset.indicator.save()
+        self.lStatus.set_text(_("{0} notes affected").format(count))
+
+class ReminderDialog:
+    """Dialog to set or clear a note's reminder"""
+    REPEATS = [0, 1, 7]
+
+    def __init__(self, note):
+        self.note = note
+        self.wReminder = Gtk.Dialog(_("Reminder"), note.gui.winMain
+                if note.gui else None, Gtk.DialogFlags.MODAL)
+        self.wReminder.add_button(_("Clear"), Gtk.ResponseType.REJECT)
+        self.wReminder.add_button(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL)
+        self.wReminder.add_button(Gtk.STOCK_OK, Gtk.ResponseType.OK)
+
+        reminder = note.properties.get("reminder")
+        due = reminders.parse(reminder) if reminder else datetime.now()
+
+        vbox = self.wReminder.get_content_area()
+        vbox.set_spacing(6)
+        self.calendar = Gtk.Calendar()
+        self.calendar.select_month(due.month - 1, due.year)
+        self.calendar.select_day(due.day)
+        vbox.pack_start(self.calendar, False, False, 0)
+
+        hbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        hbox.pack_start(Gtk.Label(label=_("Time:")), False, False, 0)
+        self.spin_hour = Gtk.SpinButton.new_with_range(0, 23, 1)
+        self.spin_hour.set_value(due.hour)
+        self.spin_minute = Gtk.SpinButton.new_with_range(0, 59, 1)
+        self.spin_minute.set_value(due.minute)
+        hbox.pack_start(self.spin_hour, False, False, 0)
+        hbox.pack_start(Gtk.Label(label=":"), False, False, 0)
+        hbox.pack_start(self.spin_minute, False, False, 0)
+        vbox.pack_start(hbox, False, False, 0)
+
+        self.cbRepeat = Gtk.ComboBoxText()
+        for label in [_("Once"), _("Every day"), _("Every week")]:
+            self.cbRepeat.append_text(label)
+        repeat = reminder.get("repeat_days", 0) if reminder else 0
+        self.cbRepeat.set_active(self.REPEATS.index(repeat)
+                if repeat in self.REPEATS else 0)
+        vbox.pack_start(self.cbRepeat, False, False, 0)
+
+        self.wReminder.show_all()
+        response = self.wReminder.run()
+        if response == Gtk.ResponseType.OK:
+            year, month, day = self.calendar.get_date()
+            due = datetime(year, month + 1, day,
+                    self.spin_hour.get_value_as_int(),
+                    self.spin_minute.get_value_as_int())
+            note.set_reminder(reminders.make(due,
+                self.REPEATS[self.cbRepeat.get_active()]))
+        elif response == Gtk.ResponseType.REJECT:
+            note.set_reminder(None)
+        self.wReminder.destroy()
+        if response in (Gtk.ResponseType.OK, Gtk.ResponseType.REJECT):
+            note.noteset.indicator.schedule_reminders()
+            note.noteset.save()
+
+class SyncDialog:
+    """Dialog to configure syncing with another instance"""
+    def __init__(self, noteset):
+        props = noteset.properties
+        self.wSync = Gtk.Dialog(_("Sync Settings"), None,
+                Gtk.DialogFlags.MODAL)
+        self.wSync.add_button(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL)
+        self.wSync.add_button(Gtk.STOCK_OK, Gtk.ResponseType.OK)
+
+        grid = Gtk.Grid(row_spacing=6, column_spacing=6)
+        self.ePeer = Gtk.Entry(text=props.get("sync_peer", ""))
+        self.ePeer.set_placeholder_text(_("host or host:port"))
+        self.eSecret = Gtk.Entry(text=props.get("sync_secret", ""))
+        self.eSecret.set_visibility(False)
+        self.chkListen = Gtk.CheckButton(
+                label=_("Accept sync connections from other computers"))
+        self.chkListen.set_active(props.get("sync_listen", False))
+        grid.attach(Gtk.Label(label=_("Sync with:"), xalign=0), 0, 0, 1, 1)
+        grid.attach(self.ePeer, 1, 0, 1, 1)
+        grid.attach(Gtk.Label(label=_("Shared secret:"), xalign=0),
+                0, 1, 1, 1)
+        grid.attach(self.eSecret, 1, 1, 1, 1)
+        grid.attach(self.chkListen, 0, 2, 2, 1)
+        grid.attach(Gtk.Label(label=_("Notes are sent unencrypted; only "
+            "sync on networks you trust. Encrypted notes are not synced."),
+            wrap=True, max_width_chars=40, xalign=0), 0, 3, 2, 1)
+        self.wSync.get_content_area().pack_start(grid, True, True, 6)
+
+        self.wSync.show_all()
+        if self.wSync.run() == Gtk.ResponseType.OK:
+            props["sync_peer"] = self.ePeer.get_text().strip()
+            props["sync_secret"] = self.eSecret.get_text()
+            # An empty secret would let anyone on the network sync
+            props["sync_listen"] = self.chkListen.get_active() and \
+                    bool(props["sync_secret"])
+            noteset.save()
+        self.wSync.destroy()
+
+class ProgressDialog:
+    """Small non-modal window reporting the progress of a long task. If
+    cancel is given, a Cancel button calls it."""
+    def __init__(self, title, cancel=None):
+        self.wProgress = Gtk.Window(title=title)
+        self.wProgress.set_default_size(350, -1)
+        self.wProgress.set_resizable(False)
+        vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        vbox.set_margin_top(10)
+        vbox.set_margin_bottom(10)
+        vbox.set_margin_start(10)
+        vbox.set_margin_end(10)
+        self.pbProgress = Gtk.ProgressBar()
+        self.pbProgress.set_show_text(True)
+        vbox.pack_start(self.pbProgress, False, False, 0)
+        if cancel is not None:
+            self.bCancel = Gtk.Button(label=_("Cancel"))
+            self.bCancel.connect("clicked", self.cancel_clicked, cancel)
+            self.bCancel.set_halign(Gtk.Align.END)
+            vbox.pack_start(self.bCancel, False, False, 0)
+            self.wProgress.connect("delete-event", self.cancel_clicked,
+                    cancel)
+        self.wProgress.add(vbox)
+        self.wProgress.show_all()
+
+    def cancel_clicked(self, widget, *args):
+        self.bCancel.set_sensitive(False)
+        self.pbProgress.set_text(_("Cancelling..."))
+        args[-1]()
+        return True
+
+    def set_fraction(self, fraction):
+        self.pbProgress.set_fraction(fraction)
+
+    def destroy(self):
+        self.wProgress.destroy()
+
+def show_transfer_report(message, report):
+    """Shows what went wrong during an import or export (see
+    stickynotes.transfer.TransferReport)"""
+    lines = []
+    if report.failure:
+        lines.append(report.failure)
+    if report.skipped:
+        lines.append(_("{} of {} records were skipped:").format(
+            report.skipped, report.skipped + report.records))
+        for line, error in report.errors:
+            lines.append(_("Line {}: {}").format(line, error))
+        if report.skipped > len(report.errors):
+            lines.append(_("...and {} more").format(
+                report.skipped - len(report.errors)))
+    winReport = Gtk.MessageDialog(None, None, Gtk.MessageType.ERROR
+            if report.failure else Gtk.MessageType.WARNING,
+            Gtk.ButtonsType.CLOSE, message)
+    winReport.format_secondary_text(report.path + "\n\n" + "\n".join(lines))
+    winReport.run()
+    winReport.destroy()
+
+class SnapshotDialog:
+    """Dialog listing snapshots of the note set, to roll back to one"""
+    def __init__(self, snapshots, restore):
+        self.wSnapshots = Gtk.Dialog(_("Snapshots"), None,
+                Gtk.DialogFlags.MODAL)
+        self.wSnapshots.set_default_size(400, 400)
+        scroll = Gtk.ScrolledWindow()
+        scroll.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        # id, time, number of changes
+        self.liststore = Gtk.ListStore(str, str, int)
+        for entry in snapshots:
+            when = datetime.strptime(entry["time"], "%Y-%m-%dT%H:%M:%S")
+            self.liststore.append([entry["id"],
+                when.strftime("%Y-%m-%d %H:%M"), entry["changes"]])
+        self.treeview = Gtk.TreeView(model=self.liststore)
+        renderer_text = Gtk.CellRendererText()
+        column_time = Gtk.TreeViewColumn(_("Taken"), renderer_text, text=1)
+        column_time.set_expand(True)
+        self.treeview.append_column(column_time)
+        self.treeview.append_column(Gtk.TreeViewColumn(_("Changes"),
+            renderer_text, text=2))
+        scroll.add(self.treeview)
+        self.wSnapshots.get_content_area().pack_start(scroll, True, True, 0)
+        self.wSnapshots.add_button(_("Close"), Gtk.ResponseType.CLOSE)
+        self.wSnapshots.add_button(_("Restore"), Gtk.ResponseType.ACCEPT)
+        self.wSnapshots.show_all()
+
+        while self.wSnapshots.run() == Gtk.ResponseType.ACCEPT:
+            model, treeiter = self.treeview.get_selection().get_selected()
+            if treeiter is None:
+                continue
+            winConfirm = Gtk.MessageDialog(self.wSnapshots, None,
+                    Gtk.MessageType.QUESTION, Gtk.ButtonsType.OK_CANCEL,
+                    _("Restore all notes to how they were at {}?").format(
+                        model[treeiter][1]))
+            winConfirm.format_secondary_text(_("Notes created since then "
+                "are moved to the archive. The current notes are "
+                "snapshotted first, so this can be undone."))
+            confirm = winConfirm.run()
+            winConfirm.destroy()
+            if confirm == Gtk.ResponseType.OK:
+                restore(model[treeiter][0])
+                break
+        self.wSnapshots.destroy()
+
 class ArchiveDialog:
     """Dialog to view and restore archived notes"""
     def __init__(self, noteset):
@@ -615,7 +1413,7 @@ class ArchiveDialog:
         archived = self.noteset.get_archived_notes()
         
         for note in archived:
-            body = note.get("body", "")
+            body = self.noteset.archived_body(note)
             # Create preview (first 50 chars)
             preview = body[:50].replace("\n", " ")
             if len(body) > 50:
@@ -663,10 +1461,7 @@ class ArchiveDialog:
             
             if confirm == Gtk.ResponseType.ACCEPT:
                 # Remove from archived notes
-                self.noteset.archived_notes = [
-                    n for n in self.noteset.archived_notes 
-                    if n.get("uuid") != uuid
-                ]
+                self.noteset.delete_archived_note(uuid)
                 self.noteset.save()
                 self.populate_list()
 
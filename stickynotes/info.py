@@ -4,6 +4,14 @@ LOCALE_DOMAIN = "indicator-stickynotes"
 
 SETTINGS_FILE = "~/.config/indicator-stickynotes"
 DEBUG_SETTINGS_FILE = "~/.stickynotes"
+# Notebooks other than the main one are stored in this directory, named
+# after the data file
+NOTEBOOK_DIR_SUFFIX = ".notebooks"
+SNAPSHOT_DIR_SUFFIX = ".snapshots"
+ATTACHMENT_DIR_SUFFIX = ".attachments"
+THUMBNAIL_DIR = "~/.cache/indicator-stickynotes/thumbnails"
+# Version of the data file format (see stickynotes.migrations)
+SCHEMA_VERSION = 2
 
 FALLBACK_PROPERTIES = { "bgcolor_hsv": [48./360, 1, 1],
                         "textcolor": [32./255, 32./255, 32./255],
@@ -13,3 +21,36 @@ FALLBACK_PROPERTIES = { "bgcolor_hsv": [48./360, 1, 1],
 # Archive settings (default values)
 DEFAULT_TRASH_RETENTION_DAYS = 30
 DEFAULT_CONFIRM_DELETE = False
+# Hidden notes beyond this many windows have their GUI torn down, least
+# recently hidden first
+DEFAULT_MAX_WINDOWS = 50
+
+# Captured files larger than this become a link to the file rather than a
+# note holding its text
+CAPTURE_MAX_BYTES = 64 * 1024
+
+# Side of the square attached images are scaled down to fit, and how much
+# disk space their thumbnails may take
+THUMBNAIL_SIZE = 96
+THUMBNAIL_CACHE_BYTES = 32 * 1024 * 1024
+
+# Window opacities offered in a note's menu
+OPACITY_LEVELS = (1.0, 0.9, 0.75, 0.5)
+
+# Geometry is recorded once a window has stopped moving for this long
+GEOMETRY_SETTLE_MS = 500
+# Delay between a change being recorded and the data file being written
+SAVE_DELAY_MS = 2000
+# Longest wait between checks for due reminders. Timers don't advance while
+# the machine is suspended, so this bounds how late a reminder can be.
+REMINDER_POLL_SECONDS = 60
+# TCP port instances listen on for sync sessions, and how long a session may
+# wait for its peer
+SYNC_PORT = 47110
+SYNC_TIMEOUT = 30
+# How long the versions of purged archived notes and deleted categories are
+# remembered, so peers that still have them can't bring them back
+SYNC_TOMBSTONE_DAYS = 90
+# How often the note set is snapshotted, and how long snapshots are kept
+SNAPSHOT_INTERVAL_SECONDS = 3600
+SNAPSHOT_RETENTION_DAYS = 7
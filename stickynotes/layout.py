@@ -0,0 +1,164 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Placement of note windows. Rectangles are (x, y, width, height) tuples
+and work areas are rectangles too."""
+
+# Side length of the cells of the spatial index, in pixels
+GRID_CELL = 256
+# Space left between notes
+NOTE_GAP = 10
+# Offset between consecutive notes when cascading
+CASCADE_STEP = 30
+
+DEFAULT_POSITION = (10, 10)
+DEFAULT_SIZE = (200, 150)
+
+def intersects(a, b):
+    """Whether two rectangles overlap"""
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and \
+            a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+def contains(area, rect):
+    """Whether rect lies completely inside area"""
+    return area[0] <= rect[0] and area[1] <= rect[1] and \
+            rect[0] + rect[2] <= area[0] + area[2] and \
+            rect[1] + rect[3] <= area[1] + area[3]
+
+def area_for(rect, areas):
+    """Returns the work area containing the centre of rect, or the first
+    area if it is outside all of them"""
+    cx, cy = rect[0] + rect[2] // 2, rect[1] + rect[3] // 2
+    for area in areas:
+        if contains(area, (cx, cy, 0, 0)):
+            return area
+    return areas[0]
+
+class SpatialIndex:
+    """Uniform grid of note rectangles for fast overlap queries"""
+    def __init__(self, cell=GRID_CELL):
+        self.cell = cell
+        self.rects = {}
+        self.cells = {}
+
+    def _cells(self, rect):
+        x, y, w, h = rect
+        for cx in range(x // self.cell, (x + max(w, 1) - 1) // self.cell + 1):
+            for cy in range(y // self.cell,
+                    (y + max(h, 1) - 1) // self.cell + 1):
+                yield cx, cy
+
+    def update(self, key, rect):
+        """Inserts or moves the rectangle of key"""
+        rect = tuple(int(v) for v in rect)
+        if self.rects.get(key) == rect:
+            return
+        self.remove(key)
+        self.rects[key] = rect
+        for c in self._cells(rect):
+            self.cells.setdefault(c, set()).add(key)
+
+    def remove(self, key):
+        rect = self.rects.pop(key, None)
+        if rect is None:
+            return
+        for c in self._cells(rect):
+            bucket = self.cells[c]
+            bucket.discard(key)
+            if not bucket:
+                del self.cells[c]
+
+    def query(self, rect):
+        """Returns the keys whose rectangles overlap rect"""
+        found = set()
+        for c in self._cells(rect):
+            for key in self.cells.get(c, ()):
+                if key not in found and intersects(self.rects[key], rect):
+                    found.add(key)
+        return found
+
+    def is_free(self, rect, gap=NOTE_GAP):
+        """Whether rect (grown by gap) overlaps no indexed rectangle"""
+        return not self.query((rect[0] - gap, rect[1] - gap,
+            rect[2] + 2 * gap, rect[3] + 2 * gap))
+
+    def find_free(self, size, area, start=None):
+        """Finds a position in area where a note of the given size overlaps
+        nothing, trying start first.
+
+        Candidate positions are the area's corner and the positions right
+        of and below every note in the area, scanned top to bottom."""
+        w, h = size
+        if start is not None and contains(area, (*start, w, h)) and \
+                self.is_free((*start, w, h)):
+            return tuple(start)
+        xs = {area[0] + NOTE_GAP}
+        ys = {area[1] + NOTE_GAP}
+        for key in self.query(area):
+            rx, ry, rw, rh = self.rects[key]
+            xs.add(rx + rw + NOTE_GAP)
+            ys.add(ry + rh + NOTE_GAP)
+        xs = sorted(xs)
+        for y in sorted(ys):
+            if y + h > area[1] + area[3]:
+                break
+            for x in xs:
+                if x + w > area[0] + area[2]:
+                    break
+                if self.is_free((x, y, w, h)):
+                    return x, y
+        # The area is full: fall back to the requested or default position
+        return tuple(start) if start is not None else \
+                (area[0] + DEFAULT_POSITION[0], area[1] + DEFAULT_POSITION[1])
+
+def tidy(sizes, area):
+    """Packs notes into rows across area. Returns a list of positions.
+
+    When the area is full, packing starts again from the top, offset so the
+    extra notes stay visible."""
+    positions = []
+    left, top = area[0] + NOTE_GAP, area[1] + NOTE_GAP
+    x, y, row_height, layer = left, top, 0, 0
+    for w, h in sizes:
+        if x + w > area[0] + area[2] and x > left:
+            x, y, row_height = left, y + row_height + NOTE_GAP, 0
+        if y + h > area[1] + area[3] and y > top:
+            layer += 1
+            x, y, row_height = left + layer * CASCADE_STEP, \
+                    top + layer * CASCADE_STEP, 0
+        positions.append((x, y))
+        x += w + NOTE_GAP
+        row_height = max(row_height, h)
+    return positions
+
+def cascade(sizes, area):
+    """Stacks notes diagonally from the top left of area. Returns a list of
+    positions."""
+    positions = []
+    left, top = area[0] + NOTE_GAP, area[1] + NOTE_GAP
+    x, y, column = left, top, 0
+    for w, h in sizes:
+        if y + h > area[1] + area[3] or x + w > area[0] + area[2]:
+            column += 1
+            x, y = left + column * CASCADE_STEP * 4, top
+            if x + w > area[0] + area[2]:
+                column = 0
+                x = left
+        positions.append((x, y))
+        x += CASCADE_STEP
+        y += CASCADE_STEP
+    return positions
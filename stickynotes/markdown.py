@@ -0,0 +1,120 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Lightweight Markdown rendering of note buffers with text tags.
+
+Only headings, checkboxes, bold text and links are rendered, and every rule
+applies within a single line. Edits therefore only re-tag the lines they
+touched, however long the note is."""
+
+import re
+
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import Pango
+
+from stickynotes import metrics
+
+# Tag names and properties. Headings are indexed by their level.
+TAGS = {
+    "md-h1": {"weight": Pango.Weight.BOLD, "scale": 1.6},
+    "md-h2": {"weight": Pango.Weight.BOLD, "scale": 1.3},
+    "md-h3": {"weight": Pango.Weight.BOLD, "scale": 1.1},
+    "md-bold": {"weight": Pango.Weight.BOLD},
+    "md-checkbox": {"family": "monospace"},
+    "md-done": {"strikethrough": True},
+    "md-link": {"underline": Pango.Underline.SINGLE},
+}
+
+# A space is required after the #s, so #tags aren't headings
+HEADING_RE = re.compile(r"^(#{1,3}) \S")
+CHECKBOX_RE = re.compile(r"^\s*[-*+] (\[([ xX])\])")
+BOLD_RE = re.compile(r"(\*\*|__)(?=\S)(.+?)(?<=\S)\1")
+LINK_RE = re.compile(r"\[[^\]\n]+\]\([^)\s]+\)|\b(?:https?|ftp)://[^\s<>]+")
+
+def spans(line):
+    """Returns (tag name, start, end) for the markup in a line of text"""
+    found = []
+    heading = HEADING_RE.match(line)
+    if heading:
+        found.append(("md-h{}".format(len(heading.group(1))), 0, len(line)))
+    checkbox = CHECKBOX_RE.match(line)
+    if checkbox:
+        found.append(("md-checkbox",) + checkbox.span(1))
+        if checkbox.group(2) in "xX":
+            found.append(("md-done", checkbox.end(1), len(line)))
+    for match in BOLD_RE.finditer(line):
+        found.append(("md-bold",) + match.span())
+    for match in LINK_RE.finditer(line):
+        found.append(("md-link",) + match.span())
+    return found
+
+class MarkdownHighlighter:
+    """Keeps the Markdown tags of a buffer up to date as it is edited"""
+    def __init__(self, buf):
+        self.buf = buf
+        table = buf.get_tag_table()
+        self.tags = {}
+        for name, props in TAGS.items():
+            # Tags stay in the buffer's table if Markdown is switched off
+            self.tags[name] = table.lookup(name) or \
+                    buf.create_tag(name, **props)
+        # The default handlers revalidate the iters to where the edit
+        # happened, so these run with the final line numbers
+        self.handlers = [buf.connect_after("insert-text", self.inserted),
+                buf.connect_after("delete-range", self.deleted)]
+        self.restyle(0, buf.get_line_count() - 1)
+
+    def disconnect(self):
+        """Stops following edits of the buffer"""
+        for handler in self.handlers:
+            self.buf.disconnect(handler)
+        self.handlers = []
+
+    def detach(self):
+        """Stops highlighting and removes all Markdown tags"""
+        self.disconnect()
+        start, end = self.buf.get_bounds()
+        for tag in self.tags.values():
+            self.buf.remove_tag(tag, start, end)
+
+    def inserted(self, buf, location, text, length):
+        end_line = location.get_line()
+        self.restyle(end_line - text.count("\n"), end_line)
+
+    def deleted(self, buf, start, end):
+        self.restyle(start.get_line(), start.get_line())
+
+    @metrics.timed("markdown.restyle")
+    def restyle(self, first, last):
+        """Re-tags lines first to last (inclusive)"""
+        buf = self.buf
+        # Tagging doesn't change the text, so it shouldn't look like an edit
+        modified = buf.get_modified()
+        for line in range(first, last + 1):
+            start = buf.get_iter_at_line(line)
+            end = start.copy()
+            if not end.ends_line():
+                end.forward_to_line_end()
+            for tag in self.tags.values():
+                buf.remove_tag(tag, start, end)
+            offset = start.get_offset()
+            for name, s, e in spans(buf.get_text(start, end, True)):
+                buf.apply_tag(self.tags[name],
+                        buf.get_iter_at_offset(offset + s),
+                        buf.get_iter_at_offset(offset + e))
+        buf.set_modified(modified)
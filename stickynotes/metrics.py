@@ -0,0 +1,132 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Timers and counters around the hot paths, for diagnosing stalls.
+
+Everything is off unless enable() is called; the instrumented functions
+then only pay for one global lookup. Samples are kept in bounded rolling
+windows, so memory use doesn't grow with uptime."""
+
+from collections import deque
+from functools import wraps
+import logging
+import socket
+import threading
+import time
+
+# Number of samples kept per metric
+WINDOW_SIZE = 512
+# Abstract socket on which a report is written to every client that connects
+SOCKET_NAME = "\0indicator-stickynotes-metrics"
+
+ENABLED = False
+_lock = threading.Lock()
+_samples = {}
+_events = {}
+_totals = {}
+log = logging.getLogger(__name__)
+
+def enable():
+    global ENABLED
+    ENABLED = True
+
+def record(name, value):
+    """Adds a sample (such as a duration in ms or a size in bytes)"""
+    if not ENABLED:
+        return
+    with _lock:
+        if name not in _samples:
+            _samples[name] = deque(maxlen=WINDOW_SIZE)
+        _samples[name].append(value)
+
+def count(name, n=1):
+    """Counts an occurrence of an event"""
+    if not ENABLED:
+        return
+    with _lock:
+        _totals[name] = _totals.get(name, 0) + n
+        if name not in _events:
+            _events[name] = deque(maxlen=WINDOW_SIZE)
+        _events[name].append(time.monotonic())
+
+def timed(name):
+    """Decorator recording the duration of each call, in ms, and counting
+    the calls"""
+    def _decorator(f):
+        @wraps(f)
+        def _wrapper(*args, **kwargs):
+            if not ENABLED:
+                return f(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                record(name, (time.perf_counter() - start) * 1000)
+                count(name)
+        return _wrapper
+    return _decorator
+
+def _percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+def summary():
+    """Returns a dictionary summarizing every metric"""
+    now = time.monotonic()
+    with _lock:
+        samples = {k: sorted(v) for k, v in _samples.items()}
+        events = {k: list(v) for k, v in _events.items()}
+        totals = dict(_totals)
+    data = {}
+    for name, values in samples.items():
+        if values:
+            data[name] = {"n": len(values), "mean": sum(values) / len(values),
+                    "p50": _percentile(values, 0.5),
+                    "p95": _percentile(values, 0.95), "max": values[-1]}
+    for name, total in totals.items():
+        data.setdefault(name, {})["total"] = total
+        data[name]["per_minute"] = sum(1 for t in events[name]
+                if now - t <= 60)
+    return data
+
+def report():
+    """Returns a human-readable report of every metric"""
+    lines = []
+    for name, stats in sorted(summary().items()):
+        lines.append(name + ": " + ", ".join("{}={:.6g}".format(k, v)
+            for k, v in stats.items()))
+    return "\n".join(lines) + "\n"
+
+def dump():
+    """Writes the report to the log"""
+    log.warning("Metrics:\n%s", report())
+
+def serve(name=SOCKET_NAME):
+    """Serves reports on a local socket from a daemon thread, e.g.
+    `socat - ABSTRACT-CONNECT:indicator-stickynotes-metrics`"""
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(name)
+    server.listen(1)
+    def _serve():
+        while True:
+            conn, addr = server.accept()
+            with conn:
+                try:
+                    conn.sendall(report().encode("utf-8"))
+                except OSError:
+                    pass
+    threading.Thread(target=_serve, daemon=True).start()
+    return server
@@ -0,0 +1,87 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Upgrades of data written by older versions.
+
+Data carries the version of its format in "version" (files without one are
+version 0). Each step upgrades from the version before it. Steps work on
+the top-level dictionary and on one note or archived note at a time, so
+all pending steps share a single pass over the notes, and batches of a data
+stream can be upgraded as they are read."""
+
+import hashlib
+import time
+
+from stickynotes.info import SCHEMA_VERSION, DEFAULT_TRASH_RETENTION_DAYS, \
+        DEFAULT_CONFIRM_DELETE
+
+class Step:
+    """Upgrade to version. data is called with the whole dictionary before
+    note and archived are called with each note or archived note and the
+    dictionary."""
+    def __init__(self, version, data=None, note=None, archived=None):
+        self.version = version
+        self.data = data
+        self.note = note
+        self.archived = archived
+
+def _v1_defaults(data):
+    """Properties added after the first release"""
+    properties = data.setdefault("properties", {})
+    properties.setdefault("trash_retention_days",
+            DEFAULT_TRASH_RETENTION_DAYS)
+    properties.setdefault("confirm_delete", DEFAULT_CONFIRM_DELETE)
+
+def _v2_archive_blobs(archived, data):
+    """Bodies of archived notes moved to a store shared by identical
+    bodies"""
+    if "body" in archived:
+        body = archived.pop("body")
+        digest = hashlib.sha256(body.encode("utf-8")).hexdigest()
+        data.setdefault("archive_blobs", {}).setdefault(digest, body)
+        archived["body_ref"] = digest
+
+STEPS = [
+    Step(1, data=_v1_defaults),
+    Step(2, archived=_v2_archive_blobs),
+]
+assert STEPS[-1].version == SCHEMA_VERSION
+
+def upgrade(data):
+    """Upgrades data in place to SCHEMA_VERSION. Returns the time each step
+    took in ms, by version; empty if data was already current."""
+    version = data.get("version", 0)
+    if version >= SCHEMA_VERSION:
+        return {}
+    steps = [step for step in STEPS if step.version > version]
+    timings = {step.version: 0.0 for step in steps}
+    for step in steps:
+        if step.data is not None:
+            start = time.perf_counter()
+            step.data(data)
+            timings[step.version] += (time.perf_counter() - start) * 1000
+    for kind, key in (("note", "notes"), ("archived", "archived_notes")):
+        pending = [step for step in steps if getattr(step, kind) is not None]
+        if not pending:
+            continue
+        for record in data.get(key, []):
+            for step in pending:
+                start = time.perf_counter()
+                getattr(step, kind)(record, data)
+                timings[step.version] += (time.perf_counter() - start) * 1000
+    data["version"] = SCHEMA_VERSION
+    return timings
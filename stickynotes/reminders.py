@@ -0,0 +1,93 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Queue of note reminders, ordered by due time.
+
+A reminder is stored in a note's properties as
+{"due": "%Y-%m-%dT%H:%M:%S", "repeat_days": n}, where a repeat of 0 fires
+only once."""
+
+from datetime import datetime, timedelta
+import heapq
+import itertools
+
+class ReminderQueue:
+    """Min-heap of (due, seq, note) entries.
+
+    Cancelled entries stay in the heap and are skipped when they reach the
+    top, so both scheduling and cancelling are O(log n)."""
+    def __init__(self):
+        self.heap = []
+        self.entries = {}
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def schedule(self, note, due):
+        """Schedules note at due, replacing any earlier entry for it"""
+        self.cancel(note)
+        entry = [due, next(self.counter), note]
+        self.entries[note] = entry
+        heapq.heappush(self.heap, entry)
+
+    def cancel(self, note):
+        entry = self.entries.pop(note, None)
+        if entry is not None:
+            entry[2] = None
+
+    def _prune(self):
+        while self.heap and self.heap[0][2] is None:
+            heapq.heappop(self.heap)
+
+    def next_due(self):
+        """Returns the earliest due time, or None if nothing is scheduled"""
+        self._prune()
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now):
+        """Removes and returns the notes due at or before now. Reminders
+        missed while the machine was asleep are returned once."""
+        due = []
+        self._prune()
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            del self.entries[entry[2]]
+            due.append(entry[2])
+            self._prune()
+        return due
+
+def parse(reminder):
+    """Returns the due time of a reminder property"""
+    return datetime.strptime(reminder["due"], "%Y-%m-%dT%H:%M:%S")
+
+def make(due, repeat_days=0):
+    """Returns a reminder property"""
+    return {"due": due.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat_days": repeat_days}
+
+def advance(reminder, now):
+    """Returns the reminder's next occurrence after now, or None if it
+    doesn't repeat. Occurrences missed in between are skipped."""
+    days = reminder.get("repeat_days", 0)
+    if days <= 0:
+        return None
+    due = parse(reminder)
+    if due <= now:
+        periods = (now - due) // timedelta(days=days) + 1
+        due += periods * timedelta(days=days)
+    return make(due, days)
@@ -0,0 +1,194 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Point-in-time snapshots of a note set.
+
+A snapshot is a state: a dictionary of entries keyed by "n:<uuid>" for
+notes, "a:<uuid>" for archived notes, "c:<id>" for categories and
+"m:notebooks" for the notebooks that were open. Most snapshots only store
+the entries that changed since the previous one and the keys that went
+away. Every KEYFRAME_INTERVAL snapshots a full state is stored instead, so
+restoring never replays a long chain and old snapshots can be dropped.
+
+Finding what changed relies on the sequence numbers that sync gives every
+change, plus a checksum of each note's properties, so preparing a snapshot
+in the main loop costs little more than extracting the changed notes.
+Compressing and writing happen in a worker thread."""
+
+from datetime import datetime, timedelta
+import gzip
+import json
+import os
+import threading
+import zlib
+
+from stickynotes.info import SNAPSHOT_RETENTION_DAYS
+
+# A full state is stored after this many incremental snapshots
+KEYFRAME_INTERVAL = 24
+INDEX_FILE = "index.json"
+
+class PendingSnapshot:
+    """Changes collected in the main loop, to be written by write()"""
+    def __init__(self, changed, removed, stamps):
+        self.time = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        self.changed = changed
+        self.removed = removed
+        self.stamps = stamps
+
+class SnapshotStore:
+    def __init__(self, directory):
+        self.directory = directory
+        # Held while the index or the snapshot files change
+        self.lock = threading.Lock()
+        try:
+            with open(os.path.join(directory, INDEX_FILE),
+                    encoding="utf-8") as fsock:
+                self.index = json.load(fsock)
+        except (OSError, ValueError):
+            self.index = {}
+        # Oldest first. Each has its id, time, whether it is full, and its
+        # number of changes.
+        self.index.setdefault("snapshots", [])
+        # Stamps of the entries as of the latest snapshot
+        self.index.setdefault("stamps", {})
+
+    def snapshots(self):
+        """Returns the snapshots, newest first"""
+        with self.lock:
+            return list(reversed(self.index["snapshots"]))
+
+    def prepare(self, noteset):
+        """Collects what changed since the last snapshot. Must run where
+        the note set may be used. Returns None if nothing changed."""
+        noteset.stamp_changes()
+        items = noteset.sync.items
+        with self.lock:
+            old = self.index["stamps"]
+        stamps = {}
+        changed = {}
+        def _check(key, stamp, data):
+            stamps[key] = stamp
+            if old.get(key) != stamp:
+                changed[key] = data()
+        for note in noteset.notes:
+            def _note_data(note=note):
+                data = note.extract(sealed=True)
+                if note.notebook:
+                    data["notebook"] = note.notebook
+                return data
+            _check("n:" + note.uuid, [items[note.uuid]["seq"],
+                zlib.crc32(json.dumps(note.properties, sort_keys=True)
+                    .encode("utf-8"))], _note_data)
+        for archived in noteset.archived_notes:
+            _check("a:" + archived["uuid"], [items[archived["uuid"]]["seq"]],
+                    lambda archived=archived:
+                    noteset.archived_note_data(archived))
+        for cid, cdata in noteset.categories.items():
+            _check("c:" + cid, [items[cid]["seq"]], lambda cdata=cdata:
+                    dict(cdata))
+        notebooks = sorted(noteset.open_notebooks)
+        _check("m:notebooks", notebooks, lambda: notebooks)
+        removed = [key for key in old if key not in stamps]
+        if not changed and not removed:
+            return None
+        # Serialize now: the note set may change before the worker runs
+        return PendingSnapshot(json.loads(json.dumps(changed)), removed,
+                stamps)
+
+    def _path(self, snapshot_id):
+        return os.path.join(self.directory, snapshot_id + ".json.gz")
+
+    def _load(self, snapshot_id):
+        with gzip.open(self._path(snapshot_id), "rt",
+                encoding="utf-8") as fsock:
+            return json.load(fsock)
+
+    def _write_json(self, path, data, compress):
+        opener = gzip.open if compress else open
+        with opener(path + ".tmp", "wt", encoding="utf-8") as fsock:
+            json.dump(data, fsock)
+        os.replace(path + ".tmp", path)
+
+    def write(self, pending):
+        """Stores a prepared snapshot. Meant for a worker thread."""
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            entries = self.index["snapshots"]
+            since_full = 0
+            for entry in reversed(entries):
+                if entry["full"]:
+                    break
+                since_full += 1
+            full = not entries or since_full + 1 >= KEYFRAME_INTERVAL
+            if full:
+                state = self._state_at(len(entries) - 1) if entries else {}
+                state.update(pending.changed)
+                for key in pending.removed:
+                    state.pop(key, None)
+                data = {"time": pending.time, "set": state, "removed": []}
+            else:
+                data = {"time": pending.time, "set": pending.changed,
+                        "removed": pending.removed}
+            snapshot_id = pending.time.replace(":", "").replace("-", "")
+            if entries and entries[-1]["id"].startswith(snapshot_id):
+                snapshot_id += "-{}".format(len(entries))
+            self._write_json(self._path(snapshot_id), data, True)
+            entries.append({"id": snapshot_id, "time": pending.time,
+                "full": full, "changes": len(pending.changed) +
+                len(pending.removed)})
+            self.index["stamps"] = pending.stamps
+            self._prune()
+            self._write_json(os.path.join(self.directory, INDEX_FILE),
+                    self.index, False)
+
+    def _prune(self):
+        """Drops the oldest run of snapshots up to a full one, as long as
+        all of them are past the retention period"""
+        cutoff = (datetime.now() - timedelta(days=SNAPSHOT_RETENTION_DAYS)
+                ).strftime("%Y-%m-%dT%H:%M:%S")
+        entries = self.index["snapshots"]
+        while True:
+            fulls = [i for i, entry in enumerate(entries) if entry["full"]]
+            if len(fulls) < 2 or entries[fulls[1] - 1]["time"] >= cutoff:
+                return
+            for entry in entries[:fulls[1]]:
+                try:
+                    os.remove(self._path(entry["id"]))
+                except FileNotFoundError:
+                    pass
+            del entries[:fulls[1]]
+
+    def _state_at(self, position):
+        entries = self.index["snapshots"]
+        start = position
+        while not entries[start]["full"]:
+            start -= 1
+        state = {}
+        for entry in entries[start:position + 1]:
+            data = self._load(entry["id"])
+            state.update(data["set"])
+            for key in data["removed"]:
+                state.pop(key, None)
+        return state
+
+    def state_at(self, snapshot_id):
+        """Returns the state of a snapshot, replaying it from the last full
+        snapshot before it. Meant for a worker thread."""
+        with self.lock:
+            ids = [entry["id"] for entry in self.index["snapshots"]]
+            return self._state_at(ids.index(snapshot_id))
@@ -0,0 +1,223 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Randomized soak test of the backend, without GTK.
+
+Runs long sequences of random operations against a NoteSet using the dummy
+GUI, checking invariants as it goes and reporting latency and memory over
+time, e.g.
+
+    python3 -m stickynotes.stress --ops 1000000 --seed 42
+
+Memory is reported as the peak resident set size. --trace-alloc reports
+Python allocations with tracemalloc instead, which is more precise but
+slows every operation down.
+"""
+
+from datetime import datetime, timedelta
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from stickynotes.backend import NoteSet, dGUI
+
+OPERATIONS = ["new", "update", "archive", "restore", "merge", "save",
+        "reload", "expire"]
+# Relative frequency of each operation
+WEIGHTS = [20, 40, 10, 8, 5, 5, 1, 1]
+
+class InvariantError(Exception):
+    pass
+
+class Soak:
+    """Applies random operations to a NoteSet and a model of what it
+    should contain"""
+    def __init__(self, data_file, seed, max_notes):
+        self.rng = random.Random(seed)
+        self.data_file = data_file
+        self.max_notes = max_notes
+        self.nset = NoteSet(dGUI, data_file, None)
+        self.nset.loads('{}')
+        # uuids the note set should contain
+        self.active = set()
+        self.archived = set()
+        self.latencies = {op: [] for op in OPERATIONS}
+
+    def _text(self):
+        # Few distinct bodies, so archived bodies get deduplicated
+        words = ["lorem", "ipsum", "dolor", "sit", "amet", "#todo"]
+        return " ".join(self.rng.choice(words)
+                for i in range(self.rng.randint(0, 30)))
+
+    def _random_note(self):
+        return self.rng.choice(self.nset.notes) if self.nset.notes else None
+
+    def op_new(self):
+        if len(self.active) >= self.max_notes:
+            return
+        note = self.nset.new()
+        note.update(self._text())
+        self.active.add(note.extract()["uuid"])
+
+    def op_update(self):
+        note = self._random_note()
+        if note:
+            note.update(self._text())
+
+    def op_archive(self):
+        note = self._random_note()
+        if note:
+            self.nset.archive_note(note)
+            self.active.discard(note.uuid)
+            self.archived.add(note.uuid)
+
+    def op_restore(self):
+        if self.archived:
+            uuid = self.rng.choice(sorted(self.archived))
+            if self.nset.restore_note(uuid) is None:
+                raise InvariantError("archived note {} not found".format(uuid))
+            self.archived.discard(uuid)
+            self.active.add(uuid)
+
+    def op_merge(self):
+        notes = [{"body": self._text()}]
+        note = self._random_note()
+        if note:
+            data = note.extract()
+            data["body"] = self._text()
+            notes.append(data)
+        self.nset.merge({"notes": notes})
+        self.active.add(notes[0]["uuid"])
+
+    def op_save(self):
+        self.nset.save()
+
+    def op_reload(self):
+        self.nset.save()
+        self.nset = NoteSet(dGUI, self.data_file, None)
+        self.nset.open()
+
+    def op_expire(self):
+        """Backdates an archived note past the retention period"""
+        if not self.archived:
+            return
+        uuid = self.rng.choice(sorted(self.archived))
+        days = self.nset.properties["trash_retention_days"] + 1
+        for archived in self.nset.archived_notes:
+            if archived.get("uuid") == uuid:
+                archived["deleted_at"] = (datetime.now() - timedelta(
+                    days=days)).strftime("%Y-%m-%dT%H:%M:%S")
+        self.nset.cleanup_old_archived_notes()
+        self.archived.discard(uuid)
+
+    def check(self, full=False):
+        uuids = [n.uuid for n in self.nset.notes]
+        if len(uuids) != len(set(uuids)):
+            raise InvariantError("duplicate note uuids")
+        if set(uuids) != self.active:
+            raise InvariantError("notes lost or invented: {}".format(
+                set(uuids) ^ self.active))
+        archived = [n.get("uuid") for n in self.nset.archived_notes]
+        if len(archived) != len(set(archived)) or \
+                set(archived) != self.archived:
+            raise InvariantError("archive does not match")
+        if set(self.nset.blob_refs) != set(self.nset.archive_blobs):
+            raise InvariantError("archive bodies and references disagree")
+        cutoff = datetime.now() - timedelta(
+                days=self.nset.properties["trash_retention_days"])
+        for note in self.nset.archived_notes:
+            if datetime.strptime(note["deleted_at"],
+                    "%Y-%m-%dT%H:%M:%S") <= cutoff:
+                raise InvariantError("archive retention not honoured")
+        if full:
+            dumped = self.nset.dumps()
+            copy = NoteSet(dGUI, self.data_file, None)
+            copy.loads(dumped)
+            if json.loads(copy.dumps()) != json.loads(dumped):
+                raise InvariantError("loads(dumps()) round trip differs")
+
+    def step(self):
+        op = self.rng.choices(OPERATIONS, WEIGHTS)[0]
+        start = time.perf_counter()
+        getattr(self, "op_" + op)()
+        self.latencies[op].append((time.perf_counter() - start) * 1000)
+
+    def report(self, done, elapsed):
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            memory = "mem={:.1f}MiB peak={:.1f}MiB".format(current / 2**20,
+                    peak / 2**20)
+        else:
+            # ru_maxrss is in KiB on Linux
+            memory = "maxrss={:.1f}MiB".format(resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss / 2**10)
+        parts = ["{:>9} ops {:8.0f} ops/s notes={} archived={} {}".format(
+            done, done / elapsed, len(self.active), len(self.archived),
+            memory)]
+        for op, values in self.latencies.items():
+            if values:
+                values.sort()
+                parts.append("  {:8} p50={:.3f}ms p95={:.3f}ms max={:.3f}ms"
+                        .format(op, values[len(values) // 2],
+                            values[int(len(values) * 0.95)], values[-1]))
+            # Latencies are reported per window, so trends stay visible
+            self.latencies[op] = []
+        print("\n".join(parts), flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test the backend")
+    parser.add_argument("--ops", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max-notes", type=int, default=1000)
+    parser.add_argument("--check-every", type=int, default=1,
+            help="check cheap invariants every N operations")
+    parser.add_argument("--roundtrip-every", type=int, default=1000,
+            help="check the loads(dumps()) round trip every N operations")
+    parser.add_argument("--report-every", type=int, default=10000)
+    parser.add_argument("--trace-alloc", action="store_true",
+            help="measure memory with tracemalloc (slow)")
+    args = parser.parse_args()
+    seed = args.seed if args.seed is not None else random.randrange(2**32)
+    print("seed", seed, flush=True)
+
+    if args.trace_alloc:
+        tracemalloc.start()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        soak = Soak(os.path.join(tmpdir, "stickynotes"), seed,
+                args.max_notes)
+        start = time.perf_counter()
+        for i in range(1, args.ops + 1):
+            soak.step()
+            try:
+                if i % args.check_every == 0:
+                    soak.check(full=i % args.roundtrip_every == 0)
+            except InvariantError as e:
+                print("FAILED after {} ops (seed {}): {}".format(i, seed, e))
+                sys.exit(1)
+            if i % args.report_every == 0:
+                soak.report(i, time.perf_counter() - start)
+        soak.check(full=True)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
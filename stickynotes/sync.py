@@ -0,0 +1,306 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Synchronization of note sets between instances over the network.
+
+Every note, archived note and category has a version vector, mapping each
+instance that changed it to that instance's change counter at the time, and
+a local sequence number. Instances remember the highest sequence number
+they have received from each peer, so a session only sends what changed
+since the last one. Concurrent changes are settled by modification time.
+
+A session is a few JSON lines each way over a TCP connection:
+
+    responder: {"hello": 1, "id": ..., "nonce": ...}
+    initiator: {"hello": 1, "id": ..., "nonce": ..., "auth": ..., "since": n}
+    responder: {"auth": ..., "since": n}, records, {"end": clock}
+    initiator: records, {"end": clock}
+
+Both sides prove they know the shared secret, but notes travel in the
+clear, so sync is meant for trusted networks. Two instances on one machine
+can be synced through the loopback interface, e.g.
+
+    python3 -m stickynotes.sync serve FILE_A --port 47110 &
+    python3 -m stickynotes.sync connect FILE_B localhost --port 47110
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+import socket
+import threading
+import uuid
+
+from stickynotes.info import SYNC_PORT, SYNC_TIMEOUT
+
+PROTOCOL = 1
+
+# Keys every message of a kind must have, and their types
+HELLO = {"hello": int, "id": str, "nonce": str}
+AUTH = {"auth": str, "since": int}
+RECORD = {"uuid": str, "kind": str, "vv": dict, "time": str, "data": dict}
+END = {"end": int}
+
+log = logging.getLogger(__name__)
+
+class SyncError(Exception):
+    pass
+
+def compare(a, b):
+    """Compares version vectors. Returns 0 if they are equal, -1 if a
+    happened before b, 1 if after, and None if they are concurrent."""
+    keys = set(a) | set(b)
+    before = all(a.get(k, 0) <= b.get(k, 0) for k in keys)
+    after = all(a.get(k, 0) >= b.get(k, 0) for k in keys)
+    if before and after:
+        return 0
+    if before:
+        return -1
+    if after:
+        return 1
+    return None
+
+def merge_versions(a, b):
+    return {k: max(a.get(k, 0), b.get(k, 0)) for k in set(a) | set(b)}
+
+class SyncState:
+    """Version vectors and sequence numbers of everything that is synced,
+    keyed by uuid (category ids for categories)"""
+    def __init__(self, data=None):
+        data = data or {}
+        self.id = data.get("id") or str(uuid.uuid4())
+        self.clock = data.get("clock", 0)
+        # Highest sequence number received from each peer
+        self.peers = data.get("peers", {})
+        # Each item has its kind ("note", "archived", "category" or
+        # "purged"), seq, vv and, if it was last changed by a peer, the
+        # peer's id as source
+        self.items = data.get("items", {})
+
+    def to_dict(self):
+        return {"id": self.id, "clock": self.clock, "peers": self.peers,
+                "items": self.items}
+
+    def changed(self, key, kind, vv=None, **extra):
+        """Records a local change. vv is the version to change from, if
+        not the item's own."""
+        self.clock += 1
+        if vv is None:
+            vv = self.items.get(key, {}).get("vv", {})
+        vv = dict(vv)
+        vv[self.id] = self.clock
+        self.items[key] = dict(extra, kind=kind, seq=self.clock, vv=vv)
+
+    def received(self, key, kind, vv, source, **extra):
+        """Records a change accepted from peer source. It gets a new
+        sequence number, so it is passed on to other peers."""
+        self.clock += 1
+        self.items[key] = dict(extra, kind=kind, seq=self.clock,
+                vv=merge_versions(self.items.get(key, {}).get("vv", {}), vv),
+                source=source)
+
+    def keep(self, key, vv):
+        """Records that the local version of an item won over a concurrent
+        version vv. It gets a new sequence number, so it is sent back."""
+        self.clock += 1
+        item = self.items[key]
+        item["vv"] = merge_versions(item["vv"], vv)
+        item["seq"] = self.clock
+        item.pop("source", None)
+
+    def forget(self, key, time):
+        """Replaces an item that no longer exists by a tombstone, which
+        keeps its version so older copies from peers are still ignored"""
+        item = self.items[key]
+        self.items[key] = {"kind": "purged", "seq": item["seq"],
+                "vv": item["vv"], "time": time}
+
+    def expire(self, before):
+        """Drops tombstones made before time before"""
+        self.items = {key: item for key, item in self.items.items()
+                if item["kind"] != "purged" or item["time"] >= before}
+
+    def outgoing(self, peer, since):
+        """Returns the keys of items changed since sequence number since,
+        except those that came from peer itself"""
+        return [key for key, item in self.items.items()
+                if item["seq"] > since and item.get("source") != peer]
+
+def category_digest(cdata):
+    return hashlib.sha1(json.dumps(cdata, sort_keys=True).encode("utf-8")
+            ).hexdigest()
+
+def _auth(secret, nonce):
+    return hmac.new(secret.encode("utf-8"), nonce.encode("utf-8"),
+            hashlib.sha256).hexdigest()
+
+def _send(wfile, obj):
+    wfile.write(json.dumps(obj).encode("utf-8") + b"\n")
+
+def _check(message, fields):
+    """Raises SyncError unless message is an object with all of fields, of
+    the right types"""
+    if not isinstance(message, dict) or not all(
+            isinstance(message.get(key), kind) for key, kind in fields.items()):
+        raise SyncError("Malformed message")
+
+def _recv(rfile, fields=None):
+    line = rfile.readline()
+    if not line:
+        raise SyncError("Connection closed by peer")
+    try:
+        message = json.loads(line.decode("utf-8"))
+    except ValueError:
+        raise SyncError("Malformed message")
+    _check(message, fields or {})
+    return message
+
+def _check_hello(hello):
+    if hello["hello"] != PROTOCOL or not hello["id"]:
+        raise SyncError("Unsupported peer")
+
+def _check_auth(message, secret, nonce):
+    if not hmac.compare_digest(message["auth"], _auth(secret, nonce)):
+        raise SyncError("Peer does not know the shared secret")
+
+def _write_records(wfile, records, clock):
+    for record in records:
+        _send(wfile, record)
+    _send(wfile, {"end": clock})
+    wfile.flush()
+
+def _read_records(rfile):
+    records = []
+    while True:
+        message = _recv(rfile)
+        if "end" in message:
+            _check(message, END)
+            return records, message["end"]
+        _check(message, RECORD)
+        if not all(isinstance(v, int) for v in message["vv"].values()):
+            raise SyncError("Malformed message")
+        records.append(message)
+
+def _direct(f, *args):
+    return f(*args)
+
+def exchange(sock, noteset, secret, initiator, call=_direct):
+    """Runs a session on a connected socket. Note set methods are run
+    through call, so a GUI can run them in its main loop. Returns the
+    number of records sent and received."""
+    # Closing the files as well lets the socket close as soon as the
+    # session ends, even if it failed
+    with sock.makefile("rb") as rfile, sock.makefile("wb") as wfile:
+        return _session(rfile, wfile, noteset, secret, initiator, call)
+
+def _session(rfile, wfile, noteset, secret, initiator, call):
+    own_id = noteset.sync.id
+    nonce = secrets.token_hex(16)
+    if initiator:
+        hello = _recv(rfile, HELLO)
+        _check_hello(hello)
+        peer = hello["id"]
+        _send(wfile, {"hello": PROTOCOL, "id": own_id, "nonce": nonce,
+            "auth": _auth(secret, hello["nonce"]),
+            "since": noteset.sync.peers.get(peer, 0)})
+        wfile.flush()
+        reply = _recv(rfile, AUTH)
+        _check_auth(reply, secret, nonce)
+        incoming, clock = _read_records(rfile)
+        # Computed before applying what came in, so none of it is echoed
+        outgoing, own_clock = call(noteset.sync_delta, peer, reply["since"])
+        _write_records(wfile, outgoing, own_clock)
+    else:
+        _send(wfile, {"hello": PROTOCOL, "id": own_id, "nonce": nonce})
+        wfile.flush()
+        hello = _recv(rfile, dict(HELLO, **AUTH))
+        _check_hello(hello)
+        _check_auth(hello, secret, nonce)
+        peer = hello["id"]
+        outgoing, own_clock = call(noteset.sync_delta, peer, hello["since"])
+        _send(wfile, {"auth": _auth(secret, hello["nonce"]),
+            "since": noteset.sync.peers.get(peer, 0)})
+        _write_records(wfile, outgoing, own_clock)
+        incoming, clock = _read_records(rfile)
+    call(noteset.sync_apply, peer, incoming, clock)
+    return len(outgoing), len(incoming)
+
+def connect(noteset, host, secret, port=SYNC_PORT, call=_direct):
+    """Syncs with the instance listening at host"""
+    with socket.create_connection((host, port), timeout=SYNC_TIMEOUT) as sock:
+        return exchange(sock, noteset, secret, True, call)
+
+def serve(noteset, secret, address="", port=SYNC_PORT, call=_direct,
+        done=None):
+    """Accepts sessions, one at a time, from a daemon thread. done is
+    called with the numbers of records sent and received after each one.
+    Returns the listening socket; closing it stops the server."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((address, port))
+    server.listen(1)
+    def _serve():
+        while True:
+            try:
+                conn, addr = server.accept()
+            except OSError:
+                return
+            with conn:
+                conn.settimeout(SYNC_TIMEOUT)
+                try:
+                    counts = exchange(conn, noteset, secret, False, call)
+                except (OSError, SyncError) as e:
+                    log.warning("Sync with %s failed: %s", addr[0], e)
+                    continue
+                except Exception:
+                    # Keep serving other peers whatever one of them sent
+                    log.exception("Sync with %s failed", addr[0])
+                    continue
+            if done is not None:
+                done(*counts)
+    threading.Thread(target=_serve, daemon=True).start()
+    return server
+
+def main():
+    from stickynotes.backend import NoteSet, dGUI
+    parser = argparse.ArgumentParser(description="Sync a data file with "
+            "another instance")
+    parser.add_argument("command", choices=["serve", "connect"])
+    parser.add_argument("data_file")
+    parser.add_argument("host", nargs="?", default="localhost")
+    parser.add_argument("--port", type=int, default=SYNC_PORT)
+    parser.add_argument("--secret", default="")
+    args = parser.parse_args()
+    noteset = NoteSet(dGUI, args.data_file, None)
+    try:
+        noteset.open()
+    except FileNotFoundError:
+        noteset.loads('{}')
+    def _done(sent, received):
+        noteset.save()
+        print("sent {} received {}".format(sent, received), flush=True)
+    if args.command == "connect":
+        _done(*connect(noteset, args.host, args.secret, args.port))
+    else:
+        serve(noteset, args.secret, args.host, args.port, done=_done)
+        threading.Event().wait()
+
+if __name__ == "__main__":
+    main()
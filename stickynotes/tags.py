@@ -0,0 +1,69 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""#tags written in note bodies"""
+
+import re
+
+TAG_RE = re.compile(r"(?<![\w#])#(\w[\w-]*)")
+
+def extract_tags(body):
+    """Returns the set of tags (lowercase, without the #) in body"""
+    return {tag.lower() for tag in TAG_RE.findall(body)}
+
+class TagIndex:
+    """Maps tags to the notes containing them, updated one note at a time"""
+    def __init__(self):
+        self.notes = {}
+        self.note_tags = {}
+        # Incremented whenever the set of known tags changes
+        self.version = 0
+
+    def update(self, note, body):
+        """Re-indexes note after its body changed"""
+        new = extract_tags(body)
+        old = self.note_tags.get(note, set())
+        if new == old:
+            return
+        for tag in old - new:
+            self._discard(tag, note)
+        for tag in new - old:
+            if tag not in self.notes:
+                self.notes[tag] = set()
+                self.version += 1
+            self.notes[tag].add(note)
+        if new:
+            self.note_tags[note] = new
+        else:
+            self.note_tags.pop(note, None)
+
+    def remove(self, note):
+        for tag in self.note_tags.pop(note, ()):
+            self._discard(tag, note)
+
+    def _discard(self, tag, note):
+        self.notes[tag].discard(note)
+        if not self.notes[tag]:
+            del self.notes[tag]
+            self.version += 1
+
+    def tags(self):
+        return sorted(self.notes)
+
+    def tagged(self, tag):
+        """Returns the set of notes tagged with tag"""
+        return self.notes.get(tag, set())
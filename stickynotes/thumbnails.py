@@ -0,0 +1,122 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Thumbnails of attached images.
+
+Images are decoded and scaled down in a worker thread, and the thumbnails
+are kept on disk, so a note with many large images never decodes them in
+the main loop. The cache is bounded in size; the thumbnails used least
+recently are dropped first."""
+
+from collections import OrderedDict
+import logging
+import os
+import queue
+import threading
+
+import gi
+gi.require_version("GdkPixbuf", "2.0")
+from gi.repository import GdkPixbuf, GLib
+
+log = logging.getLogger(__name__)
+
+class ThumbnailCache:
+    def __init__(self, directory, size, max_bytes):
+        self.directory = directory
+        self.size = size
+        self.max_bytes = max_bytes
+        self.requests = queue.Queue()
+        # Callbacks waiting for each thumbnail, by file name
+        self.waiting = {}
+        self.worker = None
+        # Sizes of the thumbnails on disk, least recently used first. Only
+        # used by the worker.
+        self.usage = None
+
+    def request(self, ref, source, callback):
+        """Calls callback with a pixbuf of the thumbnail of the image at
+        source, or None if it can't be read. Must be called from the main
+        loop, where callback is called too."""
+        name = "{}-{}.png".format(os.path.splitext(ref)[0], self.size)
+        if name in self.waiting:
+            self.waiting[name].append(callback)
+            return
+        self.waiting[name] = [callback]
+        self.requests.put((name, source))
+        if self.worker is None:
+            self.worker = threading.Thread(target=self._run, daemon=True)
+            self.worker.start()
+
+    def _run(self):
+        while True:
+            name, source = self.requests.get()
+            try:
+                pixbuf = self._thumbnail(name, source)
+            except (GLib.Error, OSError):
+                pixbuf = None
+            except Exception:
+                # Fail this thumbnail only; later requests still need
+                # the worker
+                log.exception("Could not make thumbnail of %s", source)
+                pixbuf = None
+            GLib.idle_add(self._deliver, name, pixbuf)
+
+    def _deliver(self, name, pixbuf):
+        for callback in self.waiting.pop(name, ()):
+            callback(pixbuf)
+        return False
+
+    def _load_usage(self):
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime, name, stat.st_size))
+        self.usage = OrderedDict((name, size) for mtime, name, size in
+                sorted(entries))
+
+    def _thumbnail(self, name, source):
+        if self.usage is None:
+            self._load_usage()
+        path = os.path.join(self.directory, name)
+        if name in self.usage:
+            try:
+                # The modification time orders the cache when it is
+                # reloaded
+                os.utime(path)
+            except FileNotFoundError:
+                del self.usage[name]
+            else:
+                self.usage.move_to_end(name)
+                return GdkPixbuf.Pixbuf.new_from_file(path)
+        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(source, self.size,
+                self.size, True)
+        pixbuf.savev(path + ".tmp", "png", [], [])
+        os.replace(path + ".tmp", path)
+        self.usage[name] = os.path.getsize(path)
+        self._evict()
+        return pixbuf
+
+    def _evict(self):
+        total = sum(self.usage.values())
+        while total > self.max_bytes and len(self.usage) > 1:
+            name, size = self.usage.popitem(last=False)
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,272 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Streaming export and import of note sets as (compressed) JSON Lines.
+
+The stream starts with a header line, followed by one line per category,
+note and archived note. Each line is small, so neither side ever needs to
+hold the whole backup in memory. The header gives the schema version of the
+records (see stickynotes.migrations), so current ones aren't migrated."""
+
+import gzip
+import io
+import json
+import os
+
+from stickynotes.info import SCHEMA_VERSION
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+STREAM_FORMAT = "indicator-stickynotes-jsonl"
+STREAM_VERSION = 1
+# Number of notes handed to NoteSet.merge at a time when importing
+IMPORT_BATCH_SIZE = 200
+# Number of notes written between progress updates when exporting
+EXPORT_CHUNK_SIZE = 200
+# Bytes copied between progress updates when backing up the data file
+COPY_CHUNK_SIZE = 1 << 20
+# Line errors listed in a report before the rest are only counted
+REPORT_MAX_ERRORS = 20
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+STREAM_EXTENSIONS = (".jsonl", ".jsonl.gz", ".jsonl.zst")
+
+class Cancelled(Exception):
+    pass
+
+class TransferReport:
+    """Outcome of an import or export: how many records were handled,
+    the records that had to be skipped and why, and whether the transfer
+    failed or was cancelled"""
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        # (line number, message) for each skipped record
+        self.errors = []
+        self.skipped = 0
+        self.failure = None
+        self.cancelled = False
+
+    @property
+    def ok(self):
+        return not (self.failure or self.skipped or self.cancelled)
+
+    def skip(self, line, message):
+        self.skipped += 1
+        if len(self.errors) < REPORT_MAX_ERRORS:
+            self.errors.append((line, message))
+
+    def fail(self, error):
+        self.failure = str(error) or error.__class__.__name__
+
+
+def is_stream_path(path):
+    """Whether a file name asks for the streaming format"""
+    return path.lower().endswith(STREAM_EXTENSIONS)
+
+def is_stream_file(path):
+    """Sniffs whether an existing file is in the streaming format"""
+    with open(path, "rb") as fsock:
+        head = fsock.read(64)
+    if head.startswith((GZIP_MAGIC, ZSTD_MAGIC)):
+        return True
+    return head.startswith(b'{"format": "' + STREAM_FORMAT.encode() + b'"')
+
+def _partial(path):
+    """Where a file is written until it is complete, so a failed or
+    cancelled transfer never leaves a truncated file at path"""
+    return path + ".part"
+
+def _open_write(path, name):
+    """Opens path for writing text, compressing according to the extension
+    of name"""
+    lpath = name.lower()
+    if lpath.endswith(".gz"):
+        return gzip.open(path, "wt", encoding="utf-8")
+    if lpath.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires the zstandard "
+                    "module")
+        raw = open(path, "wb")
+        writer = zstandard.ZstdCompressor().stream_writer(raw,
+                closefd=True)
+        return io.TextIOWrapper(writer, encoding="utf-8")
+    return open(path, "w", encoding="utf-8")
+
+def _open_read(raw):
+    """Wraps a raw binary file in the right decompressor, returning text"""
+    head = raw.peek(4)[:4]
+    if head.startswith(GZIP_MAGIC):
+        stream = gzip.GzipFile(fileobj=raw, mode="rb")
+    elif head.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("zstd decompression requires the zstandard "
+                    "module")
+        stream = zstandard.ZstdDecompressor().stream_reader(raw)
+    else:
+        stream = raw
+    return io.TextIOWrapper(stream, encoding="utf-8")
+
+def write_stream(noteset, path):
+    """Writes noteset to path one record per line.
+
+    This is a generator yielding the fraction of work done after every
+    chunk, so callers can drive it from an idle handler and show progress.
+    Closing it early cancels the export and leaves path untouched.
+    """
+    total = len(noteset.notes) + len(noteset.archived_notes) or 1
+    try:
+        yield from _write_records(noteset, _partial(path), path, total)
+        os.replace(_partial(path), path)
+    except BaseException:
+        if os.path.exists(_partial(path)):
+            os.remove(_partial(path))
+        raise
+    yield 1.0
+
+def _write_records(noteset, path, name, total):
+    done = 0
+    with _open_write(path, name) as fsock:
+        fsock.write(json.dumps({"format": STREAM_FORMAT,
+            "version": STREAM_VERSION, "schema": SCHEMA_VERSION,
+            "notes": len(noteset.notes),
+            "archived_notes": len(noteset.archived_notes)}) + "\n")
+        for cid, cdata in noteset.categories.items():
+            fsock.write(json.dumps({"section": "category", "id": cid,
+                "data": cdata}) + "\n")
+        for section, records in (("note", noteset.notes),
+                ("archived", noteset.archived_notes)):
+            # Iterate over a copy: the note set may change between chunks
+            for record in list(records):
+                if section == "note":
+                    data = record.extract(sealed=True)
+                else:
+                    data = noteset.archived_note_data(record)
+                fsock.write(json.dumps({"section": section, "data": data})
+                        + "\n")
+                done += 1
+                if done % EXPORT_CHUNK_SIZE == 0:
+                    yield done / total
+
+def read_stream(path, batch_size=IMPORT_BATCH_SIZE, report=None):
+    """Reads a stream written by write_stream.
+
+    Yields (batch, fraction) pairs, where batch is a dictionary in the
+    format accepted by NoteSet.merge and fraction is an estimate of how much
+    of the file has been read. With a report, malformed records are
+    skipped and recorded in it rather than ending the import."""
+    size = os.path.getsize(path) or 1
+    with open(path, "rb") as raw:
+        fsock = _open_read(raw)
+        header = json.loads(fsock.readline() or "{}")
+        if header.get("format") != STREAM_FORMAT:
+            raise ValueError("Not a stickynotes data stream")
+        if header.get("version", 0) > STREAM_VERSION:
+            raise ValueError("Unsupported stream version")
+        # Streams written before the header had it need migrating
+        def _new_batch():
+            return {"version": header["schema"]} if "schema" in header \
+                    else {}
+        batch = _new_batch()
+        count = 0
+        for number, line in enumerate(fsock, 2):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                section = record.get("section")
+                if section == "category":
+                    batch.setdefault("categories", {})[record["id"]] = \
+                            dict(record["data"])
+                elif section in ("note", "archived"):
+                    if not isinstance(record["data"], dict):
+                        raise ValueError("record data is not an object")
+                    batch.setdefault("notes" if section == "note" else
+                            "archived_notes", []).append(record["data"])
+                else:
+                    continue
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                if report is None:
+                    raise
+                report.skip(number, "{}: {}".format(e.__class__.__name__, e))
+                continue
+            count += 1
+            if report is not None:
+                report.records += 1
+            if count >= batch_size:
+                yield batch, min(raw.tell() / size, 1.0)
+                batch = _new_batch()
+                count = 0
+        if count:
+            yield batch, 1.0
+
+def read_file(path, batch_size=IMPORT_BATCH_SIZE, report=None):
+    """Reads a data file (the format of NoteSet.dumps) in batches, like
+    read_stream. The file is parsed at once, but is handed out in batches
+    so that merging it doesn't hold up the caller for long."""
+    with open(path, encoding="utf-8") as fsock:
+        data = json.loads(fsock.read())
+    if not isinstance(data, dict):
+        raise ValueError("Not a stickynotes data file")
+    notes = data.get("notes", [])
+    archived = data.get("archived_notes", [])
+    total = len(notes) + len(archived) or 1
+    # Categories come first, so notes find theirs when they are merged
+    head = {k: data[k] for k in ("version", "categories") if k in data}
+    if "categories" in head:
+        yield head, 0.0
+    done = 0
+    for key, records in (("notes", notes), ("archived_notes", archived)):
+        for start in range(0, len(records), batch_size):
+            batch = {key: records[start:start + batch_size]}
+            if "version" in data:
+                batch["version"] = data["version"]
+            if key == "archived_notes":
+                batch["archive_blobs"] = data.get("archive_blobs", {})
+            done += len(batch[key])
+            if report is not None:
+                report.records += len(batch[key])
+            yield batch, done / total
+
+def copy_file(src, dst, cancel=None):
+    """Copies src to dst a chunk at a time, yielding the fraction copied.
+    If cancel (a threading.Event) gets set, the copy stops with Cancelled
+    and dst is left untouched."""
+    size = os.path.getsize(src) or 1
+    copied = 0
+    try:
+        with open(src, "rb") as fin, open(_partial(dst), "wb") as fout:
+            while True:
+                if cancel is not None and cancel.is_set():
+                    raise Cancelled()
+                chunk = fin.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                fout.write(chunk)
+                copied += len(chunk)
+                yield min(copied / size, 1.0)
+        os.replace(_partial(dst), dst)
+    except BaseException:
+        if os.path.exists(_partial(dst)):
+            os.remove(_partial(dst))
+        raise
+    yield 1.0
+
@@ -0,0 +1,83 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the attachment store and attachment links"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from stickynotes import attachments
+from stickynotes.attachments import AttachmentStore
+
+class LinkTest(unittest.TestCase):
+    def test_markup_and_links(self):
+        ref = "a" * 64 + ".png"
+        body = "see {} and {} and [x](attachment:{})".format(
+                attachments.markup("shot [1].png", ref),
+                attachments.markup("notes.txt", "b" * 64), ref)
+        self.assertTrue(body.startswith("see ![shot (1).png]"))
+        self.assertEqual(attachments.links(body), [
+            ("shot (1).png", ref, True), ("notes.txt", "b" * 64, False)])
+        self.assertEqual(attachments.references(body), {ref, "b" * 64})
+
+class StoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = AttachmentStore(os.path.join(self.directory, "store"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def source(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as fsock:
+            fsock.write(data)
+        return path
+
+    def test_identical_files_are_stored_once(self):
+        ref = self.store.add(self.source("a.PNG", b"image"))
+        self.assertTrue(ref.endswith(".png"))
+        self.assertEqual(self.store.add(self.source("b.png", b"image")), ref)
+        self.assertEqual(os.listdir(self.store.directory), [ref])
+        with open(self.store.path(ref), "rb") as fsock:
+            self.assertEqual(fsock.read(), b"image")
+
+    def test_odd_extensions_are_dropped(self):
+        ref = self.store.add(self.source("archive.tar-gz", b"data"))
+        self.assertEqual(len(ref), 64)
+
+    def test_collect_keeps_referenced_and_recent(self):
+        kept = self.store.add(self.source("kept", b"kept"))
+        recent = self.store.add(self.source("recent", b"recent"))
+        old = self.store.add(self.source("old", b"old"))
+        past = time.time() - 3600
+        for ref in (kept, old):
+            os.utime(self.store.path(ref), (past, past))
+        self.assertEqual(self.store.collect({kept}, 60), 1)
+        self.assertEqual(sorted(os.listdir(self.store.directory)),
+                sorted([kept, recent]))
+        # Being referenced counts as being seen now
+        self.assertGreater(os.path.getmtime(self.store.path(kept)), past)
+
+    def test_collect_without_store(self):
+        self.assertEqual(self.store.collect(set(), 0), 0)
+
+if __name__ == '__main__':
+    unittest.main()
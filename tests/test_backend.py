@@ -0,0 +1,382 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the note set, run with the dummy GUI so they need no display:
+
+    python3 -m unittest discover tests
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from stickynotes import attachments
+from stickynotes.backend import NoteSet, dGUI
+from stickynotes.snapshots import SnapshotStore
+
+class BufferGUI(dGUI):
+    """Dummy GUI that holds the body like a text buffer does, and counts
+    how often it is read"""
+    def __init__(self, *args, note=None, **kwargs):
+        super().__init__(note=note)
+        self.text = note.take_body()
+        self.modified = False
+        self.reads = 0
+    def get_body(self):
+        self.reads += 1
+        return self.text
+    def set_body(self, body):
+        self.text = body
+    def type(self, text):
+        self.text += text
+        self.modified = True
+    def update_note(self):
+        if self.modified:
+            self.note.touch(self.get_body())
+            self.modified = False
+
+class CallGUI(dGUI):
+    """Dummy GUI that records which of its methods were called"""
+    def __init__(self, *args, note=None, **kwargs):
+        super().__init__(note=note)
+        self.calls = []
+    def show(self, *args, **kwargs):
+        self.calls.append("show")
+    def populate_menu(self):
+        self.calls.append("populate_menu")
+    def update_style(self):
+        self.calls.append("update_style")
+
+class NoteSetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.directory, "notes")
+        self.nset = self.new_noteset()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def new_noteset(self, gui_class=dGUI):
+        nset = NoteSet(gui_class, self.data_file, None)
+        nset.loads("{}")
+        return nset
+
+class ArchiveTest(NoteSetTestCase):
+    def test_archived_note_leaves_indices(self):
+        note = self.nset.new(area=(0, 0, 1000, 1000), body="#todo milk")
+        self.nset.archive_note(note)
+        self.assertNotIn(note, self.nset.layout.rects)
+        self.assertNotIn(note, self.nset.tags.tagged("todo"))
+        # The archived note's spot is free again
+        self.assertEqual(self.nset.new(area=(0, 0, 1000, 1000)).rect(),
+                note.rect())
+
+    def test_identical_bodies_are_stored_once(self):
+        notes = [self.nset.new(body="same") for i in range(3)]
+        for note in notes:
+            self.nset.archive_note(note)
+        self.assertEqual(list(self.nset.archive_blobs.values()), ["same"])
+        uuid = self.nset.archived_notes[0]["uuid"]
+        self.nset.delete_archived_note(uuid)
+        self.assertEqual(len(self.nset.archive_blobs), 1)
+        restored = self.nset.restore_note(
+                self.nset.archived_notes[0]["uuid"], save=False)
+        self.assertEqual(restored.body, "same")
+        self.nset.delete_archived_note(self.nset.archived_notes[0]["uuid"])
+        self.assertEqual(self.nset.archive_blobs, {})
+
+    def test_blobs_survive_reload(self):
+        for body in ("one", "one", "two"):
+            self.nset.archive_note(self.nset.new(body=body))
+        self.nset.save()
+        nset = NoteSet(dGUI, self.data_file, None)
+        nset.open()
+        self.assertEqual(sorted(nset.archived_body(a)
+            for a in nset.archived_notes), ["one", "one", "two"])
+        self.assertEqual(len(nset.archive_blobs), 2)
+
+class SaveTest(NoteSetTestCase):
+    def test_unchanged_buffers_are_not_read(self):
+        nset = self.new_noteset(BufferGUI)
+        note = nset.new(body="hello")
+        nset.save()
+        reads = note.gui.reads
+        nset.save()
+        self.assertEqual(note.gui.reads, reads)
+        note.update("changed")
+        nset.save()
+        self.assertEqual(note.gui.reads, reads + 1)
+        with open(self.data_file) as fsock:
+            self.assertIn('"changed"', fsock.read())
+
+    def test_typed_text_is_read_once(self):
+        nset = self.new_noteset(BufferGUI)
+        note = nset.new(body="hello")
+        nset.save()
+        reads = note.gui.reads
+        note.gui.type(" #world")
+        nset.save()
+        # Read once for the tag index and the saved body together
+        self.assertEqual(note.gui.reads, reads + 1)
+        self.assertIn(note, nset.tags.tagged("world"))
+        self.assertEqual(note.body, "hello #world")
+        self.assertIsNone(note._fresh)
+
+class NotebookTest(NoteSetTestCase):
+    def test_notebooks_are_stored_apart(self):
+        self.nset.open_notebook("work")
+        self.nset.new(body="main")
+        self.nset.new(notebook="work", body="work")
+        self.nset.save()
+        for path, body in ((self.data_file, "main"),
+                (self.nset.notebook_path("work"), "work")):
+            with open(path) as fsock:
+                self.assertEqual([n["body"] for n in
+                    json.load(fsock)["notes"]], [body])
+        nset = NoteSet(dGUI, self.data_file, None)
+        nset.open()
+        self.assertEqual(sorted((n.notebook, n.body) for n in nset.notes),
+                [("", "main"), ("work", "work")])
+
+    def test_closed_notebooks_are_unloaded(self):
+        self.nset.open_notebook("work")
+        self.nset.new(notebook="work", body="work")
+        self.nset.close_notebook("work")
+        self.assertEqual(self.nset.notes, [])
+        nset = NoteSet(dGUI, self.data_file, None)
+        nset.open()
+        self.assertEqual(nset.notes, [])
+        nset.open_notebook("work", show=False)
+        self.assertEqual([n.body for n in nset.notes], ["work"])
+
+    def test_only_changed_files_are_rewritten(self):
+        self.nset.open_notebook("work")
+        note = self.nset.new(notebook="work", body="work")
+        self.nset.save()
+        main = os.stat(self.data_file).st_ino
+        shard = os.stat(self.nset.notebook_path("work")).st_ino
+        note.update("changed")
+        self.nset.save()
+        self.assertEqual(os.stat(self.data_file).st_ino, main)
+        self.assertNotEqual(os.stat(self.nset.notebook_path("work")).st_ino,
+                shard)
+
+class EvictTest(NoteSetTestCase):
+    def test_least_recently_hidden_are_evicted(self):
+        nset = self.new_noteset(BufferGUI)
+        nset.properties["max_windows"] = 2
+        notes = [nset.new(body=str(i)) for i in range(4)]
+        for note in notes[:3]:
+            note.hide()
+        nset.evict_guis()
+        # Visible windows stay, whatever the cap
+        self.assertEqual([n.gui is not None for n in notes],
+                [False, False, True, True])
+        self.assertEqual(len(nset.guis()), 2)
+        # The body was taken back from the torn down window
+        self.assertEqual(notes[0].body, "0")
+        notes[0].show()
+        self.assertEqual(notes[0].gui.text, "0")
+
+    def test_hideall_evicts(self):
+        self.nset.properties["max_windows"] = 1
+        for i in range(3):
+            self.nset.new()
+        self.nset.hideall()
+        self.assertEqual(len(self.nset.guis()), 1)
+
+class UpdateTest(NoteSetTestCase):
+    def test_update_marks_dirty(self):
+        note = self.nset.new()
+        self.nset.save()
+        self.assertFalse(self.nset.dirty)
+        note.update("changed")
+        self.assertTrue(self.nset.dirty)
+
+class AttachmentTest(NoteSetTestCase):
+    def test_closed_notebook_keeps_attachments(self):
+        source = os.path.join(self.directory, "photo.jpg")
+        with open(source, "wb") as fsock:
+            fsock.write(b"not really a photo")
+        ref = self.nset.attachments.add(source)
+        self.nset.open_notebook("work")
+        self.nset.new(notebook="work",
+                body=attachments.markup("photo.jpg", ref))
+        self.nset.close_notebook("work")
+        refs = self.nset.attachment_references()
+        self.assertEqual(refs, {ref})
+        self.nset.attachments.collect(refs, -1)
+        self.assertTrue(os.path.exists(self.nset.attachments.path(ref)))
+
+class MergeTest(NoteSetTestCase):
+    def test_hidden_notes_stay_without_gui(self):
+        evicted, hidden = self.nset.new(), self.nset.new()
+        evicted.hide()
+        evicted.release_gui()
+        hidden.hide()
+        self.nset.merge({"notes": [
+            {"uuid": evicted.extract()["uuid"], "body": "synced"},
+            {"uuid": hidden.extract()["uuid"], "body": "synced too"}]})
+        self.assertIsNone(evicted.gui)
+        self.assertIsNone(hidden.gui)
+        self.assertNotIn(hidden, self.nset.hidden)
+        self.assertEqual(evicted.body, "synced")
+        self.assertEqual(hidden.body, "synced too")
+
+    def test_category_change_only_restyles_its_notes(self):
+        nset = self.new_noteset(CallGUI)
+        nset.categories = {"work": {"bgcolor_hsv": [0, 0, 1]}, "home": {}}
+        work, home, edited = [nset.new() for i in range(3)]
+        work.category = "work"
+        home.category = "home"
+        nset.merge({"categories": {"work": {"bgcolor_hsv": [0.5, 0, 1]},
+            "home": {}}, "notes": [{"uuid": edited.uuid, "body": "new"}]})
+        self.assertEqual(work.gui.calls, ["populate_menu", "update_style"])
+        self.assertEqual(home.gui.calls, ["populate_menu"])
+        self.assertEqual(edited.gui.calls, ["show"])
+        # Categories that didn't change leave windows alone
+        nset.merge({"categories": {"home": {}}})
+        self.assertEqual(home.gui.calls, ["populate_menu"])
+
+class ProfileTest(NoteSetTestCase):
+    def test_apply_profile(self):
+        nset = self.new_noteset(CallGUI)
+        shown, moved, hidden = [nset.new() for i in range(3)]
+        moved.place((300, 300))
+        hidden.hide()
+        nset.save_profile("desk")
+        moved.place((500, 500))
+        hidden.show()
+        shown.hide()
+        for note in nset.notes:
+            note.gui.calls = []
+        nset.apply_profile("desk")
+        self.assertEqual([shown.is_visible, moved.is_visible,
+            hidden.is_visible], [True, True, False])
+        self.assertEqual(moved.rect()[:2], (300, 300))
+        self.assertEqual(nset.properties["profile"], "desk")
+        # Windows are moved, hidden or shown, never rebuilt
+        for note in nset.notes:
+            self.assertNotIn("show", note.gui.calls)
+
+    def test_showing_everything_leaves_the_profile(self):
+        self.nset.new()
+        self.nset.save_profile("desk")
+        self.nset.showall()
+        self.assertNotIn("profile", self.nset.properties)
+        self.nset.delete_profile("desk")
+        self.assertEqual(self.nset.properties["profiles"], {})
+
+class WindowStateTest(NoteSetTestCase):
+    def test_stacking_order_follows_raises(self):
+        a, b, c = [self.nset.new() for i in range(3)]
+        for note in (b, a, c, a):
+            note.raised()
+        self.assertEqual(self.nset.stacking_order(), [b, c, a])
+        top = self.nset.properties["z_top"]
+        # Raising the top window again changes nothing
+        a.raised()
+        self.assertEqual(self.nset.properties["z_top"], top)
+
+    def test_window_state_survives_reload(self):
+        note = self.nset.new()
+        note.properties.update(keep_above=True, sticky=True, opacity=0.8)
+        note.raised()
+        self.nset.save()
+        nset = NoteSet(dGUI, self.data_file, None)
+        nset.open()
+        [copy] = nset.notes
+        for prop in ("keep_above", "sticky", "opacity", "z"):
+            self.assertEqual(copy.properties[prop], note.properties[prop])
+
+    def test_window_state_stays_local_on_sync(self):
+        note = self.nset.new(body="shared")
+        note.properties["opacity"] = 0.5
+        data = note.extract()
+        data["properties"] = dict(data["properties"], opacity=1.0,
+                locked=True)
+        self.nset.sync_apply("peer", [{"uuid": note.uuid, "kind": "note",
+            "vv": {"peer": 1}, "time": "2999-01-01T00:00:00",
+            "data": data}], 1)
+        self.assertEqual(note.properties["opacity"], 0.5)
+        self.assertTrue(note.properties["locked"])
+
+class GeometryTest(NoteSetTestCase):
+    def test_set_geometry_reports_changes(self):
+        note = self.nset.new()
+        self.nset.dirty = False
+        self.assertTrue(note.set_geometry((10, 20), (200, 150)))
+        self.assertTrue(self.nset.dirty)
+        self.assertEqual(note.properties["position"], [10, 20])
+        self.assertEqual(note.properties["size"], [200, 150])
+        self.nset.dirty = False
+        # Repeated configure events with the same geometry are ignored
+        self.assertFalse(note.set_geometry([10, 20], [200, 150]))
+        self.assertFalse(self.nset.dirty)
+
+class CaptureTest(NoteSetTestCase):
+    def test_captured_notes_are_placed_without_windows(self):
+        nset = self.new_noteset(CallGUI)
+        area = (0, 0, 1000, 1000)
+        first = nset.new(area=area, body="one", show=False)
+        nset.dirty = False
+        second = nset.new(area=area, body="#two", show=False)
+        self.assertTrue(nset.dirty)
+        self.assertIsNone(second.gui)
+        self.assertEqual(second.body, "#two")
+        self.assertEqual(nset.tags.tagged("two"), {second})
+        self.assertNotEqual(first.rect()[:2], second.rect()[:2])
+        # The window is built once, when the note is shown
+        second.show()
+        self.assertEqual(second.gui.calls, [])
+
+class MigrationTest(NoteSetTestCase):
+    def test_batched_import_adds_up_timings(self):
+        self.nset.record_migrations()
+        old = {"notes": [{"uuid": str(i), "body": "note"} for i in range(4)]}
+        for note in old["notes"]:
+            self.nset.merge({"notes": [note]})
+        timings = self.nset.record_migrations()
+        self.assertEqual(sorted(timings), [1, 2])
+        self.assertEqual(self.nset.migration_timings, {})
+        self.assertEqual(len(self.nset.notes), 4)
+
+    def test_current_data_is_not_migrated(self):
+        self.nset.record_migrations()
+        self.nset.sync_apply("peer", [], 0)
+        self.assertEqual(self.nset.record_migrations(), {})
+
+class SnapshotTest(NoteSetTestCase):
+    def test_restore_keeps_notebook(self):
+        store = SnapshotStore(os.path.join(self.directory, "snapshots"))
+        self.nset.open_notebook("work")
+        note = self.nset.new(notebook="work", body="before")
+        store.write(store.prepare(self.nset))
+        note.update("after")
+        self.nset.restore_state(store.state_at(store.snapshots()[0]["id"]))
+        [restored] = self.nset.notes
+        self.assertEqual(restored.body, "before")
+        self.assertEqual(restored.notebook, "work")
+        self.nset.archive_note(restored)
+        self.nset.restore_state(store.state_at(store.snapshots()[0]["id"]))
+        [restored] = self.nset.notes
+        self.assertEqual(restored.notebook, "work")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of note encryption. Most need the cryptography module, and are
+skipped without it."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from stickynotes import crypto
+from stickynotes.backend import NoteSet, dGUI
+from stickynotes.crypto import LockedError, NoteCipher
+
+needs_cryptography = unittest.skipUnless(crypto.available(),
+        "cryptography is not available")
+
+class CipherTest(unittest.TestCase):
+    def test_locked(self):
+        cipher = NoteCipher()
+        with self.assertRaises(LockedError):
+            cipher.seal("text")
+        with self.assertRaises(LockedError):
+            cipher.open("dGV4dA==")
+
+    @needs_cryptography
+    def test_seal_and_open(self):
+        cipher = NoteCipher()
+        params = cipher.setup("passphrase")
+        sealed = cipher.seal("secret")
+        self.assertNotIn("secret", sealed)
+        self.assertNotEqual(cipher.seal("secret"), sealed)
+        other = NoteCipher()
+        self.assertFalse(other.unlock(params, "wrong"))
+        self.assertFalse(other.unlocked)
+        self.assertTrue(other.unlock(params, "passphrase"))
+        self.assertEqual(other.open(sealed), "secret")
+
+@needs_cryptography
+class EncryptedNoteTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.directory, "notes")
+        self.nset = NoteSet(dGUI, self.data_file, None)
+        self.nset.loads("{}")
+        self.nset.enable_encryption("passphrase")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_bodies_are_stored_sealed(self):
+        note = self.nset.new(body="secret")
+        note.properties["encrypted"] = True
+        self.nset.new(body="plain")
+        self.nset.save()
+        with open(self.data_file) as fsock:
+            data = json.load(fsock)
+        self.assertNotIn("secret", json.dumps(data))
+        nset = NoteSet(dGUI, self.data_file, None)
+        nset.open()
+        self.assertTrue(nset.needs_unlock())
+        sealed = [n for n in nset.notes if n.is_sealed]
+        self.assertEqual(len(sealed), 1)
+        self.assertFalse(nset.unlock("wrong"))
+        self.assertTrue(nset.unlock("passphrase"))
+        self.assertEqual(sorted(n.body for n in nset.notes),
+                ["plain", "secret"])
+
+    def test_unchanged_notes_are_not_resealed(self):
+        note = self.nset.new(body="secret")
+        note.properties["encrypted"] = True
+        first = note.extract(sealed=True)["body_enc"]
+        self.assertEqual(note.extract(sealed=True)["body_enc"], first)
+        note.update("changed")
+        self.assertNotEqual(note.extract(sealed=True)["body_enc"], first)
+
+if __name__ == '__main__':
+    unittest.main()
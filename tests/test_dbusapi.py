@@ -0,0 +1,95 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the D-Bus methods, called directly rather than over a bus.
+They need PyGObject, and are skipped without it."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from stickynotes.backend import NoteSet, dGUI
+
+try:
+    from stickynotes import dbusapi
+except (ImportError, ValueError):
+    dbusapi = None
+
+class Indicator:
+    def __init__(self, nset):
+        self.nset = nset
+        self.saves = 0
+    def schedule_save(self):
+        self.saves += 1
+
+class CountingGUI(dGUI):
+    """Dummy GUI that counts how many windows were built"""
+    built = 0
+    def __init__(self, *args, note=None, **kwargs):
+        super().__init__(note=note)
+        CountingGUI.built += 1
+
+@unittest.skipIf(dbusapi is None, "PyGObject is not available")
+class MethodTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.nset = NoteSet(CountingGUI, os.path.join(self.directory,
+            "notes"), None)
+        self.nset.loads("{}")
+        self.indicator = Indicator(self.nset)
+        # Not registered on any bus
+        self.service = dbusapi.DBusService.__new__(dbusapi.DBusService)
+        self.service.indicator = self.indicator
+        self.service.registration = None
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_new_note_builds_one_window(self):
+        CountingGUI.built = 0
+        with mock.patch.object(dbusapi, "work_areas",
+                return_value=[(0, 0, 1000, 1000)]):
+            result = self.service.do_NewNote("from a script")
+        [note] = self.nset.notes
+        self.assertEqual(result.unpack(), (note.uuid,))
+        self.assertEqual(note.body, "from a script")
+        self.assertEqual(CountingGUI.built, 1)
+        self.assertEqual(self.indicator.saves, 1)
+
+    def test_update_notes_skips_unknown(self):
+        note = self.nset.new(body="old")
+        uuid = note.extract()["uuid"]
+        result = self.service.do_UpdateNotes({uuid: "new",
+            "unknown": "ignored"})
+        self.assertEqual(result.unpack(), (1,))
+        self.assertEqual(note.body, "new")
+
+    def test_unknown_note(self):
+        with self.assertRaises(dbusapi.NoSuchNote):
+            self.service.do_GetNote("unknown")
+
+    def test_search_pages(self):
+        for i in range(3):
+            self.nset.new(body="#todo item {}".format(i))
+        total, results = self.service.do_Search("", "todo", 1, 1).unpack()
+        self.assertEqual(total, 3)
+        self.assertEqual(len(results), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of note placement and the spatial index"""
+
+import unittest
+
+from stickynotes import layout
+from stickynotes.layout import NOTE_GAP, SpatialIndex
+
+AREA = (0, 0, 1000, 800)
+
+class SpatialIndexTest(unittest.TestCase):
+    def test_query_spans_cells(self):
+        index = SpatialIndex(cell=100)
+        index.update("wide", (50, 50, 300, 20))
+        index.update("far", (900, 900, 10, 10))
+        self.assertEqual(index.query((320, 55, 5, 5)), {"wide"})
+        self.assertEqual(index.query((0, 0, 40, 40)), set())
+
+    def test_moved_and_removed_rects_leave_cells(self):
+        index = SpatialIndex(cell=100)
+        index.update("note", (0, 0, 50, 50))
+        index.update("note", (500, 500, 50, 50))
+        self.assertEqual(index.query((0, 0, 50, 50)), set())
+        index.remove("note")
+        self.assertEqual(index.cells, {})
+        self.assertEqual(index.rects, {})
+
+    def test_find_free_skips_taken_space(self):
+        index = SpatialIndex()
+        index.update("a", (NOTE_GAP, NOTE_GAP, 200, 150))
+        x, y = index.find_free((200, 150), AREA)
+        self.assertTrue(index.is_free((x, y, 200, 150)))
+        self.assertTrue(layout.contains(AREA, (x, y, 200, 150)))
+        # A free start is taken as it is
+        self.assertEqual(index.find_free((200, 150), AREA, (500, 500)),
+                (500, 500))
+
+    def test_full_area_falls_back(self):
+        index = SpatialIndex()
+        index.update("all", AREA)
+        self.assertEqual(index.find_free((200, 150), AREA, (20, 30)),
+                (20, 30))
+
+class ArrangeTest(unittest.TestCase):
+    def test_tidy_fills_rows(self):
+        positions = layout.tidy([(400, 100)] * 3, AREA)
+        self.assertEqual(positions, [(10, 10), (420, 10), (10, 120)])
+
+    def test_tidy_layers_when_full(self):
+        positions = layout.tidy([(900, 700)] * 2, AREA)
+        self.assertEqual(positions[1], (10 + layout.CASCADE_STEP,
+            10 + layout.CASCADE_STEP))
+
+    def test_cascade_stays_in_area(self):
+        for x, y in layout.cascade([(200, 150)] * 40, AREA):
+            self.assertTrue(layout.contains(AREA, (x, y, 200, 150)))
+
+if __name__ == '__main__':
+    unittest.main()
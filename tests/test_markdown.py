@@ -0,0 +1,45 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the Markdown rules. They need PyGObject, and are skipped
+without it."""
+
+import unittest
+
+try:
+    from stickynotes import markdown
+except (ImportError, ValueError):
+    markdown = None
+
+@unittest.skipIf(markdown is None, "PyGObject is not available")
+class SpansTest(unittest.TestCase):
+    def test_heading_is_not_a_tag(self):
+        self.assertEqual(markdown.spans("## Title"), [("md-h2", 0, 8)])
+        self.assertEqual(markdown.spans("#tag"), [])
+
+    def test_checkbox(self):
+        self.assertEqual(markdown.spans("- [ ] milk"),
+                [("md-checkbox", 2, 5)])
+        self.assertEqual(markdown.spans("- [x] milk"),
+                [("md-checkbox", 2, 5), ("md-done", 5, 10)])
+
+    def test_bold_and_links(self):
+        self.assertEqual(markdown.spans("a **b** http://x.org [c](d)"),
+                [("md-bold", 2, 7), ("md-link", 8, 20), ("md-link", 21, 27)])
+
+if __name__ == '__main__':
+    unittest.main()
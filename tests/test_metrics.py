@@ -0,0 +1,68 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the opt-in metrics"""
+
+import unittest
+
+from stickynotes import metrics
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        for store in (metrics._samples, metrics._events, metrics._totals):
+            store.clear()
+
+    def tearDown(self):
+        metrics.ENABLED = False
+        self.setUp()
+
+    def test_disabled_records_nothing(self):
+        metrics.record("save", 1.0)
+        metrics.count("save")
+        self.assertEqual(metrics.summary(), {})
+
+    def test_summary(self):
+        metrics.enable()
+        for value in range(1, 101):
+            metrics.record("save.bytes", value)
+        stats = metrics.summary()["save.bytes"]
+        self.assertEqual(stats["n"], 100)
+        self.assertEqual(stats["p50"], 51)
+        self.assertEqual(stats["max"], 100)
+
+    def test_windows_are_bounded(self):
+        metrics.enable()
+        for i in range(metrics.WINDOW_SIZE + 10):
+            metrics.count("merge")
+        stats = metrics.summary()["merge"]
+        self.assertEqual(stats["total"], metrics.WINDOW_SIZE + 10)
+        self.assertEqual(len(metrics._events["merge"]), metrics.WINDOW_SIZE)
+
+    def test_timed(self):
+        @metrics.timed("work")
+        def work(x):
+            return x * 2
+        self.assertEqual(work(2), 4)
+        self.assertNotIn("work", metrics.summary())
+        metrics.enable()
+        self.assertEqual(work(3), 6)
+        stats = metrics.summary()["work"]
+        self.assertEqual((stats["n"], stats["total"]), (1, 1))
+        self.assertIn("work: ", metrics.report())
+
+if __name__ == '__main__':
+    unittest.main()
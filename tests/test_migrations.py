@@ -0,0 +1,96 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the upgrades of old data, and of which data gets upgraded"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from stickynotes import migrations, transfer
+from stickynotes.backend import NoteSet, dGUI
+from stickynotes.info import SCHEMA_VERSION
+
+class UpgradeTest(unittest.TestCase):
+    def test_version_0_is_upgraded(self):
+        data = {"notes": [{"body": "live"}],
+                "archived_notes": [{"uuid": "a", "body": "gone"}]}
+        timings = migrations.upgrade(data)
+        self.assertEqual(sorted(timings), [1, 2])
+        self.assertEqual(data["version"], SCHEMA_VERSION)
+        self.assertIn("trash_retention_days", data["properties"])
+        ref = data["archived_notes"][0]["body_ref"]
+        self.assertEqual(data["archive_blobs"][ref], "gone")
+
+    def test_current_data_is_left_alone(self):
+        data = {"version": SCHEMA_VERSION,
+                "archived_notes": [{"uuid": "a", "body": "gone"}]}
+        self.assertEqual(migrations.upgrade(data), {})
+        self.assertEqual(data["archived_notes"][0]["body"], "gone")
+
+class LoadTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.nset = NoteSet(dGUI, os.path.join(self.directory, "notes"),
+                None)
+        self.nset.loads("{}")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_missing_properties_are_tolerated(self):
+        self.nset.loads(json.dumps({"version": SCHEMA_VERSION,
+            "notes": [{"body": "note"}]}))
+        self.assertEqual(self.nset.properties, {})
+        self.assertEqual([n.body for n in self.nset.notes], ["note"])
+
+    def test_current_streams_are_not_migrated(self):
+        self.nset.new(body="kept")
+        self.nset.archive_note(self.nset.new(body="archived"))
+        path = os.path.join(self.directory, "backup.jsonl")
+        for fraction in transfer.write_stream(self.nset, path):
+            pass
+        other = NoteSet(dGUI, os.path.join(self.directory, "other"), None)
+        other.loads("{}")
+        other.record_migrations()
+        for batch, fraction in transfer.read_stream(path, batch_size=1):
+            self.assertEqual(batch["version"], SCHEMA_VERSION)
+            other.merge(batch)
+        self.assertEqual(other.record_migrations(), {})
+        self.assertEqual([n.body for n in other.notes], ["kept"])
+        self.assertEqual(other.archived_note_data(
+            other.archived_notes[0])["body"], "archived")
+
+    def test_old_streams_are_migrated(self):
+        path = os.path.join(self.directory, "old.jsonl")
+        with open(path, "w") as fsock:
+            fsock.write(json.dumps({"format": transfer.STREAM_FORMAT,
+                "version": 1}) + "\n")
+            fsock.write(json.dumps({"section": "archived",
+                "data": {"uuid": "a", "body": "old"}}) + "\n")
+        self.nset.record_migrations()
+        for batch, fraction in transfer.read_stream(path):
+            self.assertNotIn("version", batch)
+            self.nset.merge(batch)
+        self.assertEqual(sorted(self.nset.record_migrations()), [1, 2])
+        self.assertEqual(self.nset.archived_note_data(
+            self.nset.archived_notes[0])["body"], "old")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+import gettext
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import setup
+except ImportError:
+    # distutils is gone from newer Pythons
+    setup = None
+
+PO = r'''msgid ""
+msgstr ""
+"Content-Type: text/plain; charset=UTF-8\n"
+"Plural-Forms: nplurals=2; plural=(n != 1);\n"
+
+msgid "New Note"
+msgstr "Neue Notiz"
+
+#, fuzzy
+msgid "Lock"
+msgstr "Sperren"
+
+msgid "Unlock"
+msgstr ""
+
+msgid "%d note"
+msgid_plural "%d notes"
+msgstr[0] "%d Notiz"
+msgstr[1] "%d Notizen"
+
+msgctxt "menu"
+msgid "Show"
+msgstr "Anzeigen"
+'''
+
+@unittest.skipIf(setup is None, "distutils is not available")
+class CompileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def compile(self, po_path):
+        mo_path = os.path.join(self.directory, "messages.mo")
+        setup.write_mo(setup.parse_po(po_path), mo_path)
+        with open(mo_path, "rb") as fsock:
+            return gettext.GNUTranslations(fsock)
+
+    def test_round_trip(self):
+        po_path = os.path.join(self.directory, "de.po")
+        with open(po_path, "w", encoding="utf-8") as fsock:
+            fsock.write(PO)
+        trans = self.compile(po_path)
+        self.assertEqual(trans.gettext("New Note"), "Neue Notiz")
+        # Fuzzy and untranslated entries fall back to the original
+        self.assertEqual(trans.gettext("Lock"), "Lock")
+        self.assertEqual(trans.gettext("Unlock"), "Unlock")
+        self.assertEqual(trans.ngettext("%d note", "%d notes", 1), "%d Notiz")
+        self.assertEqual(trans.ngettext("%d note", "%d notes", 3),
+                "%d Notizen")
+        self.assertEqual(trans.pgettext("menu", "Show"), "Anzeigen")
+
+    def test_shipped_catalogs_compile(self):
+        for po_path in sorted(os.listdir(setup.PO_DIR)):
+            if po_path.endswith(".po"):
+                self.compile(os.path.join(setup.PO_DIR, po_path))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the reminder queue and of reminders on notes"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from stickynotes import reminders
+from stickynotes.backend import NoteSet, dGUI
+from stickynotes.reminders import ReminderQueue
+
+NOW = datetime(2024, 5, 1, 12, 0, 0)
+
+class QueueTest(unittest.TestCase):
+    def test_pops_due_in_order(self):
+        queue = ReminderQueue()
+        queue.schedule("late", NOW + timedelta(hours=2))
+        queue.schedule("early", NOW - timedelta(hours=1))
+        queue.schedule("soon", NOW)
+        self.assertEqual(queue.next_due(), NOW - timedelta(hours=1))
+        self.assertEqual(queue.pop_due(NOW), ["early", "soon"])
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(queue.pop_due(NOW), [])
+
+    def test_rescheduling_and_cancelling(self):
+        queue = ReminderQueue()
+        queue.schedule("note", NOW)
+        queue.schedule("note", NOW + timedelta(days=1))
+        queue.schedule("other", NOW)
+        queue.cancel("other")
+        self.assertEqual(queue.pop_due(NOW), [])
+        self.assertEqual(queue.next_due(), NOW + timedelta(days=1))
+        queue.cancel("note")
+        self.assertIsNone(queue.next_due())
+        self.assertEqual(queue.heap, [])
+
+class AdvanceTest(unittest.TestCase):
+    def test_one_off(self):
+        self.assertIsNone(reminders.advance(reminders.make(NOW), NOW))
+
+    def test_missed_occurrences_are_skipped(self):
+        reminder = reminders.make(NOW - timedelta(days=10), repeat_days=7)
+        self.assertEqual(reminders.parse(reminders.advance(reminder, NOW)),
+                NOW + timedelta(days=4))
+
+class NoteReminderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.nset = NoteSet(dGUI, os.path.join(self.directory, "notes"),
+                None)
+        self.nset.loads("{}")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fire_reminders(self):
+        once, weekly = self.nset.new(), self.nset.new()
+        once.set_reminder(reminders.make(NOW))
+        weekly.set_reminder(reminders.make(NOW, repeat_days=7))
+        self.assertEqual(set(self.nset.fire_reminders(NOW)), {once, weekly})
+        self.assertNotIn("reminder", once.properties)
+        self.assertEqual(self.nset.reminders.next_due(),
+                NOW + timedelta(days=7))
+
+    def test_archived_notes_are_not_reminded(self):
+        note = self.nset.new()
+        note.set_reminder(reminders.make(NOW))
+        self.nset.archive_note(note)
+        self.assertEqual(self.nset.fire_reminders(NOW), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of selections and their bulk operations"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from stickynotes.backend import NoteSet, dGUI
+
+class SelectionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.nset = NoteSet(dGUI, os.path.join(self.directory, "notes"),
+                None)
+        self.nset.loads("{}")
+        self.nset.categories = {"work": {"name": "Work"}, "home": {}}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_criteria_combine(self):
+        match = self.nset.new(body="#todo Call Bob")
+        match.category = "work"
+        self.nset.new(body="#todo call Alice").category = "home"
+        self.nset.new(body="call Bob").category = "work"
+        self.assertEqual(self.nset.select(category="work", tag="todo",
+            query="bob").notes, [match])
+
+    def test_archived_notes_are_selected_by_uuid(self):
+        note = self.nset.new(body="#old")
+        self.nset.archive_note(note)
+        selection = self.nset.select(tag="old")
+        self.assertEqual(selection.notes, [])
+        self.assertEqual(selection.archived, [note.uuid])
+        selection.restore()
+        self.assertEqual([n.body for n in self.nset.notes], ["#old"])
+        self.assertEqual(self.nset.archived_notes, [])
+
+    def test_marked(self):
+        a, b = self.nset.new(), self.nset.new()
+        self.nset.marked.add(b)
+        self.assertEqual(self.nset.select(marked=True).notes, [b])
+
+    def test_bulk_operations(self):
+        notes = [self.nset.new(body="#bulk") for i in range(3)]
+        selection = self.nset.select(tag="bulk")
+        selection.set_category("work")
+        selection.lock()
+        self.assertTrue(all(n.category == "work" and
+            n.properties["locked"] for n in notes))
+        with self.assertRaises(KeyError):
+            selection.set_category("missing")
+        selection.archive()
+        self.assertEqual(self.nset.notes, [])
+        self.assertEqual(len(self.nset.archived_notes), 3)
+
+    def test_export_can_be_merged(self):
+        note = self.nset.new(body="exported")
+        note.category = "work"
+        self.nset.new(body="left out")
+        path = os.path.join(self.directory, "export.json")
+        self.nset.select(query="exported").export(path)
+        with open(path) as fsock:
+            data = json.load(fsock)
+        self.assertEqual(list(data["categories"]), ["work"])
+        other = NoteSet(dGUI, os.path.join(self.directory, "other"), None)
+        other.loads("{}")
+        other.merge(data)
+        self.assertEqual([(n.body, n.category) for n in other.notes],
+                [("exported", "work")])
+
+if __name__ == '__main__':
+    unittest.main()
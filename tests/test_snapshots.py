@@ -0,0 +1,98 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of snapshots and point-in-time restore"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from stickynotes import snapshots
+from stickynotes.backend import NoteSet, dGUI
+from stickynotes.snapshots import SnapshotStore
+
+class SnapshotStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.nset = NoteSet(dGUI, os.path.join(self.directory, "notes"),
+                None)
+        self.nset.loads("{}")
+        self.store = SnapshotStore(os.path.join(self.directory, "snapshots"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def take(self):
+        pending = self.store.prepare(self.nset)
+        if pending is not None:
+            self.store.write(pending)
+        return pending
+
+    def test_only_changes_are_stored(self):
+        note = self.nset.new(body="one")
+        other = self.nset.new(body="two")
+        self.assertEqual(set(self.take().changed), {"n:" + note.uuid,
+            "n:" + other.uuid, "m:notebooks"})
+        self.assertIsNone(self.take())
+        note.update("changed")
+        pending = self.take()
+        self.assertEqual(list(pending.changed), ["n:" + note.uuid])
+        [latest, first] = self.store.snapshots()
+        self.assertEqual((first["full"], latest["full"]), (True, False))
+
+    def test_restore_rolls_back(self):
+        self.nset.categories["cat"] = {"name": "Before"}
+        kept = self.nset.new(body="before")
+        deleted = self.nset.new(body="deleted later")
+        self.take()
+        snapshot_id = self.store.snapshots()[0]["id"]
+        kept.update("after")
+        self.nset.archive_note(deleted)
+        self.nset.categories["cat"] = {"name": "After"}
+        created = self.nset.new(body="created later")
+        self.take()
+        self.nset.restore_state(self.store.state_at(snapshot_id))
+        self.assertEqual(sorted(n.body for n in self.nset.notes),
+                ["before", "deleted later"])
+        self.assertEqual(self.nset.categories["cat"], {"name": "Before"})
+        # Notes that didn't exist then are archived, not lost
+        self.assertEqual([a["uuid"] for a in self.nset.archived_notes],
+                [created.uuid])
+
+    def test_keyframes_bound_replay(self):
+        note = self.nset.new()
+        with mock.patch.object(snapshots, "KEYFRAME_INTERVAL", 3):
+            for i in range(7):
+                note.update(str(i))
+                self.take()
+        fulls = [s["full"] for s in reversed(self.store.snapshots())]
+        self.assertEqual(fulls, [True, False, False, True, False, False,
+            True])
+        state = self.store.state_at(self.store.snapshots()[1]["id"])
+        self.assertEqual(state["n:" + note.uuid]["body"], "5")
+
+    def test_index_survives_reopening(self):
+        self.nset.new()
+        self.take()
+        store = SnapshotStore(self.store.directory)
+        self.assertEqual(store.snapshots(), self.store.snapshots())
+        self.assertIsNone(store.prepare(self.nset))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of sync sessions between note sets, over local sockets"""
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+
+from stickynotes import sync
+from stickynotes.backend import NoteSet, dGUI
+
+class SyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def new_noteset(self, name):
+        nset = NoteSet(dGUI, os.path.join(self.directory, name), None)
+        nset.loads("{}")
+        return nset
+
+def run_session(a, b, secret="secret", secret_b=None):
+    """Syncs a (initiating) with b over a socket pair. Returns the counts
+    of both sides, or the exceptions they raised."""
+    left, right = socket.socketpair()
+    results = {}
+    def _run(name, sock, nset, key, initiator):
+        try:
+            results[name] = sync.exchange(sock, nset, key, initiator)
+        except sync.SyncError as e:
+            results[name] = e
+        finally:
+            sock.close()
+    thread = threading.Thread(target=_run, args=("b", right, b,
+        secret if secret_b is None else secret_b, False))
+    thread.start()
+    _run("a", left, a, secret, True)
+    thread.join()
+    return results["a"], results["b"]
+
+class VersionTest(unittest.TestCase):
+    def test_compare(self):
+        self.assertEqual(sync.compare({"a": 1}, {"a": 1}), 0)
+        self.assertEqual(sync.compare({"a": 1}, {"a": 2}), -1)
+        self.assertEqual(sync.compare({"a": 2, "b": 1}, {"a": 2}), 1)
+        self.assertIsNone(sync.compare({"a": 2}, {"b": 1}))
+
+    def test_merge_versions(self):
+        self.assertEqual(sync.merge_versions({"a": 2, "b": 1}, {"b": 3}),
+                {"a": 2, "b": 3})
+
+class ExchangeTest(SyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.a = self.new_noteset("a")
+        self.b = self.new_noteset("b")
+
+    def test_notes_travel_both_ways(self):
+        self.a.new(body="from a")
+        self.b.new(body="from b")
+        self.assertEqual(run_session(self.a, self.b), ((1, 1), (1, 1)))
+        for nset in (self.a, self.b):
+            self.assertEqual(sorted(n.body for n in nset.notes),
+                    ["from a", "from b"])
+        # Nothing changed since, so nothing is sent again
+        self.assertEqual(run_session(self.a, self.b), ((0, 0), (0, 0)))
+
+    def test_wrong_secret_is_refused(self):
+        self.a.new(body="private")
+        a, b = run_session(self.a, self.b, secret_b="other")
+        self.assertIsInstance(b, sync.SyncError)
+        self.assertEqual(self.b.notes, [])
+
+    def test_later_concurrent_change_wins(self):
+        note = self.a.new(body="first")
+        run_session(self.a, self.b)
+        copy = self.b.notes[0]
+        note.update("a's edit")
+        note.last_modified = datetime(2020, 1, 1)
+        copy.update("b's edit")
+        copy.last_modified = datetime(2020, 1, 2)
+        run_session(self.a, self.b)
+        run_session(self.a, self.b)
+        self.assertEqual(note.body, "b's edit")
+        self.assertEqual(copy.body, "b's edit")
+
+class Indicator:
+    def __init__(self):
+        self.changed = []
+    def notes_changed(self, uuids):
+        self.changed.extend(uuids)
+
+class StampTest(SyncTestCase):
+    def test_save_stamps_only_with_sync_enabled(self):
+        nset = self.new_noteset("a")
+        nset.indicator = Indicator()
+        note = nset.new(body="local")
+        nset.save()
+        self.assertEqual(nset.sync.items, {})
+        # Changes are still announced
+        self.assertEqual(nset.indicator.changed, [note.uuid])
+        nset.properties["sync_peer"] = "localhost"
+        nset.save()
+        self.assertEqual(nset.sync.items[note.uuid]["kind"], "note")
+        self.assertEqual(nset.indicator.changed, [note.uuid])
+
+    def test_purged_notes_leave_tombstones(self):
+        a = self.new_noteset("a")
+        b = self.new_noteset("b")
+        note = a.new(body="short lived")
+        a.archive_note(note)
+        run_session(a, b)
+        a.delete_archived_note(note.uuid)
+        a.stamp_changes()
+        self.assertEqual(a.sync.items[note.uuid]["kind"], "purged")
+        # b still has the archived copy; a peer's older version is ignored
+        b.sync.items[note.uuid].pop("source")
+        self.assertEqual(run_session(a, b)[0], (0, 1))
+        self.assertEqual(a.archived_notes, [])
+        a.sync.expire("9999-01-01T00:00:00")
+        self.assertNotIn(note.uuid, a.sync.items)
+
+    def test_deleted_categories_leave_tombstones(self):
+        nset = self.new_noteset("a")
+        nset.categories["cat"] = {"name": "Work"}
+        nset.stamp_changes()
+        del nset.categories["cat"]
+        nset.stamp_changes()
+        self.assertEqual(nset.sync.items["cat"]["kind"], "purged")
+        nset.sync.expire("2000-01-01T00:00:00")
+        self.assertIn("cat", nset.sync.items)
+
+class ServeTest(SyncTestCase):
+    def test_malformed_messages_keep_server_running(self):
+        nset = self.new_noteset("served")
+        nset.new(body="served")
+        done = threading.Event()
+        server = sync.serve(nset, "secret", "127.0.0.1", 0,
+                done=lambda *counts: done.set())
+        port = server.getsockname()[1]
+        try:
+            for line in (b"[]\n", b'{"hello": 1}\n', b"null\n",
+                    b'{"hello": 1, "id": "x", "nonce": 5}\n'):
+                with socket.create_connection(("127.0.0.1", port)) as sock:
+                    sock.makefile("rb").readline()
+                    sock.sendall(line)
+                    # The server hangs up on the malformed session
+                    self.assertEqual(sock.makefile("rb").readline(), b"")
+            other = self.new_noteset("other")
+            sync.connect(other, "127.0.0.1", "secret", port)
+            self.assertTrue(done.wait(5))
+            self.assertEqual([n.body for n in other.notes], ["served"])
+        finally:
+            server.close()
+
+    def test_malformed_records_are_refused(self):
+        with self.assertRaises(sync.SyncError):
+            sync._check({"uuid": "x", "kind": "note"}, sync.RECORD)
+        with self.assertRaises(sync.SyncError):
+            sync._check(["end"], sync.END)
+
+if __name__ == '__main__':
+    unittest.main()
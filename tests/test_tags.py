@@ -0,0 +1,83 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of #tags and the tag index"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from stickynotes.backend import NoteSet, dGUI
+from stickynotes.tags import TagIndex, extract_tags
+
+class ExtractTest(unittest.TestCase):
+    def test_extract(self):
+        self.assertEqual(extract_tags("#Todo buy milk #to-do, not a#tag "
+            "or ##double or # space"), {"todo", "to-do"})
+
+class IndexTest(unittest.TestCase):
+    def test_update_and_remove(self):
+        index = TagIndex()
+        index.update("a", "#x #y")
+        index.update("b", "#y")
+        self.assertEqual(index.tags(), ["x", "y"])
+        version = index.version
+        index.update("a", "#y only")
+        self.assertEqual(index.tagged("x"), set())
+        self.assertEqual(index.tagged("y"), {"a", "b"})
+        self.assertGreater(index.version, version)
+        index.remove("a")
+        index.remove("b")
+        self.assertEqual((index.notes, index.note_tags), ({}, {}))
+
+    def test_version_only_changes_with_the_set_of_tags(self):
+        index = TagIndex()
+        index.update("a", "#x")
+        version = index.version
+        index.update("b", "#x")
+        index.update("a", "#x again")
+        self.assertEqual(index.version, version)
+
+class NoteTagTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.nset = NoteSet(dGUI, os.path.join(self.directory, "notes"),
+                None)
+        self.nset.loads("{}")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_index_follows_bodies(self):
+        note = self.nset.new(body="#work")
+        self.assertEqual(self.nset.tags.tagged("work"), {note})
+        note.update("#home")
+        self.assertEqual(self.nset.tags.tags(), ["home"])
+        self.nset.save()
+        nset = NoteSet(dGUI, self.nset.data_file, None)
+        nset.open()
+        self.assertEqual(nset.tags.tags(), ["home"])
+
+    def test_filter_by_tag_hides_others(self):
+        work, home = self.nset.new(body="#work"), self.nset.new(body="#home")
+        self.nset.filter_by_tag("work")
+        self.assertIn(home, self.nset.hidden)
+        self.assertNotIn(work, self.nset.hidden)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+# Copyright © 2012-2018 Umang Varma <umang.me@gmail.com>
+#
+# This file is part of indicator-stickynotes.
+#
+# indicator-stickynotes is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# indicator-stickynotes is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# indicator-stickynotes.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of streaming export and import"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from stickynotes import transfer
+from stickynotes.backend import NoteSet, dGUI
+
+class TransferTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.nset = self.new_noteset("notes")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def new_noteset(self, name):
+        nset = NoteSet(dGUI, os.path.join(self.directory, name), None)
+        nset.loads("{}")
+        return nset
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def export(self, name):
+        for fraction in transfer.write_stream(self.nset, self.path(name)):
+            pass
+        return self.path(name)
+
+    def import_into(self, nset, path, **kwargs):
+        for batch, fraction in transfer.read_stream(path, **kwargs):
+            nset.merge(batch)
+
+class StreamTest(TransferTestCase):
+    def fill(self):
+        self.nset.categories["cat"] = {"name": "Work"}
+        for i in range(5):
+            note = self.nset.new(body="note {}".format(i))
+            note.category = "cat"
+        self.nset.archive_note(self.nset.notes[0])
+
+    def check_copy(self, path):
+        self.assertTrue(transfer.is_stream_file(path))
+        copy = self.new_noteset("copy")
+        self.import_into(copy, path, batch_size=2)
+        self.assertEqual(copy.categories, self.nset.categories)
+        self.assertEqual(sorted(n.body for n in copy.notes),
+                ["note {}".format(i) for i in range(1, 5)])
+        self.assertEqual({n.category for n in copy.notes}, {"cat"})
+        self.assertEqual([copy.archived_note_data(a)["body"]
+            for a in copy.archived_notes], ["note 0"])
+
+    def test_round_trip(self):
+        self.fill()
+        self.check_copy(self.export("backup.jsonl"))
+
+    def test_round_trip_gzip(self):
+        self.fill()
+        path = self.export("backup.jsonl.gz")
+        with open(path, "rb") as fsock:
+            self.assertEqual(fsock.read(2), transfer.GZIP_MAGIC)
+        self.check_copy(path)
+
+    def test_closing_export_leaves_no_file(self):
+        for i in range(transfer.EXPORT_CHUNK_SIZE + 1):
+            self.nset.new()
+        steps = transfer.write_stream(self.nset, self.path("partial.jsonl"))
+        next(steps)
+        steps.close()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_not_a_stream(self):
+        with open(self.path("other.jsonl"), "w") as fsock:
+            fsock.write('{"notes": []}\n')
+        with self.assertRaises(ValueError):
+            list(transfer.read_stream(self.path("other.jsonl")))
+
+    def test_stream_paths(self):
+        self.assertTrue(transfer.is_stream_path("Backup.JSONL.GZ"))
+        self.assertFalse(transfer.is_stream_path("backup.json"))
+
+class FileTest(TransferTestCase):
+    def test_data_file_in_batches(self):
+        self.nset.categories["cat"] = {"name": "Work"}
+        for i in range(5):
+            self.nset.new(body=str(i))
+        self.nset.save()
+        batches = [batch for batch, fraction in transfer.read_file(
+            self.nset.data_file, batch_size=2)]
+        # Categories come first, on their own
+        self.assertEqual(list(batches[0]), ["version", "categories"])
+        self.assertEqual([len(b["notes"]) for b in batches[1:]], [2, 2, 1])
+        copy = self.new_noteset("copy")
+        for batch in batches:
+            copy.merge(batch)
+        self.assertEqual(sorted(n.body for n in copy.notes),
+                [str(i) for i in range(5)])
+
+class ReportTest(TransferTestCase):
+    def test_malformed_records_are_skipped(self):
+        path = self.path("damaged.jsonl")
+        with open(path, "w") as fsock:
+            fsock.write('{"format": "%s", "version": 1}\n'
+                    % transfer.STREAM_FORMAT)
+            fsock.write('{"section": "note", "data": {"body": "one"}}\n')
+            fsock.write('{"section": "note", "data": \n')
+            fsock.write('{"section": "note", "data": "not a note"}\n')
+            fsock.write('{"section": "note", "data": {"body": "two"}}\n')
+        report = transfer.TransferReport(path)
+        self.import_into(self.nset, path, report=report)
+        self.assertEqual(sorted(n.body for n in self.nset.notes),
+                ["one", "two"])
+        self.assertEqual(report.records, 2)
+        self.assertEqual(report.skipped, 2)
+        self.assertEqual([line for line, message in report.errors], [3, 4])
+        self.assertFalse(report.ok)
+
+    def test_errors_listed_are_capped(self):
+        report = transfer.TransferReport("path")
+        for line in range(transfer.REPORT_MAX_ERRORS + 5):
+            report.skip(line, "bad")
+        self.assertEqual(len(report.errors), transfer.REPORT_MAX_ERRORS)
+        self.assertEqual(report.skipped, transfer.REPORT_MAX_ERRORS + 5)
+
+class CopyTest(TransferTestCase):
+    def setUp(self):
+        super().setUp()
+        with open(self.path("src"), "wb") as fsock:
+            fsock.write(b"x" * (transfer.COPY_CHUNK_SIZE * 2 + 1))
+
+    def test_copy(self):
+        fractions = list(transfer.copy_file(self.path("src"),
+            self.path("dst")))
+        self.assertEqual(fractions[-1], 1.0)
+        self.assertEqual(os.path.getsize(self.path("dst")),
+                os.path.getsize(self.path("src")))
+
+    def test_cancelled_copy_leaves_nothing(self):
+        cancel = threading.Event()
+        copying = transfer.copy_file(self.path("src"), self.path("dst"),
+                cancel)
+        next(copying)
+        cancel.set()
+        with self.assertRaises(transfer.Cancelled):
+            list(copying)
+        self.assertEqual(os.listdir(self.directory), ["src"])
+
+if __name__ == '__main__':
+    unittest.main()